@@ -0,0 +1,80 @@
+"""
+Batch Scoring DAG
+Scores a directory or MinIO prefix with the production model and writes
+Parquet results (see scripts/batch_score.py). Rerunning with the same source
+and output resumes from the last finished part.
+Uses the road-mark-pipeline image built by ml_training_pipeline.
+"""
+
+import os
+from datetime import datetime, timedelta
+from airflow import DAG
+from airflow.models.param import Param
+from airflow.providers.docker.operators.docker import DockerOperator
+from docker.types import Mount
+
+# Get the project root directory from environment variable
+PROJECT_ROOT = os.getenv("PROJECT_ROOT_PATH")
+if not PROJECT_ROOT:
+    raise ValueError("PROJECT_ROOT_PATH environment variable is not set")
+
+# Default arguments for the DAG
+default_args = {
+    "owner": "airflow",
+    "depends_on_past": False,
+    "start_date": datetime(2025, 1, 1),
+    "email_on_failure": False,
+    "email_on_retry": False,
+    # A retry resumes where the failed attempt stopped
+    "retries": 2,
+    "retry_delay": timedelta(minutes=2),
+}
+
+with DAG(
+    "batch_scoring",
+    default_args=default_args,
+    description="Score a dataset with the production YOLO model",
+    schedule_interval=None,  # Manual trigger only
+    catchup=False,
+    params={
+        "source": Param("s3://datasets/images", type="string"),
+        "output": Param("s3://scores/images", type="string"),
+        "batch_size": Param(32, type="integer"),
+    },
+    tags=["ml", "yolo", "inference", "mlflow"],
+) as dag:
+
+    batch_score = DockerOperator(
+        task_id="batch_score",
+        image="road-mark-pipeline:latest",
+        api_version="auto",
+        auto_remove=True,
+        command=[
+            "bash",
+            "-c",
+            """
+            cd /workspace
+            python scripts/batch_score.py
+            echo "✅ Batch scoring completed successfully"
+            """,
+        ],
+        docker_url="unix://var/run/docker.sock",
+        network_mode="road-mark-detection-mlflow_default",
+        mounts=[
+            Mount(
+                source=os.path.join(PROJECT_ROOT, "runs"),
+                target="/workspace/runs",
+                type="bind",
+            )
+        ],
+        mount_tmp_dir=False,
+        environment={
+            "MLFLOW_TRACKING_URI": "http://mlflow:5000",
+            "MLFLOW_S3_ENDPOINT_URL": "http://minio:9000",
+            "AWS_ACCESS_KEY_ID": "minio",
+            "AWS_SECRET_ACCESS_KEY": "minio123",
+            "SCORE_SOURCE": "{{ params.source }}",
+            "SCORE_OUTPUT": "{{ params.output }}",
+            "SCORE_BATCH_SIZE": "{{ params.batch_size }}",
+        },
+    )
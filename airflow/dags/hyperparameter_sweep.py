@@ -0,0 +1,174 @@
+"""
+Hyperparameter Sweep DAG
+Trains several YOLO configurations in parallel, each as an MLflow child run
+of one sweep run, stops trials that fall behind the others early, then logs
+and registers the best one (see scripts/sweep.py).
+
+Trials run in the "yolo_training" pool, created by airflow-init with one
+slot per SWEEP_TRIAL_CPUS cores and SWEEP_TRIAL_MEMORY_MB of RAM of the
+host, and each trial container is limited to that many CPUs and that much
+memory. scripts/road_mark_detection.py sizes batch, dataloader workers and
+torch threads from those container limits rather than the whole host.
+"""
+
+import os
+from datetime import datetime, timedelta
+from airflow import DAG
+from airflow.decorators import task
+from airflow.models.param import Param
+from airflow.providers.docker.operators.docker import DockerOperator
+from docker.types import Mount
+
+# Get the project root directory from environment variable
+PROJECT_ROOT = os.getenv("PROJECT_ROOT_PATH")
+if not PROJECT_ROOT:
+    raise ValueError("PROJECT_ROOT_PATH environment variable is not set")
+
+TRIAL_CPUS = int(os.getenv("SWEEP_TRIAL_CPUS", "4"))
+TRIAL_MEMORY_MB = int(os.getenv("SWEEP_TRIAL_MEMORY_MB", "4096"))
+TRAINING_POOL = "yolo_training"
+
+MLFLOW_ENV = {
+    "MLFLOW_TRACKING_URI": "http://mlflow:5000",
+    "MLFLOW_S3_ENDPOINT_URL": "http://minio:9000",
+    "AWS_ACCESS_KEY_ID": "minio",
+    "AWS_SECRET_ACCESS_KEY": "minio123",
+}
+
+SWEEP_ENV = {
+    **MLFLOW_ENV,
+    "SWEEP_METRIC": "{{ params.metric }}",
+    "SWEEP_MODE": "{{ params.mode }}",
+    "SWEEP_MIN_EPOCHS": "{{ params.min_epochs }}",
+}
+
+RUNS_MOUNT = [
+    Mount(
+        source=os.path.join(PROJECT_ROOT, "runs"),
+        target="/workspace/runs",
+        type="bind",
+    )
+]
+
+# Default arguments for the DAG
+default_args = {
+    "owner": "airflow",
+    "depends_on_past": False,
+    "start_date": datetime(2025, 1, 1),
+    "email_on_failure": False,
+    "email_on_retry": False,
+    "retries": 1,
+    "retry_delay": timedelta(minutes=5),
+}
+
+
+def sweep_step(task_id: str, script: str, **kwargs) -> DockerOperator:
+    return DockerOperator(
+        task_id=task_id,
+        image="road-mark-pipeline:latest",
+        api_version="auto",
+        auto_remove=True,
+        command=["bash", "-c", f"cd /workspace && {script}"],
+        docker_url="unix://var/run/docker.sock",
+        network_mode="road-mark-detection-mlflow_default",
+        mounts=RUNS_MOUNT,
+        mount_tmp_dir=False,
+        **kwargs,
+    )
+
+
+with DAG(
+    "hyperparameter_sweep",
+    default_args=default_args,
+    description="Parallel YOLO hyperparameter sweep with MLflow child runs",
+    schedule_interval=None,  # Manual trigger only
+    catchup=False,
+    params={
+        # Train arguments per trial (any TRAIN_* setting of
+        # scripts/road_mark_detection.py)
+        "trials": Param(
+            [
+                {"model": "weights/yolov8n.pt", "imgsz": 480, "epochs": 20},
+                {"model": "weights/yolov8n.pt", "imgsz": 640, "epochs": 20},
+                {"model": "yolov8s.pt", "imgsz": 480, "epochs": 20},
+                {"model": "yolov8s.pt", "imgsz": 640, "epochs": 20},
+            ],
+            type="array",
+        ),
+        "metric": Param("metrics/mAP50-95B", type="string"),
+        "mode": Param("max", enum=["max", "min"]),
+        "min_epochs": Param(3, type="integer"),
+    },
+    tags=["ml", "yolo", "training", "mlflow", "sweep"],
+) as dag:
+
+    # Parent MLflow run; its id is the last line of output (XCom)
+    start_sweep = sweep_step(
+        "start_sweep",
+        "python scripts/sweep.py start",
+        environment=SWEEP_ENV,
+        do_xcom_push=True,
+    )
+
+    @task
+    def make_trials(parent_run_id: str, params=None) -> list:
+        """One container environment per trial."""
+        trials = []
+        for i, trial in enumerate(params["trials"]):
+            env = {f"TRAIN_{k.upper()}": str(v) for k, v in trial.items()}
+            env.setdefault("TRAIN_WORKERS", str(max(1, TRIAL_CPUS - 1)))
+            env["TRAIN_NAME"] = f"sweep_{i:02d}"
+            env["SWEEP_PARENT_RUN_ID"] = parent_run_id.strip()
+            env["SWEEP_METRIC"] = params["metric"]
+            env["SWEEP_MODE"] = params["mode"]
+            env["SWEEP_MIN_EPOCHS"] = str(params["min_epochs"])
+            trials.append({**MLFLOW_ENV, **env})
+        return trials
+
+    # Mapped over the trials; the pool bounds how many train at once
+    train_trial = DockerOperator.partial(
+        task_id="train_trial",
+        image="road-mark-pipeline:latest",
+        api_version="auto",
+        auto_remove=True,
+        command=["bash", "-c", "cd /workspace && python scripts/sweep.py trial"],
+        docker_url="unix://var/run/docker.sock",
+        network_mode="road-mark-detection-mlflow_default",
+        mounts=RUNS_MOUNT,
+        mount_tmp_dir=False,
+        pool=TRAINING_POOL,
+        cpus=float(TRIAL_CPUS),
+        mem_limit=f"{TRIAL_MEMORY_MB}m",
+        retries=0,
+    ).expand(environment=make_trials(start_sweep.output))
+
+    # Best trial's run directory (XCom), once every trial has ended
+    select_best = sweep_step(
+        "select_best",
+        "python scripts/sweep.py select",
+        environment={
+            **SWEEP_ENV,
+            "SWEEP_PARENT_RUN_ID": (
+                "{{ ti.xcom_pull(task_ids='start_sweep') | trim }}"
+            ),
+        },
+        do_xcom_push=True,
+        trigger_rule="all_done",
+    )
+
+    log_model = sweep_step(
+        "log_model",
+        "python scripts/log_model.py",
+        environment={
+            **MLFLOW_ENV,
+            "TRAIN_DIR": "{{ ti.xcom_pull(task_ids='select_best') | trim }}",
+        },
+    )
+
+    register_model = sweep_step(
+        "register_model",
+        "python scripts/register_model.py",
+        environment=MLFLOW_ENV,
+    )
+
+    start_sweep >> train_trial >> select_best >> log_model >> register_model
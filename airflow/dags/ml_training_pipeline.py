@@ -2,12 +2,21 @@
 ML Training Pipeline DAG
 Orchestrates YOLO training, model logging, and model registration.
 Each step runs in a Docker container and only proceeds if the previous step succeeds.
+
+Steps whose inputs haven't changed are skipped: the pipeline image is only
+rebuilt when its Dockerfile, scripts or weights change, and
+scripts/pipeline_plan.py fingerprints code, hyperparameters and data to
+either re-register an earlier run that trained on exactly the same inputs,
+warm-start from the production model when images were only added, or train
+from scratch.
 """
 
+import json
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
 from airflow import DAG
+from airflow.decorators import task
 from airflow.providers.docker.operators.docker import DockerOperator
 from docker.types import Mount
 
@@ -37,13 +46,38 @@ with DAG(
     tags=["ml", "yolo", "training", "mlflow"],
 ) as dag:
 
-    # Task 0: Build Docker image
+    # Task 0: Build Docker image, unless one with the same fingerprint exists.
+    # The image fingerprint covers everything the image COPYs or installs;
+    # the environment one only Dockerfile.pipeline, whose inline pip list
+    # is the image's environment (requirements.txt belongs to the API).
+    # The last line ({"image": ..., "environment": ...}) is pushed to XCom.
     build_image = DockerOperator(
         task_id="build_image",
         image="docker:latest",
         api_version="auto",
         auto_remove=True,
-        command="build -t road-mark-pipeline:latest -f Dockerfile.pipeline .",
+        command=[
+            "sh",
+            "-c",
+            """
+            set -e
+            fp_image=$(find Dockerfile.pipeline scripts weights -type f \
+                -not -path '*/__pycache__/*' | sort | xargs sha256sum \
+                | sha256sum | cut -c1-16)
+            fp_env=$(sha256sum Dockerfile.pipeline | cut -c1-16)
+            current=$(docker image inspect road-mark-pipeline:latest 2>/dev/null \
+                | grep -o '"fingerprint": *"[0-9a-f]*"' | head -n1 \
+                | cut -d'"' -f4 || true)
+            if [ "$current" = "$fp_image" ]; then
+                echo "♻️ road-mark-pipeline:latest is up to date ($fp_image)"
+            else
+                docker build -t road-mark-pipeline:latest \
+                    --label fingerprint=$fp_image -f Dockerfile.pipeline .
+            fi
+            printf '{"image": "%s", "environment": "%s"}\\n' $fp_image $fp_env
+            """,
+        ],
+        do_xcom_push=True,
         docker_url="unix://var/run/docker.sock",
         network_mode="road-mark-detection-mlflow_default",
         mounts=[
@@ -61,7 +95,73 @@ with DAG(
         working_dir="/workspace",
     )
 
-    # Task 1: Train YOLO model
+    # Task 1: Fingerprint the inputs and decide between reuse, warm start and
+    # training from scratch (the plan is the last line of output, in XCom)
+    plan_pipeline = DockerOperator(
+        task_id="plan_pipeline",
+        image="road-mark-pipeline:latest",
+        api_version="auto",
+        auto_remove=True,
+        command=["bash", "-c", "cd /workspace && python scripts/pipeline_plan.py"],
+        docker_url="unix://var/run/docker.sock",
+        network_mode="road-mark-detection-mlflow_default",
+        mounts=[
+            Mount(
+                source=os.path.join(PROJECT_ROOT, "runs"),
+                target="/workspace/runs",
+                type="bind",
+            )
+        ],
+        mount_tmp_dir=False,
+        environment={
+            "MLFLOW_TRACKING_URI": "http://mlflow:5000",
+            "MLFLOW_S3_ENDPOINT_URL": "http://minio:9000",
+            "AWS_ACCESS_KEY_ID": "minio",
+            "AWS_SECRET_ACCESS_KEY": "minio123",
+            "PIPELINE_IMAGE": "{{ ti.xcom_pull(task_ids='build_image') }}",
+        },
+        do_xcom_push=True,
+    )
+
+    @task.branch
+    def choose_path(plan: str) -> str:
+        """Skip straight to registration when an earlier run can be reused."""
+        if json.loads(plan)["action"] == "reuse":
+            return "register_model"
+        return "prepare_dataset"
+
+    # Task 2: Decode the dataset once into a memory-mapped store (no-op when
+    # the data hasn't changed since the last run)
+    prepare_dataset = DockerOperator(
+        task_id="prepare_dataset",
+        image="road-mark-pipeline:latest",
+        api_version="auto",
+        auto_remove=True,
+        command=[
+            "bash",
+            "-c",
+            """
+            cd /workspace
+            python scripts/prepare_dataset.py
+            echo "✅ Dataset preparation completed successfully"
+            """,
+        ],
+        docker_url="unix://var/run/docker.sock",
+        network_mode="road-mark-detection-mlflow_default",
+        mounts=[
+            Mount(
+                source=os.path.join(PROJECT_ROOT, "runs"),
+                target="/workspace/runs",
+                type="bind",
+            )
+        ],
+        mount_tmp_dir=False,
+        environment={
+            "DATASET_CACHE_DIR": "/workspace/runs/dataset_cache",
+        },
+    )
+
+    # Task 3: Train YOLO model (from production weights on a warm start)
     train_yolo = DockerOperator(
         task_id="train_yolo",
         image="road-mark-pipeline:latest",
@@ -91,10 +191,12 @@ with DAG(
             "MLFLOW_S3_ENDPOINT_URL": "http://minio:9000",
             "AWS_ACCESS_KEY_ID": "minio",
             "AWS_SECRET_ACCESS_KEY": "minio123",
+            "DATASET_CACHE_DIR": "/workspace/runs/dataset_cache",
+            "PIPELINE_PLAN": "{{ ti.xcom_pull(task_ids='plan_pipeline') }}",
         },
     )
 
-    # Task 2: Log model to MLflow
+    # Task 4: Log model to MLflow
     log_model = DockerOperator(
         task_id="log_model",
         image="road-mark-pipeline:latest",
@@ -127,7 +229,8 @@ with DAG(
         },
     )
 
-    # Task 3: Register model and promote to Production
+    # Task 5: Register model and promote to Production (the reused run's, if
+    # training was skipped) when it passes the promotion gate
     register_model = DockerOperator(
         task_id="register_model",
         image="road-mark-pipeline:latest",
@@ -144,15 +247,31 @@ with DAG(
         ],
         docker_url="unix://var/run/docker.sock",
         network_mode="road-mark-detection-mlflow_default",
-        mounts=[],
+        # Same data as training, for the promotion gate's benchmark
+        mounts=[
+            Mount(
+                source=os.path.join(PROJECT_ROOT, "runs"),
+                target="/workspace/runs",
+                type="bind",
+            )
+        ],
         mount_tmp_dir=False,
         environment={
             "MLFLOW_TRACKING_URI": "http://mlflow:5000",
             "MLFLOW_S3_ENDPOINT_URL": "http://minio:9000",
             "AWS_ACCESS_KEY_ID": "minio",
             "AWS_SECRET_ACCESS_KEY": "minio123",
+            "REGISTER_RUN_ID": (
+                "{% set plan = macros.json.loads("
+                "ti.xcom_pull(task_ids='plan_pipeline')) %}"
+                "{{ plan.run_id if plan.action == 'reuse' else '' }}"
+            ),
         },
+        trigger_rule="none_failed_min_one_success",
     )
 
-    # Define task dependencies (sequential execution)
-    build_image >> train_yolo >> log_model >> register_model
+    # Define task dependencies
+    path = choose_path(plan_pipeline.output)
+    build_image >> plan_pipeline >> path
+    path >> prepare_dataset >> train_yolo >> log_model >> register_model
+    path >> register_model
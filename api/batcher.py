@@ -0,0 +1,232 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional
+
+from api.metrics import BATCH_SIZE, BATCH_QUEUE_WAIT, INFERENCE_QUEUE_DEPTH
+from api.workers import InferencePool, QueueFullError
+
+
+class BatchItemResult(NamedTuple):
+    result: Any
+    batch_size: int
+    queue_wait: float
+    inference_time: float
+
+
+class _Pending(NamedTuple):
+    item: Any
+    future: asyncio.Future
+    enqueued_at: float
+
+
+# =========================
+# MICRO-BATCHER
+# =========================
+class MicroBatcher:
+    """Coalesce concurrent requests into a single batched forward pass.
+
+    Requests are collected until either ``max_batch_size`` items are queued
+    or ``max_wait_ms`` has elapsed since the first one arrived, then
+    ``predict_fn`` is called once with the whole list on ``pool``.
+    ``predict_fn`` must return one result per input, in order.
+
+    At most ``max_queue_size`` requests may wait for a worker; beyond that
+    ``submit`` raises ``QueueFullError`` so callers can shed load.
+
+    With ``key_fn``, only items with equal keys (e.g. the same input shape)
+    share a batch. Items with other keys that arrive meanwhile are held back
+    and the oldest of them starts the next batch, so no key starves.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[Any]], List[Any]],
+        pool: InferencePool,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 64,
+        retry_after: int = 1,
+        key_fn: Optional[Callable[[Any], Hashable]] = None,
+    ):
+        self.predict_fn = predict_fn
+        self.pool = pool
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue_size = max(1, max_queue_size)
+        self.retry_after = retry_after
+        self.key_fn = key_fn
+        self._held: deque = deque()
+        self._depth = INFERENCE_QUEUE_DEPTH.labels(pool=pool.name)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._space: Optional[asyncio.Event] = None
+        self._batches = set()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._slots = asyncio.Semaphore(self.pool.num_workers)
+        self._space = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # Let running batches finish, then fail anything still queued
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        while self._held or not self._queue.empty():
+            pending = self._held.popleft() if self._held else self._get_nowait()
+            self._depth.dec()
+            if not pending.future.done():
+                pending.future.set_exception(RuntimeError("Batcher stopped"))
+        # Wake submitters blocked on a full queue so they fail too
+        self._space.set()
+
+    @property
+    def queue_depth(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._held)
+
+    async def submit(self, item: Any, block: bool = False) -> BatchItemResult:
+        """Queue ``item`` and wait for its result.
+
+        With ``block`` set, a full queue makes the caller wait for space
+        instead of raising ``QueueFullError``; bulk endpoints use this to
+        apply backpressure to themselves rather than to their client.
+        """
+        if self._task is None:
+            raise RuntimeError("Batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        pending = _Pending(item, future, time.perf_counter())
+        # Held-back items left the asyncio queue but still wait for a worker,
+        # so they count against max_queue_size too
+        while self.queue_depth >= self.max_queue_size:
+            if not block:
+                raise QueueFullError(retry_after=self.retry_after)
+            self._space.clear()
+            await self._space.wait()
+            if self._task is None:
+                raise RuntimeError("Batcher stopped")
+        self._queue.put_nowait(pending)
+        self._depth.inc()
+        return await future
+
+    def _get_nowait(self) -> _Pending:
+        return self._queue.get_nowait()
+
+    def _key(self, pending: _Pending) -> Hashable:
+        return self.key_fn(pending.item) if self.key_fn else None
+
+    def _room(self, batch: List[_Pending]) -> bool:
+        # Stop pulling from the queue once the batch is full, or once enough
+        # other-key items are held back to bound the memory they pin
+        return (
+            len(batch) < self.max_batch_size
+            and len(self._held) < self.max_queue_size
+        )
+
+    def _offer(self, batch: List[_Pending], key: Hashable, pending: _Pending):
+        """Add ``pending`` to the batch if its key matches, else hold it back."""
+        if self._key(pending) == key:
+            batch.append(pending)
+        else:
+            self._held.append(pending)
+
+    async def _collect(self) -> List[_Pending]:
+        loop = asyncio.get_running_loop()
+        first = self._held.popleft() if self._held else await self._queue.get()
+        key = self._key(first)
+        batch = [first]
+
+        # Held-back items with this key go first, in arrival order
+        for pending in list(self._held):
+            if len(batch) >= self.max_batch_size:
+                break
+            if self._key(pending) == key:
+                self._held.remove(pending)
+                batch.append(pending)
+
+        deadline = loop.time() + self.max_wait
+        try:
+            while self._room(batch):
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._offer(batch, key, pending)
+        except BaseException:
+            # Stopped mid-collection: keep the items so stop() can fail them
+            self._held.extendleft(reversed(batch))
+            raise
+
+        # Anything that arrived while we were waiting rides along for free
+        while self._room(batch) and not self._queue.empty():
+            self._offer(batch, key, self._get_nowait())
+
+        self._depth.dec(len(batch))
+        self._space.set()
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker first: while all workers are busy the
+            # queue keeps filling, so batches grow with load
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._dispatch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _dispatch(self, batch: List[_Pending]):
+        try:
+            dispatched_at = time.perf_counter()
+            BATCH_SIZE.observe(len(batch))
+            for pending in batch:
+                BATCH_QUEUE_WAIT.observe(dispatched_at - pending.enqueued_at)
+
+            try:
+                inference_start = time.perf_counter()
+                results = await self.pool.run(
+                    self.predict_fn, [p.item for p in batch]
+                )
+                inference_time = time.perf_counter() - inference_start
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"Expected {len(batch)} results, got {len(results)}"
+                    )
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                return
+
+            for pending, result in zip(batch, results):
+                if not pending.future.done():
+                    pending.future.set_result(
+                        BatchItemResult(
+                            result=result,
+                            batch_size=len(batch),
+                            queue_wait=dispatched_at - pending.enqueued_at,
+                            inference_time=inference_time,
+                        )
+                    )
+        finally:
+            self._slots.release()
@@ -0,0 +1,85 @@
+"""
+Gunicorn config for multi-process serving.
+
+The master imports the app and loads the model once (preload_app), then
+forks API_WORKERS uvicorn workers that share the weights copy-on-write, so
+memory per extra worker stays close to constant. Each worker hot-swaps on
+its own when the alias moves, so after the first swap every worker holds
+its own copy of the weights until the server is restarted.
+
+Usage:
+    gunicorn -c api/gunicorn_conf.py api.main:app
+"""
+
+import os
+import shutil
+
+# =========================
+# CONFIG
+# =========================
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+API_CPU_AFFINITY = os.getenv("API_CPU_AFFINITY", "false").lower() == "true"
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus")
+
+bind = os.getenv("API_BIND", "0.0.0.0:8000")
+workers = API_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("API_TIMEOUT", "120"))
+
+# prometheus_client picks multiprocess mode from the environment at import
+# time, so this must be set before the app (and prometheus_client) is loaded
+if API_WORKERS > 1:
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = PROMETHEUS_MULTIPROC_DIR
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# =========================
+# SERVER HOOKS
+# =========================
+def when_ready(server):
+    # Runs in the master after the app is imported and before any fork
+    from api import main
+
+    main.load_model()
+    # The master never exits, so its live gauges (api_model_info, warmup
+    # times) would be reported forever; workers publish their own after fork
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def post_fork(server, worker):
+    from api import main
+
+    main.models.publish()
+
+    cores = _available_cores()
+    slot = (worker.age - 1) % API_WORKERS
+    per_worker = max(1, len(cores) // API_WORKERS)
+
+    if API_CPU_AFFINITY and hasattr(os, "sched_setaffinity"):
+        # Pin each worker to its own contiguous slice of cores
+        start = (slot * per_worker) % len(cores)
+        worker_cores = cores[start : start + per_worker]
+        os.sched_setaffinity(0, worker_cores)
+        server.log.info(f"Worker {worker.pid} pinned to cores {worker_cores}")
+    elif not main.torch_threads:
+        # Unpinned workers share every core; split this worker's share between
+        # all its inference threads (interactive and jobs pools)
+        main.torch_threads = max(1, per_worker // main.INFERENCE_THREADS)
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
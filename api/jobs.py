@@ -0,0 +1,522 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from api.metrics import JOB_IMAGES, JOBS
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = (
+    "queued",
+    "running",
+    "succeeded",
+    "failed",
+    "cancelled",
+)
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+
+class JobRequest(BaseModel):
+    inputs: List[str]  # s3://bucket/key URIs or paths under files_root
+    output_format: str = "jsonl"
+    resolution: str = "full"
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    inputs: List[str]
+    output_format: str
+    resolution: str
+    created_at: float
+    updated_at: float
+    processed: int = 0
+    failed: int = 0
+    output_uri: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def total(self) -> int:
+        return len(self.inputs)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "progress": self.processed / self.total if self.total else 1.0,
+            "output_format": self.output_format,
+            "output_uri": self.output_uri,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+# =========================
+# JOB STORE
+# =========================
+class JobStore:
+    """Jobs and their progress in SQLite, shared by all worker processes.
+
+    A job is claimed by flipping it to running in a single UPDATE, so two
+    processes never run the same job. Running jobs refresh ``updated_at`` as
+    they progress; one whose heartbeat is older than ``stale_after`` (its
+    process died or the API restarted) can be claimed again and resumes
+    from its last recorded position.
+    """
+
+    def __init__(self, path: str, stale_after: float = 300.0):
+        self.path = path
+        self.stale_after = stale_after
+        self._created = False
+        self._create_lock = threading.Lock()
+
+    def _create(self):
+        # On first use rather than in __init__, so importing the API (which
+        # builds the store at module level) touches no files
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    inputs TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    resolution TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    output_uri TEXT,
+                    error TEXT,
+                    owner TEXT
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        finally:
+            db.close()
+
+    @contextmanager
+    def _connect(self):
+        if not self._created:
+            with self._create_lock:
+                if not self._created:
+                    self._create()
+                    self._created = True
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _job(row) -> Job:
+        return Job(
+            id=row["id"],
+            status=row["status"],
+            inputs=json.loads(row["inputs"]),
+            output_format=row["output_format"],
+            resolution=row["resolution"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            processed=row["processed"],
+            failed=row["failed"],
+            output_uri=row["output_uri"],
+            error=row["error"],
+        )
+
+    def create(self, request: JobRequest) -> Job:
+        now = time.time()
+        job = Job(
+            id=uuid.uuid4().hex,
+            status=QUEUED,
+            inputs=list(request.inputs),
+            output_format=request.output_format,
+            resolution=request.resolution,
+            created_at=now,
+            updated_at=now,
+        )
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, inputs, output_format, resolution,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job.id,
+                    job.status,
+                    json.dumps(job.inputs),
+                    job.output_format,
+                    job.resolution,
+                    now,
+                    now,
+                ),
+            )
+        JOBS.labels(status=QUEUED).inc()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def claim(self, owner: str) -> Optional[Job]:
+        """Take the oldest queued (or abandoned running) job, if any."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = ?"
+                " OR (status = ? AND updated_at < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now - self.stale_after),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, owner, now, row["id"]),
+            )
+            db.execute("COMMIT")
+        job = self._job(row)
+        job.status = RUNNING
+        return job
+
+    def progress(self, job_id: str, owner: str, processed: int, failed: int) -> bool:
+        """Record progress; False if the job was cancelled or reclaimed by
+        another runner meanwhile (its heartbeat went stale)."""
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE jobs SET processed = ?, failed = ?, updated_at = ?"
+                " WHERE id = ? AND status = ? AND owner = ?",
+                (processed, failed, time.time(), job_id, RUNNING, owner),
+            ).rowcount
+        return updated == 1
+
+    def finish(
+        self,
+        job_id: str,
+        owner: str,
+        status: str,
+        output_uri: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Settle the job; False (and no change) if ``owner`` no longer runs it."""
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, output_uri = ?, error = ?,"
+                " updated_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                (status, output_uri, error, time.time(), job_id, RUNNING, owner),
+            ).rowcount
+        if updated:
+            JOBS.labels(status=status).inc()
+        return updated == 1
+
+    def cancel(self, job_id: str) -> bool:
+        with self._connect() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?"
+                " WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+            ).rowcount
+        if updated:
+            JOBS.labels(status=CANCELLED).inc()
+        return updated == 1
+
+
+# =========================
+# OBJECT STORAGE
+# =========================
+class ObjectStore:
+    """Read inputs and write results by URI.
+
+    ``s3://bucket/key`` goes to S3/MinIO, unless ``local_root`` is set, in
+    which case it maps to ``local_root/bucket/key`` (a stand-in for running
+    without MinIO). Anything else is a local path, which job inputs may only
+    use under ``files_root``: clients must not be able to read arbitrary
+    files of the server. Without ``files_root`` local inputs are refused.
+    """
+
+    def __init__(
+        self, local_root: Optional[str] = None, files_root: Optional[str] = None
+    ):
+        self.local_root = Path(local_root).resolve() if local_root else None
+        self.files_root = Path(files_root).resolve() if files_root else None
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                import boto3
+
+                self._client = boto3.client(
+                    "s3", endpoint_url=os.getenv("MLFLOW_S3_ENDPOINT_URL")
+                )
+            return self._client
+
+    @staticmethod
+    def _split(uri: str) -> Tuple[str, str]:
+        bucket, _, key = uri[len("s3://") :].partition("/")
+        return bucket, key
+
+    @staticmethod
+    def _inside(root: Path, path: Path) -> Path:
+        # Relative paths are taken from root; ".." and symlinks are resolved
+        # before the check
+        resolved = (root / path).resolve()
+        if resolved != root and root not in resolved.parents:
+            raise ValueError(f"{path} is outside {root}")
+        return resolved
+
+    def _local(self, uri: str, untrusted: bool = False) -> Optional[Path]:
+        if not uri.startswith("s3://"):
+            if not untrusted:
+                return Path(uri)
+            if self.files_root is None:
+                raise ValueError("Local input paths are disabled")
+            return self._inside(self.files_root, Path(uri))
+        if self.local_root is not None:
+            bucket, key = self._split(uri)
+            return self._inside(self.local_root, Path(bucket) / key)
+        return None
+
+    def check_input(self, uri: str):
+        """Raise ValueError if ``uri`` may not be read as a job input."""
+        self._local(uri, untrusted=True)
+
+    def read(self, uri: str) -> bytes:
+        """Read a job input (client-supplied, so confined to ``files_root``)."""
+        path = self._local(uri, untrusted=True)
+        if path is not None:
+            return path.read_bytes()
+        bucket, key = self._split(uri)
+        return self.client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def write(self, local_path: Path, uri: str):
+        path = self._local(uri)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(local_path, path)
+            return
+        bucket, key = self._split(uri)
+        try:
+            self.client.head_bucket(Bucket=bucket)
+        except Exception:
+            self.client.create_bucket(Bucket=bucket)
+        self.client.upload_file(str(local_path), bucket, key)
+
+    def open(self, uri: str):
+        """A readable stream of the object, for serving results."""
+        path = self._local(uri)
+        if path is not None:
+            return open(path, "rb")
+        bucket, key = self._split(uri)
+        return self.client.get_object(Bucket=bucket, Key=key)["Body"]
+
+
+# =========================
+# JOB RUNNER
+# =========================
+Predict = Callable[[List[Tuple[int, bytes]], str], Awaitable[List[Dict]]]
+
+
+class JobRunner:
+    """Run queued jobs in the background, in large batches.
+
+    Inputs are fetched ``fetch_workers`` at a time and handed to ``predict``
+    ``batch_size`` images at a time; ``predict`` returns one record per
+    image. Records are appended to a local JSONL file and progress is saved
+    after every batch, so a job picked up again after a restart continues
+    where it stopped. When all inputs are done the file (converted to
+    Parquet if asked) is written to ``output_prefix/<job id>.<format>``.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        objects: ObjectStore,
+        predict: Predict,
+        work_dir: str,
+        output_prefix: str,
+        batch_size: int = 64,
+        fetch_workers: int = 8,
+        poll_interval: float = 2.0,
+    ):
+        self.store = store
+        self.objects = objects
+        self.predict = predict
+        self.work_dir = Path(work_dir)
+        self.output_prefix = output_prefix.rstrip("/")
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.owner = f"{os.uname().nodename}:{os.getpid()}"
+        self._fetch_pool = ThreadPoolExecutor(
+            max_workers=fetch_workers, thread_name_prefix="job-fetch"
+        )
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self.work_dir.mkdir(parents=True, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._fetch_pool.shutdown(wait=False)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                job = await loop.run_in_executor(None, self.store.claim, self.owner)
+            except Exception as e:
+                print(f"⚠️ Job store unavailable: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                # Shutting down: the heartbeat goes stale and the job resumes
+                raise
+            except Exception as e:
+                print(f"❌ Job {job.id} failed: {e}")
+                await loop.run_in_executor(
+                    None,
+                    lambda: self.store.finish(
+                        job.id, self.owner, FAILED, error=str(e)
+                    ),
+                )
+
+    def _fetch(self, index: int, uri: str) -> Tuple[int, bytes]:
+        try:
+            return index, self.objects.read(uri)
+        except Exception as e:
+            print(f"⚠️ Could not read {uri}: {e}")
+            return index, b""
+
+    async def _process(self, job: Job):
+        loop = asyncio.get_running_loop()
+        print(f"🧾 Job {job.id}: {job.total} inputs, resuming at {job.processed}")
+        part_path = self.work_dir / f"{job.id}.jsonl"
+        if job.processed == 0 and part_path.exists():
+            part_path.unlink()
+
+        processed, failed = job.processed, job.failed
+        for start in range(job.processed, job.total, self.batch_size):
+            indices = range(start, min(start + self.batch_size, job.total))
+            fetched = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        self._fetch_pool, self._fetch, i, job.inputs[i]
+                    )
+                    for i in indices
+                )
+            )
+            records = await self.predict(fetched, job.resolution)
+            for record in records:
+                record["source"] = job.inputs[record["index"]]
+            errors = sum(1 for record in records if "error" in record)
+
+            with open(part_path, "a") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+            processed += len(records)
+            failed += errors
+            JOB_IMAGES.labels(outcome="ok").inc(len(records) - errors)
+            JOB_IMAGES.labels(outcome="error").inc(errors)
+
+            still_ours = await loop.run_in_executor(
+                None, self.store.progress, job.id, self.owner, processed, failed
+            )
+            if not still_ours:
+                current = await loop.run_in_executor(None, self.store.get, job.id)
+                if current is not None and current.status == CANCELLED:
+                    print(f"🛑 Job {job.id} cancelled at {processed}/{job.total}")
+                    part_path.unlink(missing_ok=True)
+                else:
+                    # Our heartbeat went stale and another runner resumed the
+                    # job; its results (and the part file) are now its own
+                    print(f"🛑 Job {job.id} taken over by another runner")
+                return
+
+        output_uri = f"{self.output_prefix}/{job.id}.{job.output_format}"
+        await loop.run_in_executor(
+            None, self._publish, part_path, job.output_format, output_uri
+        )
+        finished = await loop.run_in_executor(
+            None,
+            lambda: self.store.finish(
+                job.id, self.owner, SUCCEEDED, output_uri=output_uri
+            ),
+        )
+        if not finished:
+            print(f"🛑 Job {job.id} was cancelled or taken over before finishing")
+            return
+        print(f"✅ Job {job.id} done: {processed} images, {failed} failed")
+
+    def _publish(self, part_path: Path, output_format: str, output_uri: str):
+        # A crash between appending a batch and saving progress replays that
+        # batch on resume; keep the last record for each index
+        records: Dict[int, Any] = {}
+        if part_path.exists():
+            with open(part_path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    records[record["index"]] = record
+        rows = [records[i] for i in sorted(records)]
+
+        out_path = part_path.with_suffix(f".out.{output_format}")
+        if output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Fixed columns: inferring from the first row would drop or retype
+            # fields when it is an error record
+            schema = pa.schema(
+                [
+                    ("index", pa.int64()),
+                    ("source", pa.string()),
+                    ("model_version", pa.string()),
+                    ("detections", pa.int32()),
+                    ("predictions", pa.string()),  # JSON, as in the jsonl output
+                    ("error", pa.string()),
+                ]
+            )
+            for row in rows:
+                row["predictions"] = json.dumps(row.get("predictions", []))
+            pq.write_table(pa.Table.from_pylist(rows, schema=schema), out_path)
+        else:
+            with open(out_path, "w") as f:
+                f.writelines(json.dumps(row) + "\n" for row in rows)
+
+        self.objects.write(out_path, output_uri)
+        out_path.unlink(missing_ok=True)
+        part_path.unlink(missing_ok=True)
@@ -1,16 +1,68 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response
-import tempfile
+from fastapi import (
+    FastAPI,
+    UploadFile,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+import asyncio
+import hmac
 import os
-import json
+import shutil
+import tempfile
+import threading
 import time
+from contextlib import ExitStack
 from datetime import datetime
 from ultralytics import YOLO
+import numpy as np
 import torch
 import ultralytics.nn.tasks
 import mlflow
 from pathlib import Path
-from typing import Dict, List
 from mlflow.tracking import MlflowClient
+from typing import Dict, List, Optional, Tuple
+
+from api.batcher import BatchItemResult, MicroBatcher
+from api.jobs import (
+    OUTPUT_FORMATS,
+    SUCCEEDED,
+    JobRequest,
+    JobRunner,
+    JobStore,
+    ObjectStore,
+)
+from api.metrics import (
+    MODEL_WARMUP_SECONDS,
+    REJECTED_REQUESTS,
+    TILES,
+    observe_stage,
+    record_detections,
+    record_request,
+    render_latest,
+    snapshot,
+    time_stage,
+)
+from api.model_cache import ModelCache
+from api.model_manager import ModelHandle, ModelManager
+from api.profiling import (
+    StackSampler,
+    StageProfiler,
+    TorchCapture,
+    add_stage,
+    run_in_executor,
+)
+from api.preprocessing import DecodedImage, ModelInput, decode_image, fit_to_imgsz
+from api.result_cache import ResultCache, content_key, dhash
+from api.serialization import Detections, dumps, encode_detections, negotiate
+from api.tiling import Tile, make_tiles, merge_tile_detections, road_fraction
+from api.uploads import iter_upload_images
+from api.video import FrameReader, stream_allowed, stream_detections
+from api.workers import InferencePool, QueueFullError, set_torch_threads
 
 # =========================
 # CONFIG
@@ -26,62 +78,296 @@ os.environ.update(
     }
 )
 
+MODEL_NAME = "road-mark-yolo"
+MODEL_ALIAS = "production"
+
+# Serve a local model instead of the registry alias (benchmarks, offline
+# runs): a .pt/exported artifact, or a model .yaml such as yolov8n.yaml to
+# build an untrained stub. MLflow is never contacted and hot reload is off.
+MODEL_PATH = os.getenv("MODEL_PATH") or None
+
+# Local artifact cache so restarts don't re-download unchanged weights
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "/app/model_cache")
+MODEL_CACHE_MAX_MB = int(os.getenv("MODEL_CACHE_MAX_MB", "2048"))
+
+# Hot reload: poll the alias and swap in new versions (0 disables)
+MODEL_POLL_SECONDS = float(os.getenv("MODEL_POLL_SECONDS", "30"))
+MODEL_DRAIN_TIMEOUT = float(os.getenv("MODEL_DRAIN_TIMEOUT", "60"))
+
+# Runtime backend: pt, onnx, onnx_int8, torchscript or openvino. Falls back
+# to the .pt weights if the version has no artifact for the chosen backend.
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "pt")
+BACKEND_GLOBS = {
+    "onnx": "*.onnx",
+    "onnx_int8": "*_int8.onnx",
+    "torchscript": "*.torchscript",
+    "openvino": "*_openvino_model",
+}
+
+# Micro-batching: concurrent /predict calls are coalesced into one forward pass
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+# Inference worker pool and admission control
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0")) or None
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "1"))
+
+# /predict/batch keeps this many images in flight (a few model batches' worth)
+BULK_WINDOW = int(os.getenv("BULK_WINDOW", str(BATCH_MAX_SIZE * 2)))
+
+# /predict/video: default frame stride and how far behind real time a live
+# stream may fall before frames are dropped. A `source` URL makes the server
+# connect out, so only hosts or URL prefixes in VIDEO_ALLOWED_SOURCES
+# (comma-separated) are opened; empty (the default) disables remote sources.
+VIDEO_STRIDE = int(os.getenv("VIDEO_STRIDE", "1"))
+VIDEO_MAX_LAG_SECONDS = float(os.getenv("VIDEO_MAX_LAG_SECONDS", "1.0"))
+VIDEO_ALLOWED_SOURCES = [
+    entry.strip()
+    for entry in os.getenv("VIDEO_ALLOWED_SOURCES", "").split(",")
+    if entry.strip()
+]
+
+# Result cache for resubmitted images (0 MB disables). Near-duplicate
+# matching by perceptual hash is off unless a max bit distance is given.
+RESULT_CACHE_MB = int(os.getenv("RESULT_CACHE_MB", "64"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+RESULT_CACHE_PHASH_DISTANCE = int(os.getenv("RESULT_CACHE_PHASH_DISTANCE", "-1"))
+
+# Profiling: Server-Timing headers on /predict, and/or keep a stage trace for
+# about 1 in PROFILE_SAMPLE_EVERY requests (0 disables). Both off by default,
+# in which case the request path is untouched.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_TRACE_BUFFER = int(os.getenv("PROFILE_TRACE_BUFFER", "100"))
+PROFILE_TRACE_FILE = os.getenv("PROFILE_TRACE_FILE") or None
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# /admin endpoints are disabled unless a token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Input resolution. Images are letterboxed to the imgsz logged with the
+# model's training run (MODEL_IMGSZ if the run has none); large JPEGs are
+# decoded at reduced size down to it. Requests may ask for the lower "fast"
+# tier, which runtimes with a fixed input size ignore.
+MODEL_IMGSZ = int(os.getenv("MODEL_IMGSZ", "480"))
+FAST_IMGSZ = int(os.getenv("FAST_IMGSZ", "320"))
+RESOLUTIONS = ("full", "fast")
+
+# Tiled mode (/predict?tiled=true) for small markings in large frames: the
+# full-resolution image is cut into overlapping TILE_SIZE squares (0 = the
+# model imgsz, i.e. native resolution) that run as one batch, and their
+# detections are merged with cross-tile NMS. A downscaled full-frame pass is
+# added so large objects split across tiles are still found. Tiles with too
+# little road-like surface can be skipped.
+TILE_SIZE = int(os.getenv("TILE_SIZE", "0"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+TILE_NMS_IOU = float(os.getenv("TILE_NMS_IOU", "0.5"))
+TILE_FULL_FRAME = os.getenv("TILE_FULL_FRAME", "true").lower() == "true"
+TILE_SKIP_ROADLESS = os.getenv("TILE_SKIP_ROADLESS", "false").lower() == "true"
+TILE_MIN_ROAD_FRACTION = float(os.getenv("TILE_MIN_ROAD_FRACTION", "0.1"))
+DECODE_REDUCED = os.getenv("DECODE_REDUCED", "true").lower() == "true"
+
+# Warmup: before reporting ready, run synthetic batches at every batch size
+# the batcher can form and every input shape (WxH) we expect, so the first
+# real requests don't pay for lazy init, allocator growth and kernel
+# selection. An empty WARMUP_SHAPES only builds the predictors.
+WARMUP_BATCH_SIZES = [
+    int(b) for b in os.getenv("WARMUP_BATCH_SIZES", "").split(",") if b
+] or list(range(1, BATCH_MAX_SIZE + 1))
+WARMUP_SHAPES = [
+    tuple(int(v) for v in shape.split("x"))
+    for shape in os.getenv("WARMUP_SHAPES", "1280x720,720x1280,640x640").split(",")
+    if shape
+]
+
+# Offline jobs (/jobs): inputs are local paths or s3:// URIs, results go to
+# JOBS_OUTPUT_PREFIX as JSONL or Parquet. Jobs live in a SQLite file shared
+# by all workers, so they survive restarts and resume where they stopped.
+# They run on their own inference threads in large batches, apart from
+# interactive traffic. JOBS_STORAGE_ROOT maps s3://bucket/key to a local
+# directory instead of MinIO. Local input paths must lie under
+# JOBS_FILES_ROOT (empty to only accept s3:// inputs).
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOBS_DB = os.getenv("JOBS_DB", "/app/jobs/jobs.db")
+JOBS_DIR = os.getenv("JOBS_DIR", "/app/jobs/work")
+JOBS_OUTPUT_PREFIX = os.getenv("JOBS_OUTPUT_PREFIX", "s3://inference-jobs/results")
+JOBS_STORAGE_ROOT = os.getenv("JOBS_STORAGE_ROOT") or None
+JOBS_FILES_ROOT = os.getenv("JOBS_FILES_ROOT", "/app/jobs/inputs") or None
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "64"))
+JOBS_MODEL_BATCH = int(os.getenv("JOBS_MODEL_BATCH", "16"))
+JOBS_FETCH_WORKERS = int(os.getenv("JOBS_FETCH_WORKERS", "8"))
+JOBS_MAX_INPUTS = int(os.getenv("JOBS_MAX_INPUTS", "100000"))
+JOBS_STALE_SECONDS = float(os.getenv("JOBS_STALE_SECONDS", "300"))
+
 app = FastAPI(title="YOLO Road Mark Detection API")
+STARTED_AT = time.time()
 
+stage_profiler = StageProfiler(
+    server_timing=SERVER_TIMING,
+    sample_every=PROFILE_SAMPLE_EVERY,
+    buffer_size=PROFILE_TRACE_BUFFER,
+    trace_file=PROFILE_TRACE_FILE,
+)
+if stage_profiler.enabled:
+    app.middleware("http")(stage_profiler)
+torch_capture = TorchCapture()
+
+# Set once the model is loaded and every inference thread is warm
+ready = threading.Event()
+profile_lock = threading.Lock()
 
-# =========================
-# METRICS TRACKING
-# =========================
-class MetricsTracker:
-    def __init__(self):
-        self.start_time = time.time()
-        self.request_count = 0
-        self.success_count = 0
-        self.error_count = 0
-        self.total_inference_time = 0
-        self.detection_counts = {}  # class -> count
-        self.last_predictions = []
-
-    def record_request(self, success: bool, inference_time: float = 0):
-        self.request_count += 1
-        if success:
-            self.success_count += 1
-            self.total_inference_time += inference_time
-        else:
-            self.error_count += 1
-
-    def record_detections(self, predictions: List[Dict]):
-        self.last_predictions = predictions
-        for pred in predictions:
-            class_name = pred.get("name", "unknown")
-            self.detection_counts[class_name] = (
-                self.detection_counts.get(class_name, 0) + 1
-            )
+
+# ultralytics per-image timings (ms) -> pipeline stage
+RESULT_SPEED_STAGES = (
+    ("preprocess", "preprocess"),
+    ("inference", "forward"),
+    ("postprocess", "nms"),
+)
+
+
+def current_version() -> Optional[str]:
+    handle = models.current
+    return handle.version if handle else None
 
 
-metrics = MetricsTracker()
-model = None
+def run_batch(inputs: List[ModelInput]) -> List[Detections]:
+    # Runs on an inference worker; reading the result tensors here keeps it
+    # off the event loop. The version is pinned for the batch so a hot swap
+    # waits for it. The batcher groups by shape and imgsz, so one suffices.
+    with models.acquire() as handle, torch_capture.batch():
+        results = handle.predict(
+            [item.array for item in inputs], imgsz=inputs[0].imgsz
+        )
+
+    detections = []
+    for result in results:
+        speed = getattr(result, "speed", None) or {}
+        timings = {
+            stage: speed[key] / 1000.0
+            for key, stage in RESULT_SPEED_STAGES
+            if speed.get(key) is not None
+        }
+        for stage, seconds in timings.items():
+            observe_stage(stage, seconds, handle.version)
+        detections.append(Detections.from_result(result, handle.version, timings))
+    return detections
 
 
 # =========================
 # MODEL LOADING
 # =========================
-@app.on_event("startup")
-def load_model():
-    global model
-    print("🔥 Loading model from MLflow...")
-    client = MlflowClient()
+def find_exported(model_dir: Path, backend: str) -> Optional[Path]:
+    """Locate an exported runtime artifact logged by scripts/log_model.py."""
+    pattern = BACKEND_GLOBS.get(backend)
+    if pattern is None:
+        return None
+    matches = sorted(Path(model_dir).rglob(pattern))
+    if backend == "onnx":
+        matches = [p for p in matches if not p.stem.endswith("_int8")]
+    return matches[0] if matches else None
+
+
+def load_yolo(model_path: str, backend: str = "pt") -> YOLO:
+    if backend != "pt":
+        # Exported runtimes are already fused and don't go through torch.load
+        return YOLO(model_path, task="detect")
+
+    # MONKEYPATCH: Fix for PyTorch 2.6+ default weights_only=True
+    # Since we trust our own model artifacts, we force weights_only=False
+    original_load = torch.load
+
+    def safe_load(*args, **kwargs):
+        if "weights_only" not in kwargs:
+            kwargs["weights_only"] = False
+        return original_load(*args, **kwargs)
+
+    torch.load = safe_load
     try:
-        model_uri = "models:/road-mark-yolo@production"
-        print(f"📦 URI: {model_uri}")
+        yolo = YOLO(model_path)
+        # Fuse conv+bn now rather than on first predict, so forked workers
+        # keep sharing these weight pages instead of each writing a copy.
+        # Under no_grad: a model built from a .yaml still requires grad, and
+        # fusing it with autograd on leaves non-leaf weights predict rejects
+        with torch.no_grad():
+            yolo.fuse()
+        return yolo
+    finally:
+        torch.load = original_load
 
-        model_dir = mlflow.artifacts.download_artifacts(model_uri)
-        print(f"📁 Downloaded to: {model_dir}")
-        model_version = client.get_model_version_by_alias(
-            name="road-mark-yolo", alias="production"
-        )
-        print(f"🏷️ Version {model_version.version} (alias: production)")
-        print(f"📊 Run ID: {model_version.run_id}")
+
+def load_local_handle() -> ModelHandle:
+    backend = next(
+        (
+            name
+            for name, pattern in sorted(BACKEND_GLOBS.items(), reverse=True)
+            if Path(MODEL_PATH).match(pattern)
+        ),
+        "pt",
+    )
+    print(f"📦 Local model: {MODEL_PATH} (backend: {backend})")
+    yolo = load_yolo(MODEL_PATH, backend)
+    return make_handle(yolo, "local", None, backend, model_imgsz(yolo))
+
+
+def model_imgsz(yolo: YOLO, run_id: Optional[str] = None) -> int:
+    """Training imgsz: MLflow run params, else the checkpoint's train args."""
+    if run_id:
+        try:
+            params = mlflow_client.get_run(run_id).data.params
+            if params.get("imgsz"):
+                return int(params["imgsz"])
+        except Exception as e:
+            print(f"⚠️ Could not read imgsz from run {run_id}: {e}")
+    imgsz = getattr(yolo, "overrides", {}).get("imgsz")
+    return imgsz if isinstance(imgsz, int) else MODEL_IMGSZ
+
+
+def make_handle(
+    yolo: YOLO, version: str, run_id: Optional[str], backend: str, imgsz: int
+) -> ModelHandle:
+    print(f"📐 Input size: {imgsz}")
+    return ModelHandle(
+        yolo,
+        version,
+        run_id,
+        backend=backend,
+        predict_kwargs={"imgsz": imgsz},
+        # ONNX is exported with a dynamic batch axis, the others are not
+        max_batch=None if backend in ("pt", "onnx", "onnx_int8") else 1,
+        imgsz=imgsz,
+        # ...nor dynamic spatial dims
+        fixed_imgsz=backend in ("torchscript", "openvino"),
+    )
+
+
+def load_handle() -> ModelHandle:
+    if MODEL_PATH:
+        return load_local_handle()
+
+    model_uri = f"models:/{MODEL_NAME}@{MODEL_ALIAS}"
+    print(f"📦 URI: {model_uri}")
+
+    cached = model_cache.fetch(MODEL_NAME, MODEL_ALIAS)
+    model_dir = cached.path
+    print(f"📁 Cached at: {model_dir}")
+    print(
+        f"🏷️ Version {cached.version} (alias: {MODEL_ALIAS}"
+        f"{', offline fallback' if cached.offline else ''})"
+    )
+    print(f"📊 Run ID: {cached.run_id}")
+
+    backend, model_path = "pt", None
+    if MODEL_BACKEND != "pt":
+        exported = find_exported(model_dir, MODEL_BACKEND)
+        if exported is not None:
+            backend, model_path = MODEL_BACKEND, str(exported)
+        else:
+            print(f"⚠️ No {MODEL_BACKEND} artifact in this version, using .pt")
+
+    if model_path is None:
         pt_files = list(Path(model_dir).rglob("*.pt"))
 
         if not pt_files:
@@ -93,186 +379,846 @@ def load_model():
             raise FileNotFoundError("No .pt file found in artifacts")
 
         model_path = str(pt_files[0])
-        print(f"✅ Found model: {model_path}")
+    print(f"✅ Found model: {model_path} (backend: {backend})")
 
-        # MONKEYPATCH: Fix for PyTorch 2.6+ default weights_only=True
-        # Since we trust our own model artifacts, we force weights_only=False
-        original_load = torch.load
+    yolo = load_yolo(model_path, backend)
+    print("✅ YOLO model loaded successfully")
 
-        def safe_load(*args, **kwargs):
-            if "weights_only" not in kwargs:
-                kwargs["weights_only"] = False
-            return original_load(*args, **kwargs)
+    model_cache.mark_good(cached.version)
+    imgsz = model_imgsz(yolo, cached.run_id)
+    return make_handle(yolo, cached.version, cached.run_id, backend, imgsz)
 
-        torch.load = safe_load
-        try:
-            model = YOLO(model_path)
-            print("✅ YOLO model loaded successfully")
-        finally:
-            torch.load = original_load
 
+def handle_imgsz(handle: Optional[ModelHandle], resolution: str = "full") -> int:
+    imgsz = handle.imgsz if handle else MODEL_IMGSZ
+    if resolution == "fast" and not (handle and handle.fixed_imgsz):
+        return min(FAST_IMGSZ, imgsz)
+    return imgsz
+
+
+def warmup_inputs(handle: ModelHandle) -> List[ModelInput]:
+    """Synthetic inputs as they reach the model, for every shape and tier."""
+    rng = np.random.default_rng(0)
+    sizes = sorted({handle_imgsz(handle, r) for r in RESOLUTIONS}, reverse=True)
+    inputs = []
+    for width, height in WARMUP_SHAPES:
+        array = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        image = DecodedImage(array, width, height, 1.0)
+        for imgsz in sizes:
+            inputs.append(ModelInput(fit_to_imgsz(image, imgsz).array, imgsz))
+    return inputs
+
+
+def warmup_replicas(handle: ModelHandle, count: int):
+    """Have ``count`` replicas ready, with every shape run through each.
+
+    Runs in the calling thread (the watcher on a hot swap) while the live
+    pool keeps serving the current version; inference threads pick the warm
+    replicas up once the version is swapped in.
+    """
+    started = time.perf_counter()
+    inputs = warmup_inputs(handle)
+    with ExitStack() as stack:
+        replicas = [stack.enter_context(handle.replica()) for _ in range(count)]
+        for replica in replicas:
+            for item in inputs:
+                handle.predict([item.array], replica, imgsz=item.imgsz)
+    elapsed = time.perf_counter() - started
+    handle.warmup_seconds["workers"] = elapsed
+    MODEL_WARMUP_SECONDS.labels(version=handle.version, phase="workers").set(elapsed)
+    print(f"🔥 Warmed {count} model replica(s) in {elapsed:.1f}s")
+
+
+def warmup_handle(handle: ModelHandle):
+    """Run every batch size at every shape before the version takes traffic."""
+    started = time.perf_counter()
+    inputs = warmup_inputs(handle)
+    with handle.replica() as replica:
+        for item in inputs:
+            for batch_size in WARMUP_BATCH_SIZES:
+                handle.predict(
+                    [item.array] * batch_size, replica, imgsz=item.imgsz
+                )
+    elapsed = time.perf_counter() - started
+    handle.warmup_seconds["model"] = elapsed
+    MODEL_WARMUP_SECONDS.labels(version=handle.version, phase="model").set(elapsed)
+    print(
+        f"🔥 Warmed up version {handle.version} in {elapsed:.1f}s "
+        f"(batch sizes {WARMUP_BATCH_SIZES}, shapes {WARMUP_SHAPES})"
+    )
+
+    # One replica per inference thread that may run at once; replicas built
+    # in the gunicorn master are inherited by every worker
+    if INFERENCE_THREADS > 1:
+        warmup_replicas(handle, INFERENCE_THREADS)
+
+
+def probe_alias() -> str:
+    model_version = mlflow_client.get_model_version_by_alias(
+        name=MODEL_NAME, alias=MODEL_ALIAS
+    )
+    return str(model_version.version)
+
+
+mlflow_client = MlflowClient()
+model_cache = ModelCache(MODEL_CACHE_DIR, max_bytes=MODEL_CACHE_MAX_MB * 1024**2)
+models = ModelManager(
+    load_handle,
+    probe_alias,
+    poll_interval=0 if MODEL_PATH else MODEL_POLL_SECONDS,
+    warmup=warmup_handle,
+    drain_timeout=MODEL_DRAIN_TIMEOUT,
+)
+result_cache = ResultCache(
+    RESULT_CACHE_MB * 1024**2,
+    ttl=RESULT_CACHE_TTL_SECONDS,
+    max_distance=RESULT_CACHE_PHASH_DISTANCE,
+)
+# One torch thread budget for both pools; gunicorn's post_fork may lower it
+# to this worker's share of the cores before startup applies it
+INFERENCE_THREADS = INFERENCE_WORKERS + (JOBS_WORKERS if JOBS_ENABLED else 0)
+torch_threads = TORCH_NUM_THREADS
+pool = InferencePool(num_workers=INFERENCE_WORKERS)
+batcher = MicroBatcher(
+    run_batch,
+    pool,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_queue_size=INFERENCE_QUEUE_SIZE,
+    retry_after=RETRY_AFTER_SECONDS,
+    key_fn=lambda item: item.batch_key,
+)
+
+job_store = JobStore(JOBS_DB, stale_after=JOBS_STALE_SECONDS)
+job_objects = ObjectStore(JOBS_STORAGE_ROOT, files_root=JOBS_FILES_ROOT)
+jobs_pool = InferencePool(num_workers=JOBS_WORKERS, name="jobs")
+jobs_batcher = MicroBatcher(
+    run_batch,
+    jobs_pool,
+    max_batch_size=JOBS_MODEL_BATCH,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_queue_size=JOBS_BATCH_SIZE,
+    key_fn=lambda item: item.batch_key,
+)
+
+
+@app.on_event("startup")
+def load_model():
+    if models.current is not None:
+        # Already loaded by the gunicorn master before forking (preload_app)
+        print("♻️ Using model preloaded by the server process")
+        return
+    print("🔥 Loading model from MLflow...")
+    try:
+        models.load()
     except Exception as e:
         print(f"❌ Model load failed: {e}")
         raise
 
 
+@app.on_event("startup")
+def start_model_watcher():
+    models.start_watcher()
+
+
+@app.on_event("shutdown")
+def stop_model_watcher():
+    models.stop_watcher()
+
+
+@app.on_event("startup")
+async def start_batcher():
+    set_torch_threads(torch_threads, INFERENCE_THREADS)
+    pool.start()
+    await batcher.start()
+    print(
+        f"🧺 Batcher started (max_batch_size={BATCH_MAX_SIZE}, "
+        f"max_wait_ms={BATCH_MAX_WAIT_MS}, workers={pool.num_workers}, "
+        f"torch_threads={torch.get_num_threads()}, queue={INFERENCE_QUEUE_SIZE})"
+    )
+    ready.set()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    ready.clear()
+    await batcher.stop()
+    pool.shutdown()
+
+
+@app.on_event("startup")
+async def start_job_runner():
+    if not JOBS_ENABLED:
+        return
+    jobs_pool.start()
+    await jobs_batcher.start()
+    await job_runner.start()
+    print(
+        f"🧾 Job runner started (batch={JOBS_BATCH_SIZE}, "
+        f"model_batch={JOBS_MODEL_BATCH}, workers={jobs_pool.num_workers})"
+    )
+
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    if not JOBS_ENABLED:
+        return
+    # Unfinished jobs are picked up again once their heartbeat goes stale
+    await job_runner.stop()
+    await jobs_batcher.stop()
+    jobs_pool.shutdown()
+
+
 # =========================
 # HEALTH & METRICS ENDPOINTS
 # =========================
+def is_ready() -> bool:
+    return ready.is_set() and models.current is not None
+
+
 @app.get("/health")
 def health():
+    handle = models.current
     return {
-        "status": "healthy" if model else "unhealthy",
-        "model_loaded": model is not None,
-        "uptime_seconds": time.time() - metrics.start_time,
-        "requests_total": metrics.request_count,
+        "status": "healthy" if is_ready() else "unhealthy",
+        "ready": is_ready(),
+        "model_loaded": handle is not None,
+        "model_version": handle.version if handle else None,
+        "model_run_id": handle.run_id if handle else None,
+        "uptime_seconds": time.time() - STARTED_AT,
     }
 
 
-@app.get("/metrics")
-async def prometheus_metrics():
-    """Prometheus metrics endpoint"""
-    uptime = time.time() - metrics.start_time
-
-    # Prometheus format
-    prometheus_data = f"""# HELP api_uptime_seconds Total uptime of the API
-# TYPE api_uptime_seconds gauge
-api_uptime_seconds {uptime}
-
-# HELP api_requests_total Total number of requests
-# TYPE api_requests_total counter
-api_requests_total {metrics.request_count}
-
-# HELP api_successful_requests_total Total successful requests
-# TYPE api_successful_requests_total counter
-api_successful_requests_total {metrics.success_count}
-
-# HELP api_failed_requests_total Total failed requests
-# TYPE api_failed_requests_total counter
-api_failed_requests_total {metrics.error_count}
-
-# HELP api_average_inference_time_seconds Average inference time in seconds
-# TYPE api_average_inference_time_seconds gauge
-"""
-
-    # Add average inference time if available
-    if metrics.success_count > 0:
-        avg_inference = metrics.total_inference_time / metrics.success_count
-        prometheus_data += f"api_average_inference_time_seconds {avg_inference}\n"
-    else:
-        prometheus_data += f"api_average_inference_time_seconds 0\n"
+@app.get("/health/live")
+def liveness():
+    """The process is up and serving HTTP (restart it if this fails)."""
+    return {"status": "alive"}
+
 
-    # Add detection metrics by class
-    prometheus_data += "\n# HELP api_detections_total Total detections by class\n"
-    prometheus_data += "# TYPE api_detections_total counter\n"
-    for class_name, count in metrics.detection_counts.items():
-        # Sanitize label (Prometheus format)
-        safe_class = class_name.replace('"', "").replace("\\", "")
-        prometheus_data += f'api_detections_total{{class="{safe_class}"}} {count}\n'
+@app.get("/health/ready")
+def readiness(response: Response):
+    """The model is loaded and warm: route traffic here only on 200."""
+    if not is_ready():
+        response.status_code = 503
+        return {"status": "not ready", "model_loaded": models.current is not None}
+    return {"status": "ready", "model_version": models.current.version}
 
-    # Model info
-    prometheus_data += f"""
-# HELP api_model_loaded Whether the model is loaded (1=yes, 0=no)
-# TYPE api_model_loaded gauge
-api_model_loaded {1 if model else 0}
-"""
 
-    return Response(content=prometheus_data, media_type="text/plain")
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics endpoint (all gunicorn workers combined)"""
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/metrics/json")
 async def json_metrics():
     """JSON metrics endpoint (for debugging)"""
+    handle = models.current
     return {
-        "uptime_seconds": time.time() - metrics.start_time,
-        "requests": {
-            "total": metrics.request_count,
-            "successful": metrics.success_count,
-            "failed": metrics.error_count,
-            "success_rate": (
-                metrics.success_count / metrics.request_count
-                if metrics.request_count > 0
-                else 0
-            ),
-        },
-        "inference": {
-            "average_time_seconds": (
-                metrics.total_inference_time / metrics.success_count
-                if metrics.success_count > 0
-                else 0
-            ),
-            "total_time_seconds": metrics.total_inference_time,
-        },
-        "detections": metrics.detection_counts,
+        **snapshot(),
         "model": {
-            "loaded": model is not None,
-            "last_loaded": datetime.fromtimestamp(metrics.start_time).isoformat(),
+            "loaded": handle is not None,
+            "version": handle.version if handle else None,
+            "last_loaded": (
+                datetime.fromtimestamp(handle.loaded_at).isoformat()
+                if handle
+                else None
+            ),
         },
     }
 
 
+# =========================
+# ADMIN / PROFILING ENDPOINTS
+# =========================
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/traces")
+async def admin_traces(x_admin_token: Optional[str] = Header(None)):
+    """Sampled per-request stage traces held by this worker, newest last."""
+    require_admin(x_admin_token)
+    return {"pid": os.getpid(), "traces": list(stage_profiler.traces)}
+
+
+@app.post("/admin/profile")
+async def admin_profile(
+    kind: str = "cpu",
+    seconds: float = 10.0,
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Profile this worker for `seconds` while it serves traffic and return the
+    result as a download. kind=cpu samples all Python stacks (collapsed
+    format for flamegraph.pl / speedscope); kind=torch records torch.profiler
+    traces of every forward pass in the window (zip of Chrome traces plus an
+    op summary). One profile runs at a time.
+    """
+    require_admin(x_admin_token)
+    if kind not in ("cpu", "torch"):
+        raise HTTPException(status_code=400, detail="kind must be cpu or torch")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    if not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    try:
+        if kind == "cpu":
+            sampler = StackSampler()
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+            content, media_type = sampler.collapsed(), "text/plain"
+            filename = f"profile-{os.getpid()}-{stamp}.folded"
+        else:
+            torch_capture.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                content = torch_capture.stop()
+            media_type = "application/zip"
+            filename = f"torch-profile-{os.getpid()}-{stamp}.zip"
+    finally:
+        profile_lock.release()
+
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # =========================
 # PREDICTION ENDPOINT
 # =========================
+def decode_and_hash(
+    content: bytes, imgsz: int, version: Optional[str] = None
+) -> Tuple[DecodedImage, Optional[int]]:
+    with time_stage("decode", version):
+        image = decode_image(content, imgsz, DECODE_REDUCED)
+    phash = dhash(image.array) if result_cache.near_duplicates else None
+    with time_stage("resize", version):
+        image = fit_to_imgsz(image, imgsz)
+    return image, phash
+
+
+async def detect(
+    content: bytes, block: bool = False, resolution: str = "full"
+) -> Tuple[Detections, Optional[BatchItemResult], Optional[str]]:
+    """
+    Run one encoded image through the result cache and the batcher.
+
+    Returns (detections, batched, cached): on a cache hit `batched` is None
+    and `cached` is "exact" or "similar". Raises ValueError if the image
+    can't be decoded.
+    """
+    handle = models.current
+    version = handle.version if handle else None
+    imgsz = handle_imgsz(handle, resolution)
+    key = f"{content_key(content)}:{imgsz}" if result_cache.enabled else None
+    if key:
+        hit = result_cache.get(key, version)
+        if hit is not None:
+            return hit, None, "exact"
+
+    # Decode in memory (off the event loop), no tempfile round-trip
+    image, phash = await run_in_executor(decode_and_hash, content, imgsz, version)
+    shape = (image.orig_width, image.orig_height, imgsz)
+    if phash is not None:
+        hit = result_cache.get_similar(phash, shape, version)
+        if hit is not None:
+            return hit, None, "similar"
+    result_cache.miss()
+
+    batched = await batcher.submit(ModelInput(image.array, imgsz), block=block)
+    detections = batched.result.scaled(image.scale)
+    add_stage("queue", batched.queue_wait)
+    for stage, seconds in (detections.timings or {}).items():
+        add_stage(stage, seconds)
+    # Only cache results from the version still being served
+    current = models.current
+    if key and current and detections.model_version == current.version:
+        result_cache.put(key, detections, detections.model_version, phash, shape)
+    return detections, batched, None
+
+
+def check_resolution(resolution: str):
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"resolution must be one of {', '.join(RESOLUTIONS)}",
+        )
+
+
+def prepare_tiles(
+    content: bytes, imgsz: int, version: Optional[str] = None
+) -> Tuple[DecodedImage, List[Tile], Optional[DecodedImage]]:
+    """Decode at full resolution, cut tiles and drop the roadless ones."""
+    with time_stage("decode", version):
+        image = decode_image(content, reduced=False)
+
+    with time_stage("tile", version):
+        tiles = make_tiles(image.array, TILE_SIZE or imgsz, TILE_OVERLAP)
+        total = len(tiles)
+        if TILE_SKIP_ROADLESS:
+            tiles = [
+                t for t in tiles if road_fraction(t.image) >= TILE_MIN_ROAD_FRACTION
+            ]
+    TILES.labels(outcome="run").inc(len(tiles))
+    TILES.labels(outcome="skipped").inc(total - len(tiles))
+
+    full = None
+    if TILE_FULL_FRAME and total > 1:
+        with time_stage("resize", version):
+            full = fit_to_imgsz(image, imgsz)
+    return image, tiles, full
+
+
+async def detect_tiled(
+    content: bytes, block: bool = False
+) -> Tuple[Detections, Optional[BatchItemResult], Optional[str]]:
+    """Like `detect`, but over overlapping full-resolution tiles."""
+    handle = models.current
+    version = handle.version if handle else None
+    imgsz = handle_imgsz(handle)
+    key = f"{content_key(content)}:tiled" if result_cache.enabled else None
+    if key:
+        hit = result_cache.get(key, version)
+        if hit is not None:
+            return hit, None, "exact"
+    result_cache.miss()
+
+    image, tiles, full = await run_in_executor(prepare_tiles, content, imgsz, version)
+    inputs = [ModelInput(tile.image, imgsz) for tile in tiles]
+    offsets = [(tile.x, tile.y) for tile in tiles]
+    if full is not None:
+        inputs.append(ModelInput(full.array, imgsz))
+        offsets.append((0, 0))
+
+    # Same-shape tiles are queued together, so the batcher runs them as one
+    # batch (up to BATCH_MAX_SIZE)
+    batched = await asyncio.gather(
+        *(batcher.submit(item, block=block) for item in inputs)
+    )
+    parts = [b.result for b in batched]
+    if full is not None:
+        parts[-1] = parts[-1].scaled(full.scale)
+
+    names = parts[0].names if parts else handle.model.names
+    with time_stage("tile_merge", version):
+        detections = merge_tile_detections(
+            parts, offsets, names, version, TILE_NMS_IOU
+        )
+    if batched:
+        add_stage("queue", max(b.queue_wait for b in batched))
+    summary = BatchItemResult(
+        result=detections,
+        batch_size=max((b.batch_size for b in batched), default=0),
+        queue_wait=max((b.queue_wait for b in batched), default=0.0),
+        inference_time=max((b.inference_time for b in batched), default=0.0),
+    )
+
+    current = models.current
+    if key and current and version == current.version:
+        result_cache.put(key, detections, version)
+    return detections, summary, None
+
+
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    if not model:
-        metrics.record_request(success=False)
+async def predict(
+    file: UploadFile = File(...),
+    accept: Optional[str] = Header(None),
+    resolution: str = "full",
+    tiled: bool = False,
+):
+    """
+    Detect road marks in one image. The response format follows the Accept
+    header: application/json (default, one object per box),
+    application/vnd.roadmark.columnar+json or application/msgpack (one
+    array per field) or application/octet-stream (raw little-endian arrays).
+    `resolution=fast` runs at FAST_IMGSZ instead of the training size;
+    `tiled=true` runs overlapping full-resolution tiles instead (see
+    TILE_SIZE).
+    """
+    started = time.perf_counter()
+    media_type = negotiate(accept)
+    if media_type is None:
+        raise HTTPException(status_code=406, detail="Unsupported Accept type")
+    check_resolution(resolution)
+
+    if not models.current:
+        record_request("predict", "error")
         raise HTTPException(status_code=503, detail="Model not loaded")
 
     if not file.content_type.startswith("image/"):
-        metrics.record_request(success=False)
+        record_request("predict", "invalid")
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    temp_path = None
-    start_time = time.time()
+    with time_stage("upload_read", current_version()):
+        content = await file.read()
 
     try:
-        # Save file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            content = await file.read()
-            tmp.write(content)
-            temp_path = tmp.name
-
         print(f"🔍 Predicting: {file.filename}")
 
-        # Predict with timing
-        inference_start = time.time()
-        results = model(temp_path)
-        inference_time = time.time() - inference_start
-
-        # Parse results
-        if results and len(results) > 0:
-            result_json = results[0].tojson()
-
-            if isinstance(result_json, str):
-                predictions = json.loads(result_json)
-            else:
-                predictions = result_json
-
-            # Record metrics
-            metrics.record_request(success=True, inference_time=inference_time)
-            metrics.record_detections(predictions)
-
-            return {
-                "filename": file.filename,
-                "detections": len(predictions),
-                "inference_time_seconds": inference_time,
-                "predictions": predictions,
-            }
+        # Predict (batched with any concurrent requests, unless cached)
+        if tiled:
+            detections, batched, cached = await detect_tiled(content)
         else:
-            metrics.record_request(success=True, inference_time=inference_time)
-            return {
-                "filename": file.filename,
-                "detections": 0,
-                "inference_time_seconds": inference_time,
-                "predictions": [],
-            }
+            detections, batched, cached = await detect(
+                content, resolution=resolution
+            )
+        inference_time = batched.inference_time if batched else 0.0
+
+        meta = {
+            "filename": file.filename,
+            "detections": len(detections),
+            "inference_time_seconds": inference_time,
+            "batch_size": batched.batch_size if batched else 0,
+            "cached": cached,
+        }
+        with time_stage("serialization", detections.model_version):
+            response = encode_detections(detections, meta, media_type)
 
+    except ValueError as e:
+        # Undecodable image
+        record_request("predict", "invalid")
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        REJECTED_REQUESTS.inc()
+        record_request("predict", "rejected")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
-        metrics.record_request(success=False)
+        record_request("predict", "error")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Cleanup
-        if temp_path and os.path.exists(temp_path):
-            os.unlink(temp_path)
+
+    record_request(
+        "predict", "success", time.perf_counter() - started, detections.model_version
+    )
+    record_detections(detections)
+    return response
+
+
+# =========================
+# BATCH PREDICTION ENDPOINT
+# =========================
+def encode_line(line: Dict) -> bytes:
+    """One NDJSON line of a streamed response."""
+    with time_stage("serialization", current_version()):
+        return dumps(line) + b"\n"
+
+
+async def predict_one(
+    index: int, filename: str, content: bytes, resolution: str = "full"
+) -> Dict:
+    """Run one image of a bulk request; errors are reported, not raised."""
+    started = time.perf_counter()
+    if not content:
+        record_request("predict_batch", "invalid")
+        return {"index": index, "filename": filename, "error": "Not an image"}
+
+    try:
+        # Bulk requests wait for queue space instead of being rejected
+        detections, batched, cached = await detect(
+            content, block=True, resolution=resolution
+        )
+    except Exception as e:
+        status = "invalid" if isinstance(e, ValueError) else "error"
+        record_request("predict_batch", status)
+        return {"index": index, "filename": filename, "error": str(e)}
+
+    inference_time = batched.inference_time if batched else 0.0
+    record_request(
+        "predict_batch",
+        "success",
+        time.perf_counter() - started,
+        detections.model_version,
+    )
+    record_detections(detections)
+    return {
+        "index": index,
+        "filename": filename,
+        "detections": len(detections),
+        "inference_time_seconds": inference_time,
+        "batch_size": batched.batch_size if batched else 0,
+        "cached": cached,
+        "predictions": detections.to_records(),
+    }
+
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...), resolution: str = "full"
+):
+    """
+    Predict many images in one request: any mix of image parts and zip/tar
+    archives. Results stream back as NDJSON, one line per image in
+    completion order (use "index" to match them to inputs). At most
+    BULK_WINDOW images are decoded or in flight at once, so memory stays
+    bounded regardless of the request size.
+    """
+    check_resolution(resolution)
+    if not models.current:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    async def stream():
+        pending = set()
+        index = 0
+        try:
+            async for filename, content in iter_upload_images(files):
+                if len(pending) >= BULK_WINDOW:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        yield encode_line(task.result())
+                pending.add(
+                    asyncio.create_task(
+                        predict_one(index, filename, content, resolution)
+                    )
+                )
+                index += 1
+
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield encode_line(task.result())
+        finally:
+            # Client went away: don't keep running its remaining images
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# =========================
+# VIDEO PREDICTION ENDPOINT
+# =========================
+async def infer_frame(image: np.ndarray) -> Dict:
+    started = time.perf_counter()
+    imgsz = handle_imgsz(models.current)
+    height, width = image.shape[:2]
+    fitted = await run_in_executor(
+        fit_to_imgsz, DecodedImage(image, width, height, 1.0), imgsz
+    )
+    batched = await batcher.submit(ModelInput(fitted.array, imgsz), block=True)
+    detections = batched.result.scaled(fitted.scale)
+    record_request(
+        "predict_video",
+        "success",
+        time.perf_counter() - started,
+        detections.model_version,
+    )
+    record_detections(detections)
+    return {
+        "detections": len(detections),
+        "inference_time_seconds": batched.inference_time,
+        "batch_size": batched.batch_size,
+        "predictions": detections.to_records(),
+    }
+
+
+@app.post("/predict/video")
+async def predict_video(
+    file: Optional[UploadFile] = File(None),
+    source: Optional[str] = Form(None),
+    stride: int = Form(VIDEO_STRIDE),
+    realtime: Optional[bool] = Form(None),
+):
+    """
+    Detect road marks in a video, streaming one NDJSON line per frame with
+    its timestamp, then a summary line. Either upload a video file or pass
+    `source`, an rtsp/http(s) stream URL on a host or under a prefix listed
+    in VIDEO_ALLOWED_SOURCES. Every `stride`-th frame is run.
+    In realtime mode (the default for streams) frames that fall more than
+    VIDEO_MAX_LAG_SECONDS behind the wall clock are dropped.
+    """
+    if not models.current:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if (file is None) == (source is None):
+        raise HTTPException(
+            status_code=400, detail="Provide exactly one of file or source"
+        )
+
+    temp_path = None
+    if file is not None:
+        # VideoCapture needs a path; spool the upload to disk off the loop
+        suffix = Path(file.filename or "").suffix or ".mp4"
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            temp_path = tmp.name
+            await asyncio.get_running_loop().run_in_executor(
+                None, shutil.copyfileobj, file.file, tmp
+            )
+        video_source = temp_path
+        is_stream = False
+    else:
+        if not VIDEO_ALLOWED_SOURCES:
+            raise HTTPException(
+                status_code=403, detail="Remote video sources are disabled"
+            )
+        if not stream_allowed(source, VIDEO_ALLOWED_SOURCES):
+            raise HTTPException(status_code=403, detail="Stream URL not allowed")
+        video_source = source
+        is_stream = True
+
+    if realtime is None:
+        realtime = is_stream
+    reader = FrameReader(
+        video_source, stride=stride, queue_size=BULK_WINDOW, realtime=realtime
+    )
+
+    async def stream():
+        try:
+            async for line in stream_detections(
+                reader,
+                infer_frame,
+                window=BULK_WINDOW,
+                max_lag=VIDEO_MAX_LAG_SECONDS if realtime else None,
+            ):
+                yield encode_line(line)
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# =========================
+# OFFLINE JOB ENDPOINTS
+# =========================
+async def predict_job_image(index: int, content: bytes, resolution: str) -> Dict:
+    """One job input -> one result record; errors are recorded, not raised."""
+    if not content:
+        return {"index": index, "error": "Could not read input"}
+    handle = models.current
+    version = handle.version if handle else None
+    imgsz = handle_imgsz(handle, resolution)
+    try:
+        image, _ = await asyncio.get_running_loop().run_in_executor(
+            None, decode_and_hash, content, imgsz, version
+        )
+        batched = await jobs_batcher.submit(
+            ModelInput(image.array, imgsz), block=True
+        )
+    except Exception as e:
+        return {"index": index, "error": str(e)}
+
+    detections = batched.result.scaled(image.scale)
+    record_detections(detections)
+    return {
+        "index": index,
+        "model_version": detections.model_version,
+        "detections": len(detections),
+        "predictions": detections.to_records(),
+    }
+
+
+async def predict_job_batch(
+    items: List[Tuple[int, bytes]], resolution: str
+) -> List[Dict]:
+    # Submitted together, so the jobs batcher fills whole model batches
+    return list(
+        await asyncio.gather(
+            *(predict_job_image(index, content, resolution) for index, content in items)
+        )
+    )
+
+
+job_runner = JobRunner(
+    job_store,
+    job_objects,
+    predict_job_batch,
+    work_dir=JOBS_DIR,
+    output_prefix=JOBS_OUTPUT_PREFIX,
+    batch_size=JOBS_BATCH_SIZE,
+    fetch_workers=JOBS_FETCH_WORKERS,
+)
+
+JOB_MEDIA_TYPES = {
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def get_job_or_404(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+def submit_job(request: JobRequest):
+    """
+    Queue an offline inference job over `inputs` (s3:// URIs, or paths
+    under JOBS_FILES_ROOT on the server) and return its id straight away.
+    Poll GET /jobs/{id} for progress; when it has succeeded, results are at
+    `output_uri` (one record per input with its index and source) and can be
+    downloaded from /jobs/{id}/results.
+    """
+    if not JOBS_ENABLED:
+        raise HTTPException(status_code=404, detail="Jobs are disabled")
+    check_resolution(request.resolution)
+    if request.output_format not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"output_format must be one of {', '.join(OUTPUT_FORMATS)}",
+        )
+    if not request.inputs:
+        raise HTTPException(status_code=400, detail="No inputs given")
+    if len(request.inputs) > JOBS_MAX_INPUTS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {JOBS_MAX_INPUTS} inputs per job"
+        )
+    for uri in request.inputs:
+        try:
+            job_objects.check_input(uri)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return job_store.create(request).to_dict()
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_job_or_404(job_id).to_dict()
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued or running job; running ones stop after their batch."""
+    job = get_job_or_404(job_id)
+    if not job_store.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    return get_job_or_404(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/results")
+def job_results(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    body = job_objects.open(job.output_uri)
+
+    def stream():
+        try:
+            yield from iter(lambda: body.read(1024 * 1024), b"")
+        finally:
+            body.close()
+
+    filename = f"{job.id}.{job.output_format}"
+    return StreamingResponse(
+        stream(),
+        media_type=JOB_MEDIA_TYPES[job.output_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
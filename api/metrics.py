@@ -1,16 +1,329 @@
-from prometheus_client import Counter, Histogram
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from api.profiling import add_stage
+
+# Where a request spends its time, in pipeline order. preprocess, forward
+# and nms come from the model's own per-image timings.
+STAGES = (
+    "upload_read",
+    "decode",
+    "resize",
+    "tile",
+    "preprocess",
+    "forward",
+    "nms",
+    "tile_merge",
+    "serialization",
+)
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0,
+    2.5, 5.0, 10.0,
+)
+STAGE_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+START_TIME = Gauge(
+    "api_start_time_seconds",
+    "Unix time the API process started",
+    multiprocess_mode="min",
+)
+START_TIME.set_to_current_time()
 
 REQUEST_COUNT = Counter(
     "inference_requests_total",
-    "Total number of inference requests"
+    "Total number of inference requests",
+    ["endpoint", "status"],
 )
 
 INFERENCE_LATENCY = Histogram(
     "inference_latency_seconds",
-    "Inference latency"
+    "End-to-end latency of successful requests",
+    ["endpoint", "model_version"],
+    buckets=LATENCY_BUCKETS,
+)
+
+STAGE_LATENCY = Histogram(
+    "inference_stage_seconds",
+    "Time spent per image in each stage of the request pipeline",
+    ["stage", "model_version"],
+    buckets=STAGE_BUCKETS,
 )
 
 DETECTION_COUNT = Counter(
     "detections_total",
-    "Total number of detected objects"
+    "Total number of detected objects",
+    ["class", "model_version"],
+)
+
+BATCH_SIZE = Histogram(
+    "inference_batch_size",
+    "Number of images per batched forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+BATCH_QUEUE_WAIT = Histogram(
+    "inference_queue_wait_seconds",
+    "Time a request waits in the batch queue before dispatch",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "inference_queue_depth",
+    "Requests waiting in the admission queue",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+INFERENCE_IN_FLIGHT = Gauge(
+    "inference_in_flight",
+    "Batches currently running on inference workers",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+REJECTED_REQUESTS = Counter(
+    "inference_rejected_requests_total",
+    "Requests rejected because the admission queue was full"
+)
+
+
+MODEL_WARMUP_SECONDS = Gauge(
+    "model_warmup_seconds",
+    "Time spent warming up a model version before it served traffic",
+    ["version", "phase"],
+    multiprocess_mode="livemax",
+)
+
+MODEL_INFO = Gauge(
+    "api_model_info",
+    "Currently served model version (1 = serving)",
+    ["version", "run_id", "backend"],
+    multiprocess_mode="livemax",
+)
+
+VIDEO_DECODE_LATENCY = Histogram(
+    "video_decode_seconds",
+    "Time to decode one video frame",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+VIDEO_INFERENCE_LATENCY = Histogram(
+    "video_inference_seconds",
+    "Time from submitting a frame to receiving its detections"
+)
+
+VIDEO_FRAMES = Counter(
+    "video_frames_total",
+    "Video frames run through the model"
+)
+
+VIDEO_DROPPED_FRAMES = Counter(
+    "video_dropped_frames_total",
+    "Video frames dropped before inference",
+    ["reason"],
+)
+
+TILES = Counter(
+    "inference_tiles_total",
+    "Tiles cut from images in tiled mode",
+    ["outcome"],
 )
+
+JOBS = Counter(
+    "inference_jobs_total",
+    "Offline inference jobs by the status they reached",
+    ["status"],
+)
+
+JOB_IMAGES = Counter(
+    "inference_job_images_total",
+    "Images processed by offline inference jobs",
+    ["outcome"],
+)
+
+RESULT_CACHE_HITS = Counter(
+    "result_cache_hits_total",
+    "Predictions served from the result cache",
+    ["kind"],
+)
+
+RESULT_CACHE_MISSES = Counter(
+    "result_cache_misses_total",
+    "Predictions that had to run the model"
+)
+
+RESULT_CACHE_EVICTIONS = Counter(
+    "result_cache_evictions_total",
+    "Entries removed from the result cache",
+    ["reason"],
+)
+
+RESULT_CACHE_BYTES = Gauge(
+    "result_cache_bytes",
+    "Approximate memory held by the result cache",
+    multiprocess_mode="livesum",
+)
+
+
+# =========================
+# RECORDING
+# =========================
+def version_label(model_version: Optional[str]) -> str:
+    return model_version or "none"
+
+
+def observe_stage(
+    stage: str,
+    seconds: float,
+    model_version: Optional[str] = None,
+    start: Optional[float] = None,
+):
+    """Record one stage in the histogram and in the request's profile, if any."""
+    STAGE_LATENCY.labels(stage, version_label(model_version)).observe(seconds)
+    add_stage(stage, seconds, start)
+
+
+@contextmanager
+def time_stage(stage: str, model_version: Optional[str] = None):
+    """Time the enclosed block as one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, model_version, start)
+
+
+def record_request(
+    endpoint: str,
+    status: str,
+    latency: Optional[float] = None,
+    model_version: Optional[str] = None,
+):
+    """Count a finished request; successful ones also feed the latency histogram."""
+    REQUEST_COUNT.labels(endpoint, status).inc()
+    if latency is not None:
+        INFERENCE_LATENCY.labels(endpoint, version_label(model_version)).observe(
+            latency
+        )
+
+
+def record_detections(detections):
+    """Count one image's detections per class."""
+    if not len(detections):
+        return
+    version = version_label(detections.model_version)
+    class_ids, counts = np.unique(detections.class_ids, return_counts=True)
+    for class_id, count in zip(class_ids.tolist(), counts.tolist()):
+        name = detections.names.get(class_id, "unknown")
+        DETECTION_COUNT.labels(name, version).inc(count)
+
+
+# =========================
+# EXPOSITION
+# =========================
+def _registry() -> CollectorRegistry:
+    """The default registry, or one aggregating all gunicorn workers."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_latest() -> bytes:
+    """Render all collectors, aggregating across worker processes if needed."""
+    return generate_latest(_registry())
+
+
+def _quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """Estimate a quantile from cumulative buckets, like histogram_quantile."""
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for upper, count in buckets:
+        if count >= rank:
+            if upper == float("inf"):
+                return lower
+            if count == below:
+                return upper
+            return lower + (upper - lower) * (rank - below) / (count - below)
+        lower, below = upper, count
+    return lower
+
+
+def _histogram_summary(
+    samples: Iterable, label: str, quantiles=(0.5, 0.95, 0.99)
+) -> Dict[str, Dict]:
+    buckets: Dict[str, Dict[float, float]] = {}
+    totals: Dict[str, Dict[str, float]] = {}
+    for sample in samples:
+        key = sample.labels.get(label)
+        if sample.name.endswith("_bucket"):
+            le = float(sample.labels["le"])
+            per_key = buckets.setdefault(key, {})
+            per_key[le] = per_key.get(le, 0.0) + sample.value
+        elif sample.name.endswith(("_count", "_sum")):
+            field = sample.name.rsplit("_", 1)[1]
+            per_key = totals.setdefault(key, {"count": 0.0, "sum": 0.0})
+            per_key[field] += sample.value
+
+    summary = {}
+    for key, per_key in totals.items():
+        cumulative = sorted(buckets.get(key, {}).items())
+        summary[key] = {
+            "count": int(per_key["count"]),
+            "mean": per_key["sum"] / per_key["count"] if per_key["count"] else 0.0,
+            **{f"p{round(q * 100)}": _quantile(q, cumulative) for q in quantiles},
+        }
+    return summary
+
+
+def snapshot() -> Dict:
+    """Readable summary of the request metrics, for /metrics/json."""
+    families = {family.name: family for family in _registry().collect()}
+
+    def samples(name):
+        family = families.get(name)
+        return family.samples if family else []
+
+    requests: Dict[str, int] = {}
+    for sample in samples("inference_requests"):
+        if sample.name.endswith("_total"):
+            status = sample.labels["status"]
+            requests[status] = requests.get(status, 0) + int(sample.value)
+
+    detections: Dict[str, int] = {}
+    for sample in samples("detections"):
+        if sample.name.endswith("_total"):
+            name = sample.labels["class"]
+            detections[name] = detections.get(name, 0) + int(sample.value)
+
+    start_times = [s.value for s in samples("api_start_time_seconds")]
+    return {
+        "uptime_seconds": time.time() - min(start_times) if start_times else 0.0,
+        "requests": requests,
+        "latency_seconds": _histogram_summary(
+            samples("inference_latency_seconds"), "endpoint"
+        ),
+        "stage_seconds": _histogram_summary(
+            samples("inference_stage_seconds"), "stage"
+        ),
+        "detections": detections,
+    }
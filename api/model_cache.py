@@ -0,0 +1,214 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+
+@dataclass
+class CachedModel:
+    path: Path
+    version: str
+    run_id: str
+    digest: str
+    offline: bool = False  # True when served from cache because MLflow was down
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _manifest(root: Path) -> Dict[str, str]:
+    return {
+        str(p.relative_to(root)): _sha256(p)
+        for p in sorted(root.rglob("*"))
+        if p.is_file()
+    }
+
+
+def _digest(manifest: Dict[str, str]) -> str:
+    h = hashlib.sha256()
+    for rel, sha in sorted(manifest.items()):
+        h.update(f"{rel}\0{sha}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+# =========================
+# MODEL ARTIFACT CACHE
+# =========================
+class ModelCache:
+    """Persistent, content-addressed cache of registered model artifacts.
+
+    Layout under ``root``::
+
+        index.json              registered version -> entry, plus last good
+        objects/<digest>/...    artifact tree, named by a hash of its files
+
+    Versions whose artifacts are identical share one object. Every hit is
+    checked against the stored file hashes, objects beyond ``max_bytes`` are
+    evicted least-recently-used first, and if MLflow or MinIO cannot be
+    reached the last version passed to ``mark_good`` is returned instead.
+    """
+
+    def __init__(
+        self, root: str, max_bytes: int, client: Optional[MlflowClient] = None
+    ):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.index_path = self.root / "index.json"
+        self.max_bytes = max_bytes
+        self.client = client or MlflowClient()
+
+    @contextmanager
+    def _locked(self):
+        # Created on first use, so constructing the cache touches no files
+        self.objects.mkdir(parents=True, exist_ok=True)
+        # Serialise access between API worker processes sharing the cache
+        with open(self.root / ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self) -> Dict:
+        if self.index_path.exists():
+            try:
+                return json.loads(self.index_path.read_text())
+            except ValueError:
+                print("⚠️ Model cache index is corrupt, starting fresh")
+        return {"versions": {}, "last_good": None}
+
+    def _save_index(self, index: Dict):
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(index, indent=2))
+        os.replace(tmp, self.index_path)
+
+    def _verify(self, entry: Dict) -> bool:
+        path = self.objects / entry["digest"]
+        if not path.is_dir():
+            return False
+        for rel, sha in entry["files"].items():
+            file_path = path / rel
+            if not file_path.is_file() or _sha256(file_path) != sha:
+                print(f"⚠️ Cached artifact failed verification: {file_path}")
+                return False
+        return True
+
+    def _hit(self, index: Dict, version: str, offline: bool = False) -> CachedModel:
+        entry = index["versions"][version]
+        entry["last_used"] = time.time()
+        self._save_index(index)
+        return CachedModel(
+            path=self.objects / entry["digest"],
+            version=version,
+            run_id=entry["run_id"],
+            digest=entry["digest"],
+            offline=offline,
+        )
+
+    def _fallback(self, index: Dict, error: Exception) -> CachedModel:
+        version = index.get("last_good")
+        if version and version in index["versions"] and self._verify(
+            index["versions"][version]
+        ):
+            print(f"⚠️ MLflow unreachable ({error}); using cached version {version}")
+            return self._hit(index, version, offline=True)
+        raise RuntimeError(f"MLflow unreachable and no cached model: {error}")
+
+    def _download(self, name: str, version: str) -> Dict:
+        staging = Path(tempfile.mkdtemp(prefix="download-", dir=self.root))
+        try:
+            mlflow.artifacts.download_artifacts(
+                f"models:/{name}/{version}", dst_path=str(staging)
+            )
+            files = _manifest(staging)
+            digest = _digest(files)
+            target = self.objects / digest
+            if target.exists():
+                shutil.rmtree(staging)
+            else:
+                os.replace(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return {
+            "digest": digest,
+            "files": files,
+            "size": sum(p.stat().st_size for p in target.rglob("*") if p.is_file()),
+        }
+
+    def _evict(self, index: Dict, keep: str):
+        versions = index["versions"]
+        protected = {
+            versions[v]["digest"]
+            for v in (keep, index.get("last_good"))
+            if v in versions
+        }
+
+        objects = {}  # digest -> (size, last_used)
+        for entry in versions.values():
+            size, last_used = objects.get(entry["digest"], (entry["size"], 0))
+            objects[entry["digest"]] = (size, max(last_used, entry["last_used"]))
+
+        total = sum(size for size, _ in objects.values())
+        for digest, (size, _) in sorted(objects.items(), key=lambda kv: kv[1][1]):
+            if total <= self.max_bytes:
+                break
+            if digest in protected:
+                continue
+            shutil.rmtree(self.objects / digest, ignore_errors=True)
+            for version in [v for v, e in versions.items() if e["digest"] == digest]:
+                del versions[version]
+                print(f"🧹 Evicted cached model version {version}")
+            total -= size
+
+    def fetch(self, name: str, alias: str) -> CachedModel:
+        """Return a local copy of ``models:/name@alias``, downloading if needed."""
+        with self._locked():
+            index = self._load_index()
+
+            try:
+                model_version = self.client.get_model_version_by_alias(
+                    name=name, alias=alias
+                )
+            except Exception as e:
+                return self._fallback(index, e)
+            version, run_id = str(model_version.version), model_version.run_id
+
+            entry = index["versions"].get(version)
+            if entry and self._verify(entry):
+                print(f"⚡ Model version {version} served from cache")
+                return self._hit(index, version)
+
+            try:
+                print(f"⬇️ Downloading model version {version}")
+                entry = self._download(name, version)
+            except Exception as e:
+                return self._fallback(index, e)
+
+            entry.update({"run_id": run_id, "last_used": time.time()})
+            index["versions"][version] = entry
+            self._evict(index, keep=version)
+            return self._hit(index, version)
+
+    def mark_good(self, version: str):
+        """Record ``version`` as the offline fallback once it has loaded."""
+        with self._locked():
+            index = self._load_index()
+            if version in index["versions"]:
+                index["last_good"] = version
+                self._save_index(index)
@@ -0,0 +1,225 @@
+import copy
+import gc
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from api.metrics import MODEL_INFO, MODEL_WARMUP_SECONDS
+
+
+class ModelHandle:
+    """One loaded model version plus the pool of replicas serving it."""
+
+    def __init__(
+        self,
+        model: Any,
+        version: str,
+        run_id: str,
+        backend: str = "pt",
+        predict_kwargs: Optional[Dict] = None,
+        max_batch: Optional[int] = None,
+        imgsz: int = 640,
+        fixed_imgsz: bool = False,
+    ):
+        self.model = model
+        self.version = version
+        self.run_id = run_id
+        self.backend = backend
+        # Exported runtimes have a fixed input size and possibly batch size
+        self.predict_kwargs = predict_kwargs or {}
+        self.max_batch = max_batch
+        # Training resolution, and whether the runtime can run at any other
+        self.imgsz = imgsz
+        self.fixed_imgsz = fixed_imgsz
+        self.loaded_at = time.time()
+        # Phase -> seconds, recorded by the warmup hook
+        self.warmup_seconds: Dict[str, float] = {}
+        self.in_flight = 0
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+        self._setup_lock = threading.Lock()
+
+    def _build_replica(self) -> Any:
+        # ultralytics keeps predictor state on the YOLO object, so concurrent
+        # callers each need their own; the copies share the nn.Module weights
+        with self._setup_lock:
+            replica = copy.copy(self.model)
+            replica.predictor = None
+            # Build the predictor (which fuses the shared weights) one
+            # replica at a time
+            replica(
+                np.zeros((32, 32, 3), dtype=np.uint8),
+                verbose=False,
+                **self.predict_kwargs,
+            )
+        return replica
+
+    @contextmanager
+    def replica(self):
+        """Check out an idle shallow copy of the model, building one if needed.
+
+        Replicas aren't tied to a thread, so they can be built and warmed
+        anywhere (e.g. the watcher thread) and then picked up by whichever
+        inference thread runs next.
+        """
+        with self._lock:
+            replica = self._idle.pop() if self._idle else None
+        if replica is None:
+            replica = self._build_replica()
+        try:
+            yield replica
+        finally:
+            with self._lock:
+                self._idle.append(replica)
+
+    def predict(self, inputs: List[Any], replica: Any = None, **kwargs) -> List[Any]:
+        if replica is None:
+            with self.replica() as replica:
+                return self.predict(inputs, replica, **kwargs)
+        kwargs = {**self.predict_kwargs, **kwargs}
+        step = self.max_batch or len(inputs)
+        results = []
+        for i in range(0, len(inputs), step):
+            results.extend(replica(inputs[i : i + step], **kwargs))
+        return results
+
+    def close(self):
+        with self._lock:
+            self._idle.clear()
+        self.model = None
+
+
+# =========================
+# MODEL MANAGER
+# =========================
+class ModelManager:
+    """Serve one model version at a time and hot-swap it when the alias moves.
+
+    A background thread calls ``probe`` every ``poll_interval`` seconds to
+    read the version the alias points at. When it changes, ``loader`` builds
+    the new version alongside the old one, ``warmup`` runs on it, and it is
+    swapped in atomically; the old version is released only after the
+    batches already running on it have finished.
+
+    Under gunicorn every worker runs its own watcher, so after the first
+    swap each worker holds a private copy of the new weights: the
+    copy-on-write sharing of the preloaded model only lasts until then, and
+    memory grows to one copy per worker. Restart the server to share a
+    single copy again.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], ModelHandle],
+        probe: Callable[[], str],
+        poll_interval: float = 30.0,
+        warmup: Optional[Callable[[ModelHandle], None]] = None,
+        drain_timeout: float = 60.0,
+    ):
+        self.loader = loader
+        self.probe = probe
+        self.poll_interval = poll_interval
+        self.warmup = warmup
+        self.drain_timeout = drain_timeout
+        self._current: Optional[ModelHandle] = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def current(self) -> Optional[ModelHandle]:
+        return self._current
+
+    @contextmanager
+    def acquire(self):
+        """Pin the current version for the duration of one batch."""
+        with self._cond:
+            handle = self._current
+            if handle is None:
+                raise RuntimeError("Model not loaded")
+            handle.in_flight += 1
+        try:
+            yield handle
+        finally:
+            with self._cond:
+                handle.in_flight -= 1
+                self._cond.notify_all()
+
+    def load(self) -> ModelHandle:
+        handle = self.loader()
+        if self.warmup:
+            self.warmup(handle)
+        self.swap(handle)
+        return handle
+
+    def swap(self, handle: ModelHandle):
+        with self._cond:
+            old, self._current = self._current, handle
+        self.publish()
+
+        if old is None:
+            return
+        print(f"🔀 Swapped model version {old.version} -> {handle.version}")
+        with self._cond:
+            drained = self._cond.wait_for(
+                lambda: old.in_flight == 0, timeout=self.drain_timeout
+            )
+        if not drained:
+            print(f"⚠️ Version {old.version} still busy after drain timeout")
+        MODEL_INFO.labels(
+            version=old.version, run_id=old.run_id, backend=old.backend
+        ).set(0)
+        old.close()
+        gc.collect()
+
+    def publish(self):
+        """Record the serving version's gauges in this process.
+
+        Called again in each gunicorn worker after fork: the preloading
+        master's values are dropped, and a forked process starts its own.
+        """
+        handle = self._current
+        if handle is None:
+            return
+        MODEL_INFO.labels(
+            version=handle.version, run_id=handle.run_id, backend=handle.backend
+        ).set(1)
+        for phase, seconds in handle.warmup_seconds.items():
+            MODEL_WARMUP_SECONDS.labels(version=handle.version, phase=phase).set(
+                seconds
+            )
+
+    def check_for_update(self):
+        version = self.probe()
+        current = self._current
+        if current is not None and version == current.version:
+            return
+        print(f"🆕 Alias moved to version {version}, loading it")
+        self.load()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check_for_update()
+            except Exception as e:
+                # Keep serving the current version; retry on the next poll
+                print(f"⚠️ Model reload failed: {e}")
+
+    def start_watcher(self):
+        if self._watcher is not None or self.poll_interval <= 0:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, name="model-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher is None:
+            return
+        self._stop.set()
+        self._watcher.join()
+        self._watcher = None
@@ -0,0 +1,106 @@
+import io
+from dataclasses import dataclass, replace
+from typing import NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# libjpeg can scale by 1/2, 1/4 or 1/8 while decoding (DCT scaling), which is
+# much cheaper than decoding at full size and resizing afterwards
+_REDUCED_JPEG_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+@dataclass
+class DecodedImage:
+    array: np.ndarray  # HxWx3 BGR, as expected by ultralytics
+    orig_width: int
+    orig_height: int
+    scale: float  # original pixels per decoded pixel
+
+
+def _reduction_factor(content: bytes, imgsz: int):
+    """Return (factor, width, height) for a JPEG much larger than imgsz."""
+    try:
+        with Image.open(io.BytesIO(content)) as header:
+            width, height = header.size
+            if header.format != "JPEG":
+                return 1, width, height
+            orientation = header.getexif().get(0x0112)
+    except Exception:
+        return 1, None, None
+
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+
+    long_side = max(width, height)
+    for factor, _ in _REDUCED_JPEG_FLAGS:
+        if long_side // factor >= imgsz:
+            return factor, width, height
+    return 1, width, height
+
+
+def decode_image(
+    content: bytes, imgsz: Optional[int] = None, reduced: bool = True
+) -> DecodedImage:
+    """Decode uploaded bytes in memory, without touching the filesystem.
+
+    When ``reduced`` is set and the source is a JPEG at least twice as large
+    as ``imgsz``, it is decoded directly at 1/2, 1/4 or 1/8 resolution while
+    keeping the long side >= ``imgsz``, so the model sees no loss of detail.
+    """
+    buffer = np.frombuffer(content, dtype=np.uint8)
+
+    factor, width, height = 1, None, None
+    if reduced and imgsz:
+        factor, width, height = _reduction_factor(content, imgsz)
+
+    flag = dict(_REDUCED_JPEG_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    array = cv2.imdecode(buffer, flag)
+    if array is None:
+        raise ValueError("Could not decode image")
+
+    if width is None or height is None:
+        height, width = array.shape[:2]
+
+    return DecodedImage(
+        array=array, orig_width=width, orig_height=height, scale=float(factor)
+    )
+
+
+class ModelInput(NamedTuple):
+    """One image queued for the model, at the size it will be run at."""
+
+    array: np.ndarray
+    imgsz: int
+
+    @property
+    def batch_key(self) -> Tuple:
+        # Equal shapes letterbox identically, so a batch needs no extra padding
+        return self.array.shape, self.imgsz
+
+
+def fit_to_imgsz(image: DecodedImage, imgsz: int) -> DecodedImage:
+    """Downscale so the long side is ``imgsz``, as the model's letterbox would.
+
+    Done here, on the decode threads and with area interpolation, the model's
+    own letterbox becomes a stride pad and images with the same aspect ratio
+    end up the same shape, so they batch together. Smaller images are left
+    for the model to upscale.
+    """
+    height, width = image.array.shape[:2]
+    long_side = max(height, width)
+    if long_side <= imgsz:
+        return image
+
+    ratio = imgsz / long_side
+    size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    array = cv2.resize(image.array, size, interpolation=cv2.INTER_AREA)
+    return replace(image, array=array, scale=image.scale * long_side / imgsz)
@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "request_profile", default=None
+)
+
+
+# =========================
+# PER-REQUEST STAGE TIMINGS
+# =========================
+class RequestProfile:
+    """Stage timings collected while one request is handled.
+
+    Only exists for requests that asked for Server-Timing or were sampled
+    for tracing; everywhere else ``current_profile()`` is None and recording
+    a stage costs one context variable lookup.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, Optional[float], float]] = []
+
+    def add(self, stage: str, seconds: float, start: Optional[float] = None):
+        offset = start - self.started if start is not None else None
+        self.spans.append((stage, offset, seconds))
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for stage, _, seconds in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def server_timing(self, total: float) -> str:
+        entries = [
+            f"{stage};dur={seconds * 1000:.2f}"
+            for stage, seconds in self.totals().items()
+        ]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+    def to_trace(self, total: float, status_code: int) -> Dict:
+        return {
+            "timestamp": time.time(),
+            "pid": os.getpid(),
+            "path": self.path,
+            "status_code": status_code,
+            "total_ms": total * 1000,
+            "spans": [
+                {
+                    "stage": stage,
+                    "start_ms": None if offset is None else offset * 1000,
+                    "duration_ms": seconds * 1000,
+                }
+                for stage, offset, seconds in self.spans
+            ],
+        }
+
+
+def add_stage(stage: str, seconds: float, start: Optional[float] = None):
+    profile = _current.get()
+    if profile is not None:
+        profile.add(stage, seconds, start)
+
+
+async def run_in_executor(fn: Callable, *args):
+    """``run_in_executor`` on the default pool, keeping the request context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, context.run, fn, *args
+    )
+
+
+class StageProfiler:
+    """ASGI-level hook that times requests to ``paths``.
+
+    With ``server_timing`` set every request gets a ``Server-Timing``
+    header; with ``sample_every`` = N, one request in N (on average) is also
+    kept as a trace in a ring buffer and, if ``trace_file`` is set, appended
+    to it as a JSON line.
+    """
+
+    def __init__(
+        self,
+        paths: Tuple[str, ...] = ("/predict",),
+        server_timing: bool = False,
+        sample_every: int = 0,
+        buffer_size: int = 100,
+        trace_file: Optional[str] = None,
+    ):
+        self.paths = paths
+        self.server_timing = server_timing
+        self.sample_every = max(0, sample_every)
+        self.trace_file = trace_file
+        self.traces: deque = deque(maxlen=max(1, buffer_size))
+        self._write_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.server_timing or self.sample_every > 0
+
+    def _sampled(self) -> bool:
+        return self.sample_every > 0 and random.random() * self.sample_every < 1
+
+    async def __call__(self, request, call_next):
+        if request.url.path not in self.paths:
+            return await call_next(request)
+        sampled = self._sampled()
+        if not (self.server_timing or sampled):
+            return await call_next(request)
+
+        profile = RequestProfile(request.url.path)
+        token = _current.set(profile)
+        try:
+            response = await call_next(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - profile.started
+
+        if self.server_timing:
+            response.headers["Server-Timing"] = profile.server_timing(total)
+        if sampled:
+            self._record(profile.to_trace(total, response.status_code))
+        return response
+
+    def _record(self, trace: Dict):
+        self.traces.append(trace)
+        if self.trace_file:
+            with self._write_lock, open(self.trace_file, "a") as f:
+                f.write(json.dumps(trace) + "\n")
+
+
+# =========================
+# ON-DEMAND PROFILES
+# =========================
+class StackSampler(threading.Thread):
+    """Sample every thread's Python stack at a fixed interval (py-spy style).
+
+    The result is in collapsed-stack format, one ``frame;frame;... count``
+    line per distinct stack, which flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                        f":{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> bytes:
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return ("\n".join(lines) + "\n").encode()
+
+
+class TorchCapture:
+    """Profile model forward passes with torch.profiler during a window.
+
+    torch.profiler only sees ops on the thread that started it, so inference
+    workers check ``active`` and wrap each batch themselves via ``batch()``.
+    Every profiled batch becomes a Chrome trace in the resulting zip, next
+    to a table of ops aggregated over the whole window.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._lock = threading.Lock()
+        self._traces: List[str] = []
+        self._ops: Dict[str, List[float]] = {}
+
+    def start(self):
+        with self._lock:
+            self._traces, self._ops = [], {}
+            self.active = True
+
+    @contextmanager
+    def batch(self):
+        if not self.active:
+            yield
+            return
+        with torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True
+        ) as prof:
+            yield
+        self._collect(prof)
+
+    def _collect(self, prof):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        try:
+            prof.export_chrome_trace(path)
+            with open(path) as f:
+                trace = f.read()
+        finally:
+            os.close(fd)
+            os.unlink(path)
+        with self._lock:
+            if not self.active:
+                return
+            self._traces.append(trace)
+            for event in prof.key_averages():
+                ops = self._ops.setdefault(event.key, [0, 0.0, 0.0])
+                ops[0] += event.count
+                ops[1] += event.self_cpu_time_total
+                ops[2] += event.cpu_time_total
+
+    def stop(self) -> bytes:
+        with self._lock:
+            self.active = False
+            traces, ops = self._traces, self._ops
+            self._traces, self._ops = [], {}
+
+        rows = sorted(ops.items(), key=lambda item: item[1][1], reverse=True)
+        table = [f"{'op':<60} {'calls':>8} {'self_cpu_ms':>12} {'cpu_ms':>12}"]
+        for name, (count, self_cpu, cpu) in rows:
+            table.append(
+                f"{name[:60]:<60} {count:>8} {self_cpu / 1000:>12.2f}"
+                f" {cpu / 1000:>12.2f}"
+            )
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("summary.txt", "\n".join(table) + "\n")
+            for i, trace in enumerate(traces):
+                archive.writestr(f"batch_{i:04d}.json", trace)
+        return buffer.getvalue()
@@ -0,0 +1,169 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from api.metrics import (
+    RESULT_CACHE_BYTES,
+    RESULT_CACHE_EVICTIONS,
+    RESULT_CACHE_HITS,
+    RESULT_CACHE_MISSES,
+)
+from api.serialization import Detections
+
+# Rough per-entry bookkeeping cost on top of the detection arrays
+_ENTRY_OVERHEAD = 512
+
+
+def content_key(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def dhash(image: np.ndarray) -> int:
+    """64-bit difference hash: robust to re-encoding, resizing and noise."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class _Entry(NamedTuple):
+    detections: Detections
+    phash: Optional[int]
+    shape: Tuple[int, ...]
+    created_at: float
+    size: int
+
+
+# =========================
+# RESULT CACHE
+# =========================
+class ResultCache:
+    """In-memory LRU cache of detections in front of the model.
+
+    Exact lookups use a hash of the uploaded bytes. With ``max_distance``
+    >= 0, images whose perceptual hash is within that many bits of a cached
+    one (and whose ``shape`` matches, so boxes still line up) are treated as
+    near-duplicates. The hash is split into ``max_distance + 1`` bands, and
+    any two hashes that close share at least one band exactly, so a lookup
+    only compares against entries in matching bands.
+
+    Entries belong to one model version: the first result stored for a new
+    version empties the cache. Entries expire after ``ttl`` seconds and the
+    least recently used ones are evicted beyond ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 3600.0, max_distance: int = -1):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.bands = max_distance + 1 if max_distance >= 0 else 0
+        self.version: Optional[str] = None
+        self.size = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._band_index: Dict[Tuple[int, int], Set[str]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def near_duplicates(self) -> bool:
+        return self.enabled and self.bands > 0
+
+    def _band_keys(self, phash: int):
+        width = 64 // self.bands
+        mask = (1 << width) - 1
+        return [(i, (phash >> (i * width)) & mask) for i in range(self.bands)]
+
+    def _remove(self, key: str, reason: Optional[str] = None):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        if entry.phash is not None:
+            for band in self._band_keys(entry.phash):
+                keys = self._band_index.get(band)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self._band_index[band]
+        if reason:
+            RESULT_CACHE_EVICTIONS.labels(reason=reason).inc()
+        RESULT_CACHE_BYTES.set(self.size)
+
+    def _live(self, key: str, version: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None or version != self.version:
+            return None
+        if time.time() - entry.created_at > self.ttl:
+            self._remove(key, "ttl")
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key: str, version: str) -> Optional[Detections]:
+        entry = self._live(key, version) if self.enabled else None
+        if entry is None:
+            return None
+        RESULT_CACHE_HITS.labels(kind="exact").inc()
+        return entry.detections
+
+    def get_similar(
+        self, phash: int, shape: Tuple[int, ...], version: str
+    ) -> Optional[Detections]:
+        if not self.near_duplicates:
+            return None
+        candidates = set()
+        for band in self._band_keys(phash):
+            candidates |= self._band_index.get(band, set())
+        for key in candidates:
+            entry = self._live(key, version)
+            if (
+                entry is not None
+                and entry.shape == shape
+                and bin(entry.phash ^ phash).count("1") <= self.max_distance
+            ):
+                RESULT_CACHE_HITS.labels(kind="similar").inc()
+                return entry.detections
+        return None
+
+    def miss(self):
+        if self.enabled:
+            RESULT_CACHE_MISSES.inc()
+
+    def put(
+        self,
+        key: str,
+        detections: Detections,
+        version: str,
+        phash: Optional[int] = None,
+        shape: Tuple[int, ...] = (),
+    ):
+        if not self.enabled:
+            return
+        if version != self.version:
+            for old_key in list(self._entries):
+                self._remove(old_key, "version")
+            self.version = version
+        if key in self._entries:
+            self._remove(key)
+
+        size = (
+            detections.boxes.nbytes
+            + detections.confidences.nbytes
+            + detections.class_ids.nbytes
+            + _ENTRY_OVERHEAD
+        )
+        if not self.near_duplicates:
+            phash = None
+        self._entries[key] = _Entry(detections, phash, shape, time.time(), size)
+        self.size += size
+        if phash is not None:
+            for band in self._band_keys(phash):
+                self._band_index.setdefault(band, set()).add(key)
+
+        while self.size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)), "lru")
+        RESULT_CACHE_BYTES.set(self.size)
@@ -0,0 +1,184 @@
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import msgpack
+import numpy as np
+import orjson
+from fastapi import Response
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.roadmark.columnar+json"
+MSGPACK = "application/msgpack"
+RAW = "application/octet-stream"
+
+# Accept value -> canonical response format
+SUPPORTED_TYPES = {
+    JSON: JSON,
+    "application/*": JSON,
+    "*/*": JSON,
+    COLUMNAR_JSON: COLUMNAR_JSON,
+    MSGPACK: MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    RAW: RAW,
+}
+
+
+# =========================
+# DETECTIONS
+# =========================
+@dataclass
+class Detections:
+    """One image's detections as flat arrays, read straight from the tensors."""
+
+    boxes: np.ndarray  # (N, 4) float32 x1, y1, x2, y2
+    confidences: np.ndarray  # (N,) float32
+    class_ids: np.ndarray  # (N,) int32
+    names: Dict[int, str]
+    model_version: Optional[str] = None  # version that produced them
+    timings: Optional[Dict[str, float]] = None  # model stage -> seconds
+
+    @classmethod
+    def from_result(
+        cls,
+        result,
+        model_version: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> "Detections":
+        boxes = result.boxes
+        return cls(
+            boxes=boxes.xyxy.cpu().numpy().astype(np.float32, copy=False),
+            confidences=boxes.conf.cpu().numpy().astype(np.float32, copy=False),
+            class_ids=boxes.cls.cpu().numpy().astype(np.int32),
+            names=result.names,
+            model_version=model_version,
+            timings=timings,
+        )
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    @property
+    def class_names(self) -> List[str]:
+        return [self.names.get(i, "unknown") for i in self.class_ids.tolist()]
+
+    def scaled(self, scale: float) -> "Detections":
+        """Map boxes from decoded-image space back to the original image."""
+        if scale == 1.0:
+            return self
+        return Detections(
+            self.boxes * scale,
+            self.confidences,
+            self.class_ids,
+            self.names,
+            self.model_version,
+            self.timings,
+        )
+
+    def to_records(self) -> List[Dict]:
+        """Row-wise form, identical in shape to ultralytics ``Results.tojson``."""
+        return [
+            {
+                "name": self.names.get(cls_id, "unknown"),
+                "class": cls_id,
+                "confidence": conf,
+                "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+            }
+            for (x1, y1, x2, y2), conf, cls_id in zip(
+                self.boxes.tolist(),
+                self.confidences.tolist(),
+                self.class_ids.tolist(),
+            )
+        ]
+
+    def to_columns(self) -> Dict:
+        """Column-wise form: one array per field plus the class name table."""
+        return {
+            "boxes": self.boxes,
+            "confidences": self.confidences,
+            "class_ids": self.class_ids,
+            "names": {str(k): v for k, v in self.names.items()},
+        }
+
+
+# =========================
+# ENCODING
+# =========================
+def dumps(obj) -> bytes:
+    """Fast JSON encoding that also handles numpy arrays and scalars."""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Pick the response format from an Accept header (None if unacceptable)."""
+    if not accept:
+        return JSON
+
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0 and media_type.strip().lower() in SUPPORTED_TYPES:
+            candidates.append((-quality, position, media_type.strip().lower()))
+
+    if not candidates:
+        return None
+    return SUPPORTED_TYPES[min(candidates)[2]]
+
+
+def encode_detections(
+    detections: Detections, meta: Dict, media_type: str = JSON
+) -> Response:
+    """Build the /predict response in the negotiated format.
+
+    ``meta`` holds the per-request fields (filename, count, timings...).
+    The raw format carries them as URL-quoted ``X-`` headers and the body is
+    little-endian: uint32 count, then float32 boxes (N x 4), float32
+    confidences and int32 class ids. ``X-Class-Names`` is the model's class
+    table as URL-quoted JSON, mapping each class id (as a string) to its
+    name: clients decode it with ``json.loads(urllib.parse.unquote(value))``
+    and look the int32 class ids up in it.
+    """
+    if media_type == RAW:
+        body = b"".join(
+            [
+                struct.pack("<I", len(detections)),
+                detections.boxes.astype("<f4", copy=False).tobytes(),
+                detections.confidences.astype("<f4", copy=False).tobytes(),
+                detections.class_ids.astype("<i4", copy=False).tobytes(),
+            ]
+        )
+        headers = {
+            f"X-{key.replace('_', '-').title()}": quote(str(value))
+            for key, value in meta.items()
+        }
+        # Header values must be latin-1; quoting keeps any class name intact
+        headers["X-Class-Names"] = quote(
+            dumps(detections.to_columns()["names"]).decode()
+        )
+        return Response(content=body, media_type=RAW, headers=headers)
+
+    if media_type == JSON:
+        payload = {**meta, "predictions": detections.to_records()}
+        return Response(content=dumps(payload), media_type=JSON)
+
+    payload = dict(meta)
+    columns = detections.to_columns()
+    if media_type == MSGPACK:
+        for key in ("boxes", "confidences", "class_ids"):
+            columns[key] = columns[key].tolist()
+        payload["predictions"] = columns
+        return Response(
+            content=msgpack.packb(payload, use_bin_type=True), media_type=MSGPACK
+        )
+
+    payload["predictions"] = columns
+    return Response(content=dumps(payload), media_type=COLUMNAR_JSON)
@@ -0,0 +1,99 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import cv2
+import numpy as np
+import torch
+import torchvision
+
+from api.serialization import Detections
+
+
+class Tile(NamedTuple):
+    x: int  # offset of the tile in the full image
+    y: int
+    image: np.ndarray
+
+
+def _starts(length: int, tile: int, stride: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Last tile flush with the edge, so every tile has the full size
+    starts.append(length - tile)
+    return starts
+
+
+def make_tiles(image: np.ndarray, tile_size: int, overlap: float = 0.2) -> List[Tile]:
+    """Split an image into overlapping ``tile_size`` squares.
+
+    Neighbouring tiles overlap by ``overlap`` of a tile, so an object cut by
+    one tile border is whole in the next tile. Tiles never extend past the
+    image; images smaller than a tile along an axis give a single, smaller
+    tile along that axis.
+    """
+    height, width = image.shape[:2]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    return [
+        Tile(x, y, image[y : y + tile_size, x : x + tile_size])
+        for y in _starts(height, tile_size, stride)
+        for x in _starts(width, tile_size, stride)
+    ]
+
+
+def road_fraction(image: np.ndarray) -> float:
+    """Share of pixels that look like road surface or paint.
+
+    Asphalt and lane paint are low-saturation greys and whites; sky,
+    vegetation and buildings are mostly saturated, very dark, or very bright
+    and blue-ish. Cheap enough to run on a downscaled copy of every tile.
+    """
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    saturation, value = hsv[..., 1], hsv[..., 2]
+    road = (saturation < 60) & (value > 40)
+    sky = (hsv[..., 0] > 90) & (hsv[..., 0] < 130) & (value > 150)
+    return float((road & ~sky).mean())
+
+
+def merge_tile_detections(
+    parts: Sequence[Detections],
+    offsets: Sequence[tuple],
+    names: Dict[int, str],
+    model_version: Optional[str] = None,
+    iou: float = 0.5,
+) -> Detections:
+    """Shift per-tile detections into image space and suppress duplicates.
+
+    Objects in the overlap are found by several tiles; class-aware NMS over
+    all tiles keeps the most confident box of each.
+    """
+    boxes = [
+        part.boxes + np.array([x, y, x, y], dtype=np.float32)
+        for part, (x, y) in zip(parts, offsets)
+        if len(part)
+    ]
+    if not boxes:
+        return Detections(
+            np.zeros((0, 4), np.float32),
+            np.zeros(0, np.float32),
+            np.zeros(0, np.int32),
+            names,
+            model_version,
+        )
+
+    boxes = np.concatenate(boxes)
+    confidences = np.concatenate([p.confidences for p in parts if len(p)])
+    class_ids = np.concatenate([p.class_ids for p in parts if len(p)])
+    keep = torchvision.ops.batched_nms(
+        torch.from_numpy(boxes),
+        torch.from_numpy(confidences),
+        torch.from_numpy(class_ids.astype(np.int64)),
+        iou,
+    ).numpy()
+    return Detections(
+        boxes[keep],
+        confidences[keep],
+        class_ids[keep],
+        names,
+        model_version,
+    )
@@ -0,0 +1,82 @@
+import asyncio
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+from typing import AsyncIterator, List, Tuple
+
+from fastapi import UploadFile
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+ZIP_TYPES = {"application/zip", "application/x-zip-compressed"}
+TAR_TYPES = {"application/x-tar", "application/gzip", "application/x-gzip"}
+
+
+def _is_image_name(name: str) -> bool:
+    return PurePosixPath(name).suffix.lower() in IMAGE_EXTENSIONS
+
+
+def _archive_kind(file: UploadFile) -> str:
+    name = (file.filename or "").lower()
+    content_type = file.content_type or ""
+    if content_type in ZIP_TYPES or name.endswith(".zip"):
+        return "zip"
+    if content_type in TAR_TYPES or name.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"
+    return ""
+
+
+def _zip_members(file: UploadFile) -> Tuple[zipfile.ZipFile, List[str]]:
+    archive = zipfile.ZipFile(file.file)
+    names = [
+        info.filename
+        for info in archive.infolist()
+        if not info.is_dir() and _is_image_name(info.filename)
+    ]
+    return archive, names
+
+
+def _tar_members(file: UploadFile) -> Tuple[tarfile.TarFile, List[tarfile.TarInfo]]:
+    archive = tarfile.open(fileobj=file.file, mode="r:*")
+    members = [
+        m for m in archive.getmembers() if m.isfile() and _is_image_name(m.name)
+    ]
+    return archive, members
+
+
+def _read_tar_member(archive: tarfile.TarFile, member: tarfile.TarInfo) -> bytes:
+    with archive.extractfile(member) as f:
+        return f.read()
+
+
+async def iter_upload_images(
+    files: List[UploadFile],
+) -> AsyncIterator[Tuple[str, bytes]]:
+    """Yield ``(name, bytes)`` for every image in a multipart upload.
+
+    Plain image parts are yielded as-is; zip and tar archives are expanded
+    one member at a time, so only the images currently being processed are
+    held in memory. Parts that are neither are yielded with empty content so
+    the caller can report them.
+    """
+    loop = asyncio.get_running_loop()
+    for file in files:
+        kind = _archive_kind(file)
+
+        if kind == "zip":
+            archive, names = await loop.run_in_executor(None, _zip_members, file)
+            with archive:
+                for name in names:
+                    content = await loop.run_in_executor(None, archive.read, name)
+                    yield f"{file.filename}/{name}", content
+        elif kind == "tar":
+            archive, members = await loop.run_in_executor(None, _tar_members, file)
+            with archive:
+                for member in members:
+                    content = await loop.run_in_executor(
+                        None, _read_tar_member, archive, member
+                    )
+                    yield f"{file.filename}/{member.name}", content
+        elif (file.content_type or "").startswith("image/"):
+            yield file.filename, await file.read()
+        else:
+            yield file.filename, b""
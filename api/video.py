@@ -0,0 +1,215 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from api.metrics import (
+    VIDEO_DECODE_LATENCY,
+    VIDEO_DROPPED_FRAMES,
+    VIDEO_FRAMES,
+    VIDEO_INFERENCE_LATENCY,
+)
+
+STREAM_SCHEMES = ("rtsp://", "rtmp://", "http://", "https://")
+
+
+def stream_allowed(source: str, allowed: Sequence[str]) -> bool:
+    """Whether the stream URL ``source`` may be opened.
+
+    Each ``allowed`` entry is either a host name, which admits any stream on
+    that host, or a URL prefix, which admits streams with the same scheme and
+    host:port whose path lies under the prefix's. Nothing is allowed when
+    ``allowed`` is empty.
+    """
+    if not source.lower().startswith(STREAM_SCHEMES):
+        return False
+    try:
+        url = urlsplit(source)
+        host, netloc = url.hostname, f"{url.hostname}:{url.port or ''}"
+    except ValueError:
+        return False
+    for entry in allowed:
+        if "://" not in entry:
+            if host == entry.lower():
+                return True
+            continue
+        prefix = urlsplit(entry)
+        root = prefix.path.rstrip("/")
+        if (
+            url.scheme == prefix.scheme.lower()
+            and netloc == f"{prefix.hostname}:{prefix.port or ''}"
+            and (url.path == root or url.path.startswith(root + "/"))
+            and ".." not in url.path.split("/")
+        ):
+            return True
+    return False
+
+
+class Frame(NamedTuple):
+    index: int
+    timestamp: float  # seconds from the start of the video
+    image: np.ndarray
+
+
+_END = object()
+
+
+# =========================
+# FRAME READER
+# =========================
+class FrameReader(threading.Thread):
+    """Decode frames from a video file or stream on a background thread.
+
+    Only every ``stride``-th frame is decoded (the others are grabbed and
+    skipped, which is much cheaper). Decoded frames go into a bounded queue;
+    in ``realtime`` mode a full queue evicts the oldest frame, so a slow
+    consumer sees recent frames instead of an ever-growing backlog.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        stride: int = 1,
+        queue_size: int = 32,
+        realtime: bool = False,
+    ):
+        super().__init__(name="frame-reader", daemon=True)
+        self.source = source
+        self.stride = max(1, stride)
+        self.realtime = realtime
+        self.frames: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self.error: Optional[str] = None
+        self.frames_read = 0
+        self.dropped = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def next_frame(self):
+        """Blocking get that gives up once the reader has stopped."""
+        while True:
+            try:
+                return self.frames.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop_event.is_set() or not self.is_alive():
+                    return _END
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if not self.realtime or item is _END:
+                    continue
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                    VIDEO_DROPPED_FRAMES.labels(reason="queue_full").inc()
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            if not capture.isOpened():
+                self.error = f"Could not open video source: {self.source}"
+                return
+            fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+            index = -1
+            while not self._stop_event.is_set():
+                if not capture.grab():
+                    break
+                index += 1
+                self.frames_read += 1
+                if index % self.stride:
+                    continue
+
+                decode_start = time.perf_counter()
+                ok, image = capture.retrieve()
+                VIDEO_DECODE_LATENCY.observe(time.perf_counter() - decode_start)
+                if not ok:
+                    continue
+
+                position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                timestamp = position if position > 0 else index / fps
+                self._put(Frame(index, timestamp, image))
+        finally:
+            capture.release()
+            self._put(_END)
+
+
+async def stream_detections(
+    reader: FrameReader,
+    infer: Callable[[np.ndarray], Awaitable[Dict]],
+    window: int = 8,
+    max_lag: Optional[float] = None,
+) -> AsyncIterator[Dict]:
+    """Run ``infer`` over the reader's frames and yield results in order.
+
+    Up to ``window`` frames are in flight at once so the batcher can group
+    them. With ``max_lag`` set, frames whose timestamp is already more than
+    ``max_lag`` seconds behind the wall clock are dropped before inference.
+    """
+    loop = asyncio.get_running_loop()
+    in_flight = deque()
+    started = time.monotonic()
+    inferred = dropped = 0
+
+    async def run(frame: Frame) -> Dict:
+        submitted = time.perf_counter()
+        result = await infer(frame.image)
+        VIDEO_INFERENCE_LATENCY.observe(time.perf_counter() - submitted)
+        VIDEO_FRAMES.inc()
+        return {"frame": frame.index, "timestamp": frame.timestamp, **result}
+
+    reader.start()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, reader.next_frame)
+            if item is _END:
+                break
+
+            lag = (time.monotonic() - started) - item.timestamp
+            if max_lag is not None and lag > max_lag:
+                dropped += 1
+                VIDEO_DROPPED_FRAMES.labels(reason="behind_realtime").inc()
+                continue
+
+            in_flight.append(asyncio.create_task(run(item)))
+            inferred += 1
+            while in_flight and (len(in_flight) >= window or in_flight[0].done()):
+                yield await in_flight.popleft()
+
+        while in_flight:
+            yield await in_flight.popleft()
+
+        yield {
+            "summary": {
+                "frames_read": reader.frames_read,
+                "frames_inferred": inferred,
+                "frames_dropped": dropped + reader.dropped,
+                "stride": reader.stride,
+                "error": reader.error,
+            }
+        }
+    finally:
+        reader.stop()
+        for task in in_flight:
+            task.cancel()
@@ -0,0 +1,83 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import torch
+
+from api.metrics import INFERENCE_IN_FLIGHT
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue cannot take another request."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+def default_torch_threads(num_workers: int) -> int:
+    """Split the available cores between workers so they don't oversubscribe."""
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    return max(1, cores // max(1, num_workers))
+
+
+def set_torch_threads(torch_threads: Optional[int], num_workers: int) -> int:
+    """Size torch's process-wide intra-op pool once for every inference thread.
+
+    ``num_workers`` counts the threads of all pools in the process, so with
+    the default of ``cores // num_workers`` they together use roughly one
+    thread per core. Call it after fork so it sees any CPU affinity.
+    """
+    torch_threads = torch_threads or default_torch_threads(num_workers)
+    torch.set_num_threads(torch_threads)
+    return torch_threads
+
+
+# =========================
+# INFERENCE WORKER POOL
+# =========================
+class InferencePool:
+    """Bounded thread pool that runs blocking inference off the event loop.
+
+    torch's thread count is process-wide and shared by every pool, so it is
+    set once with ``set_torch_threads`` rather than per pool. ``name`` labels
+    the pool's metrics, so bulk work doesn't show up as interactive load.
+    """
+
+    def __init__(self, num_workers: int = 1, name: str = "interactive"):
+        self.num_workers = max(1, num_workers)
+        self.name = name
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = INFERENCE_IN_FLIGHT.labels(pool=name)
+
+    def start(self):
+        if self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.num_workers, thread_name_prefix=f"inference-{self.name}"
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def run(self, fn: Callable, *args) -> Any:
+        if self._executor is None:
+            raise RuntimeError("Inference pool is not running")
+        self._in_flight.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            self._in_flight.dec()
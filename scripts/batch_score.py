@@ -0,0 +1,386 @@
+"""
+Score a whole dataset with the production model and write Parquet results.
+
+Images are listed from SCORE_SOURCE (a local directory or an s3://bucket/prefix
+on MinIO), fetched and decoded by a thread pool that stays SCORE_PREFETCH
+images ahead of the model, and run through the model in batches of
+SCORE_BATCH_SIZE. Every SCORE_PART_SIZE images become one Parquet part in
+SCORE_OUTPUT, next to a _manifest.json that records the finished parts and
+the model version, so a rerun skips the parts already written and scores
+the rest with the same version. A _summary.json with images/second is
+written at the end.
+
+Usage:
+    SCORE_SOURCE=s3://datasets/frames SCORE_OUTPUT=s3://scores/frames \\
+        python scripts/batch_score.py
+"""
+
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+# =========================================================
+# CONFIG
+# =========================================================
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
+MINIO_ENDPOINT = os.getenv("MLFLOW_S3_ENDPOINT_URL", "http://localhost:9000")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "minio")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "minio123")
+
+os.environ.update(
+    {
+        "MLFLOW_S3_ENDPOINT_URL": MINIO_ENDPOINT,
+        "AWS_ACCESS_KEY_ID": AWS_ACCESS_KEY_ID,
+        "AWS_SECRET_ACCESS_KEY": AWS_SECRET_ACCESS_KEY,
+    }
+)
+
+import mlflow  # noqa: E402
+from mlflow.tracking import MlflowClient  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from benchmark_backends import load_model  # noqa: E402
+
+MODEL_NAME = "road-mark-yolo"
+MODEL_ALIAS = "production"
+
+SOURCE = os.getenv("SCORE_SOURCE", "data/images")
+OUTPUT = os.getenv("SCORE_OUTPUT", "runs/batch_score")
+# Score local weights instead of the registry alias
+MODEL_PATH = os.getenv("SCORE_MODEL_PATH") or None
+IMGSZ = int(os.getenv("IMGSZ", "0")) or None  # default: the run's imgsz
+CPUS = os.cpu_count() or 1
+BATCH_SIZE = int(os.getenv("SCORE_BATCH_SIZE", "32"))
+PART_SIZE = int(os.getenv("SCORE_PART_SIZE", "2000"))
+DECODE_WORKERS = int(os.getenv("SCORE_DECODE_WORKERS", "0")) or CPUS
+PREFETCH = int(os.getenv("SCORE_PREFETCH", "0")) or BATCH_SIZE * 4
+TORCH_THREADS = int(os.getenv("SCORE_TORCH_THREADS", "0")) or CPUS
+# Start over even if the output holds parts from a different listing/model
+RESTART = os.getenv("SCORE_RESTART", "false").lower() == "true"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# =========================================================
+# STORAGE
+# =========================================================
+class Storage:
+    """A local directory or an s3://bucket/prefix, addressed by full key."""
+
+    def __init__(self, root: str):
+        self.root = root.rstrip("/")
+        self.is_s3 = self.root.startswith("s3://")
+        self._client = None
+        if self.is_s3:
+            self.bucket, _, self.prefix = self.root[len("s3://") :].partition("/")
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("s3", endpoint_url=MINIO_ENDPOINT)
+        return self._client
+
+    def list(self, suffixes: Tuple[str, ...] = IMAGE_EXTENSIONS) -> List[str]:
+        if not self.is_s3:
+            return sorted(
+                str(p)
+                for p in Path(self.root).rglob("*")
+                if p.is_file() and p.suffix.lower() in suffixes
+            )
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys += [
+                f"s3://{self.bucket}/{obj['Key']}"
+                for obj in page.get("Contents", [])
+                if obj["Key"].lower().endswith(suffixes)
+            ]
+        return sorted(keys)
+
+    def _object_key(self, key: str) -> str:
+        return key[len(f"s3://{self.bucket}/") :]
+
+    def read(self, key: str) -> bytes:
+        if not self.is_s3:
+            return Path(key).read_bytes()
+        obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        return obj["Body"].read()
+
+    def path(self, name: str) -> str:
+        return f"{self.root}/{name}"
+
+    def read_json(self, name: str) -> Optional[Dict]:
+        try:
+            return json.loads(self.read(self.path(name)))
+        except Exception:
+            return None
+
+    def write(self, name: str, data: bytes):
+        if not self.is_s3:
+            path = Path(self.path(name))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so a killed run never leaves half a file
+            tmp = path.with_name(f".{path.name}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(path)
+            return
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except Exception:
+            self.client.create_bucket(Bucket=self.bucket)
+        self.client.put_object(
+            Bucket=self.bucket, Key=self._object_key(self.path(name)), Body=data
+        )
+
+
+# =========================================================
+# MODEL
+# =========================================================
+def resolve_model(version: Optional[str]) -> Tuple[object, str, int]:
+    """Load ``version`` (or the production alias) as (model, version, imgsz)."""
+    if MODEL_PATH:
+        print(f"📦 Local model: {MODEL_PATH}")
+        return load_model(Path(MODEL_PATH), "pt"), "local", IMGSZ or 480
+
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    client = MlflowClient()
+    if version is None:
+        model_version = client.get_model_version_by_alias(MODEL_NAME, MODEL_ALIAS)
+    else:
+        model_version = client.get_model_version(MODEL_NAME, version)
+    version = str(model_version.version)
+    print(f"📦 Scoring with {MODEL_NAME} version {version}")
+
+    local_dir = mlflow.artifacts.download_artifacts(
+        artifact_uri=f"models:/{MODEL_NAME}/{version}"
+    )
+    pt_files = sorted(Path(local_dir).rglob("*.pt"))
+    if not pt_files:
+        raise RuntimeError(f"❌ No .pt file in version {version}")
+
+    imgsz = IMGSZ
+    if imgsz is None:
+        params = client.get_run(model_version.run_id).data.params
+        imgsz = int(params.get("imgsz", 480))
+    return load_model(pt_files[0], "pt"), version, imgsz
+
+
+# =========================================================
+# PIPELINE
+# =========================================================
+def load_image(storage: Storage, key: str, imgsz: int) -> Dict:
+    """Fetch, decode and downscale one image (runs on the decode pool)."""
+    row = {"key": key, "width": None, "height": None, "error": None}
+    try:
+        data = np.frombuffer(storage.read(key), dtype=np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode image")
+    except Exception as e:
+        row["error"] = str(e)
+        return row
+
+    height, width = image.shape[:2]
+    row["width"], row["height"], row["scale"] = width, height, 1.0
+    # Shrink to the model size here, in parallel, not in the model thread
+    long_side = max(width, height)
+    if long_side > imgsz:
+        row["scale"] = long_side / imgsz
+        size = (round(width / row["scale"]), round(height / row["scale"]))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    row["image"] = image
+    return row
+
+
+def prefetch(
+    pool: ThreadPoolExecutor, storage: Storage, keys: List[str], imgsz: int
+) -> Iterator[Dict]:
+    """Decoded rows in order, keeping up to PREFETCH loads in flight."""
+    pending = deque()
+    remaining = iter(keys)
+    for key in remaining:
+        pending.append(pool.submit(load_image, storage, key, imgsz))
+        if len(pending) >= PREFETCH:
+            break
+    while pending:
+        row = pending.popleft().result()
+        key = next(remaining, None)
+        if key is not None:
+            pending.append(pool.submit(load_image, storage, key, imgsz))
+        yield row
+
+
+def score_batch(model, rows: List[Dict], imgsz: int, version: str):
+    ok = [row for row in rows if row["error"] is None]
+    results = (
+        model([row.pop("image") for row in ok], imgsz=imgsz, verbose=False)
+        if ok
+        else []
+    )
+    for row, result in zip(ok, results):
+        boxes = result.boxes
+        class_ids = boxes.cls.cpu().numpy().astype(np.int32)
+        xyxy = boxes.xyxy.cpu().numpy() * row.pop("scale")
+        row.update(
+            num_detections=len(class_ids),
+            class_id=class_ids.tolist(),
+            class_name=[result.names[int(c)] for c in class_ids],
+            confidence=boxes.conf.cpu().numpy().tolist(),
+            x1=xyxy[:, 0].tolist(),
+            y1=xyxy[:, 1].tolist(),
+            x2=xyxy[:, 2].tolist(),
+            y2=xyxy[:, 3].tolist(),
+        )
+    for row in rows:
+        row["model_version"] = version
+
+
+def to_parquet(rows: List[Dict]) -> bytes:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    floats = pa.list_(pa.float32())
+    schema = pa.schema(
+        [
+            ("key", pa.string()),
+            ("width", pa.int32()),
+            ("height", pa.int32()),
+            ("model_version", pa.string()),
+            ("num_detections", pa.int32()),
+            ("class_id", pa.list_(pa.int32())),
+            ("class_name", pa.list_(pa.string())),
+            ("confidence", floats),
+            ("x1", floats),
+            ("y1", floats),
+            ("x2", floats),
+            ("y2", floats),
+            ("error", pa.string()),
+        ]
+    )
+    table = pa.Table.from_pylist(rows, schema=schema)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+def listing_fingerprint(keys: List[str]) -> str:
+    return hashlib.sha256("\n".join(keys).encode()).hexdigest()
+
+
+# =========================================================
+# MAIN
+# =========================================================
+if __name__ == "__main__":
+    torch.set_num_threads(TORCH_THREADS)
+    # Parallelism comes from the decode pool; keep OpenCV single-threaded
+    cv2.setNumThreads(1)
+
+    source, output = Storage(SOURCE), Storage(OUTPUT)
+    keys = source.list()
+    if not keys:
+        raise RuntimeError(f"❌ No images found in {SOURCE}")
+    fingerprint = listing_fingerprint(keys)
+    parts = [keys[i : i + PART_SIZE] for i in range(0, len(keys), PART_SIZE)]
+    print(f"🗂️ {len(keys)} images in {SOURCE}, {len(parts)} part(s)")
+
+    manifest = output.read_json("_manifest.json")
+    if manifest and not RESTART and (
+        manifest["fingerprint"] != fingerprint or manifest["part_size"] != PART_SIZE
+    ):
+        raise RuntimeError(
+            f"❌ {OUTPUT} holds results for a different listing or part size; "
+            "set SCORE_RESTART=true to overwrite them"
+        )
+    if manifest is None or RESTART:
+        pinned, done = None, set()
+        print(f"🆕 Starting a new scoring run into {OUTPUT}")
+    else:
+        pinned, done = manifest["model_version"], set(manifest["done"])
+        print(
+            f"♻️ Resuming: {len(done)}/{len(parts)} part(s) done "
+            f"with version {manifest['model_version']}"
+        )
+
+    # A resumed run keeps the version it started with, even if the alias moved
+    model, version, imgsz = resolve_model(pinned)
+    manifest = {
+        "source": SOURCE,
+        "fingerprint": fingerprint,
+        "part_size": PART_SIZE,
+        "model_name": MODEL_NAME,
+        "model_version": version,
+        "imgsz": imgsz,
+        "done": sorted(done),
+    }
+    output.write("_manifest.json", json.dumps(manifest, indent=2).encode())
+
+    todo = [(i, part) for i, part in enumerate(parts) if f"part-{i:05d}" not in done]
+    todo_keys = [key for _, part in todo for key in part]
+    print(
+        f"🚀 Scoring {len(todo_keys)} images: batch {BATCH_SIZE}, imgsz {imgsz}, "
+        f"{DECODE_WORKERS} decode workers, {TORCH_THREADS} torch threads"
+    )
+
+    # Warm up so the first part's throughput isn't skewed by lazy init
+    model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+
+    started = time.perf_counter()
+    scored = failed = 0
+    with ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix="decode") as pool:
+        rows_in = prefetch(pool, source, todo_keys, imgsz)
+        for index, part in todo:
+            part_started = time.perf_counter()
+            rows = []
+            while len(rows) < len(part):
+                batch = [
+                    next(rows_in) for _ in range(min(BATCH_SIZE, len(part) - len(rows)))
+                ]
+                score_batch(model, batch, imgsz, version)
+                rows += batch
+
+            name = f"part-{index:05d}"
+            output.write(f"{name}.parquet", to_parquet(rows))
+            manifest["done"] = sorted(set(manifest["done"]) | {name})
+            output.write("_manifest.json", json.dumps(manifest, indent=2).encode())
+
+            part_failed = sum(1 for row in rows if row["error"] is not None)
+            scored += len(rows)
+            failed += part_failed
+            elapsed = time.perf_counter() - part_started
+            print(
+                f"✅ {name}: {len(rows)} images ({part_failed} failed) in "
+                f"{elapsed:.1f}s, {len(rows) / elapsed:.1f} images/s"
+            )
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "source": SOURCE,
+        "output": OUTPUT,
+        "model_version": version,
+        "images": len(keys),
+        "scored_this_run": scored,
+        "failed_this_run": failed,
+        "seconds": elapsed,
+        "images_per_second": scored / elapsed if elapsed else None,
+        "batch_size": BATCH_SIZE,
+        "decode_workers": DECODE_WORKERS,
+        "torch_threads": TORCH_THREADS,
+    }
+    output.write("_summary.json", json.dumps(summary, indent=2).encode())
+    print(f"⏱️ {json.dumps(summary, indent=2)}")
+    print(f"🎉 Results written to {OUTPUT}")
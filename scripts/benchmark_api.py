@@ -0,0 +1,382 @@
+"""
+Load-test the inference API and report latency, throughput and resource use.
+
+Requests are replayed from a JSONL file, one request per line:
+
+    {"image": "data/test/images/0001.jpg", "endpoint": "/predict",
+     "accept": "application/json"}
+
+("endpoint" and "accept" are optional). Lines without an "image" are
+skipped; if none are usable, synthetic JPEG frames are sent instead.
+
+The target is either the app imported in-process (BENCH_TARGET=inprocess,
+driven through FastAPI's TestClient) or a running server
+(BENCH_TARGET=http://host:8000). In-process runs need no MLflow: set
+MODEL_PATH to a local .pt, or leave the default yolov8n.yaml stub.
+
+Each concurrency level in BENCH_CONCURRENCY is run for BENCH_DURATION
+seconds, either closed-loop (every client sends its next request as soon
+as the previous one returns) or, with BENCH_RATE > 0, open-loop: arrivals
+follow a Poisson process at BENCH_RATE requests/s and latency is measured
+from the scheduled arrival, so server-side queueing is not hidden.
+
+The JSON report (BENCH_OUTPUT) has throughput, p50/p95/p99 latency, error
+rate, CPU and peak RSS per scenario. With BENCH_BASELINE pointing at an
+earlier report, p99 and throughput are compared scenario by scenario and
+the script exits non-zero if p99 regressed by more than
+BENCH_MAX_REGRESSION (a fraction).
+
+Usage:
+    python scripts/benchmark_api.py [requests.jsonl]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import psutil
+
+# =========================================================
+# CONFIG
+# =========================================================
+TARGET = os.getenv("BENCH_TARGET", "inprocess")
+CONCURRENCY = [int(c) for c in os.getenv("BENCH_CONCURRENCY", "1,4,16").split(",")]
+RATE = float(os.getenv("BENCH_RATE", "0"))
+DURATION = float(os.getenv("BENCH_DURATION", "20"))
+WARMUP_REQUESTS = int(os.getenv("BENCH_WARMUP_REQUESTS", "5"))
+ENDPOINT = os.getenv("BENCH_ENDPOINT", "/predict")
+ACCEPT = os.getenv("BENCH_ACCEPT", "application/json")
+SYNTHETIC_COUNT = int(os.getenv("BENCH_SYNTHETIC_COUNT", "16"))
+SYNTHETIC_SIZE = os.getenv("BENCH_SYNTHETIC_SIZE", "1280x720")
+SERVER_PID = int(os.getenv("BENCH_SERVER_PID", "0")) or None
+OUTPUT_PATH = os.getenv("BENCH_OUTPUT", "runs/benchmark_api.json")
+BASELINE_PATH = os.getenv("BENCH_BASELINE")
+MAX_REGRESSION = float(os.getenv("BENCH_MAX_REGRESSION", "0.10"))
+
+# In-process runs never touch the registry, nor the API's /app paths
+os.environ.setdefault("MODEL_PATH", "yolov8n.yaml")
+os.environ.setdefault("RESULT_CACHE_MB", "0")
+os.environ.setdefault("JOBS_ENABLED", "false")
+SCRATCH_DIR = os.path.join(tempfile.gettempdir(), f"benchmark_api_{os.getpid()}")
+os.environ.setdefault("MODEL_CACHE_DIR", os.path.join(SCRATCH_DIR, "model_cache"))
+os.environ.setdefault("JOBS_DB", os.path.join(SCRATCH_DIR, "jobs.db"))
+os.environ.setdefault("JOBS_DIR", os.path.join(SCRATCH_DIR, "jobs"))
+
+
+# =========================================================
+# WORKLOAD
+# =========================================================
+def load_requests(path: Path) -> list:
+    """(filename, bytes, endpoint, accept) for every usable replay line."""
+    requests = []
+    if not path.exists():
+        return requests
+    for line in path.read_text().splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        image = entry.get("image")
+        if not image or not Path(image).exists():
+            continue
+        requests.append(
+            (
+                Path(image).name,
+                Path(image).read_bytes(),
+                entry.get("endpoint", ENDPOINT),
+                entry.get("accept", ACCEPT),
+            )
+        )
+    return requests
+
+
+def synthetic_requests(count: int = SYNTHETIC_COUNT) -> list:
+    """Random JPEG frames with a few painted lanes, at SYNTHETIC_SIZE."""
+    width, height = (int(v) for v in SYNTHETIC_SIZE.split("x"))
+    rng = np.random.default_rng(0)
+    requests = []
+    for i in range(count):
+        image = rng.integers(40, 90, (height, width, 3), dtype=np.uint8)
+        for _ in range(4):
+            x = int(rng.integers(0, width))
+            cv2.line(image, (x, height), (width // 2, height // 3), (230,) * 3, 8)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        requests.append((f"synthetic_{i}.jpg", encoded.tobytes(), ENDPOINT, ACCEPT))
+    return requests
+
+
+# =========================================================
+# CLIENTS
+# =========================================================
+class InProcessClient:
+    """The API app driven through TestClient, in this process."""
+
+    def __init__(self):
+        from fastapi.testclient import TestClient
+
+        sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+        from api.main import app
+
+        self._client = TestClient(app)
+        self._client.__enter__()  # runs the startup hooks (model load)
+        self.process = psutil.Process()
+
+    def send(self, request) -> int:
+        filename, content, endpoint, accept = request
+        response = self._client.post(
+            endpoint,
+            files={"file": (filename, content, "image/jpeg")},
+            headers={"Accept": accept},
+        )
+        return response.status_code
+
+    def close(self):
+        self._client.__exit__(None, None, None)
+
+
+class HttpClient:
+    """A running server, one keep-alive session per client thread."""
+
+    def __init__(self, base_url: str, pid=None):
+        import requests
+
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self._local = threading.local()
+        self.process = psutil.Process(pid) if pid else None
+
+    def send(self, request) -> int:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        filename, content, endpoint, accept = request
+        response = session.post(
+            self.base_url + endpoint,
+            files={"file": (filename, content, "image/jpeg")},
+            headers={"Accept": accept},
+            timeout=60,
+        )
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ResourceMonitor(threading.Thread):
+    """Sample CPU and RSS of a process (and its children) while a run lasts."""
+
+    def __init__(self, process, interval: float = 0.5):
+        super().__init__(name="resource-monitor", daemon=True)
+        self.process = process
+        self.interval = interval
+        self.cpu_samples = []
+        self.peak_rss = 0
+        self._stop_event = threading.Event()
+        self._known = {}
+
+    def _processes(self):
+        # cpu_percent is measured between calls on the same Process object,
+        # so keep one per pid (gunicorn workers are children of the master)
+        try:
+            current = [self.process] + self.process.children(recursive=True)
+        except psutil.Error:
+            current = [self.process]
+        for proc in current:
+            if proc.pid not in self._known:
+                self._known[proc.pid] = proc
+                proc.cpu_percent(None)
+        return [self._known[proc.pid] for proc in current]
+
+    def run(self):
+        self._processes()
+        while not self._stop_event.wait(self.interval):
+            cpu = rss = 0.0
+            for proc in self._processes():
+                try:
+                    cpu += proc.cpu_percent(None)
+                    rss += proc.memory_info().rss
+                except psutil.Error:
+                    continue
+            self.cpu_samples.append(cpu)
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join()
+        return {
+            "cpu_percent_mean": (
+                float(np.mean(self.cpu_samples)) if self.cpu_samples else None
+            ),
+            "rss_mb_peak": self.peak_rss / 1024**2 if self.peak_rss else None,
+        }
+
+
+# =========================================================
+# LOAD GENERATION
+# =========================================================
+def percentile(values: list, q: float) -> float:
+    return float(np.percentile(np.asarray(values), q)) if values else 0.0
+
+
+def run_scenario(client, requests: list, concurrency: int, rate: float) -> dict:
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def send(request, scheduled_at: float):
+        try:
+            status = client.send(request)
+        except Exception:
+            status = 0
+        latency = time.perf_counter() - scheduled_at
+        with lock:
+            latencies.append(latency)
+            statuses.append(status)
+
+    monitor = ResourceMonitor(client.process) if client.process else None
+    if monitor:
+        monitor.start()
+
+    started = time.perf_counter()
+    deadline = started + DURATION
+    if rate > 0:
+        # Open loop: arrivals don't wait for responses
+        rng = np.random.default_rng(concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            arrival, i = started, 0
+            while True:
+                arrival += rng.exponential(1.0 / rate)
+                if arrival >= deadline:
+                    break
+                time.sleep(max(0.0, arrival - time.perf_counter()))
+                executor.submit(send, requests[i % len(requests)], arrival)
+                i += 1
+    else:
+        # Closed loop: each client sends its next request when one returns
+        def loop(offset: int):
+            i = offset
+            while time.perf_counter() < deadline:
+                send(requests[i % len(requests)], time.perf_counter())
+                i += concurrency
+
+        threads = [
+            threading.Thread(target=loop, args=(c,)) for c in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [lat for lat, status in zip(latencies, statuses) if 200 <= status < 300]
+    errors = len(statuses) - len(ok)
+    report = {
+        "mode": "open" if rate > 0 else "closed",
+        "concurrency": concurrency,
+        "rate": rate or None,
+        "requests": len(statuses),
+        "errors": errors,
+        "error_rate": errors / len(statuses) if statuses else 0.0,
+        "status_codes": {
+            str(code): statuses.count(code) for code in sorted(set(statuses))
+        },
+        "throughput_rps": len(ok) / elapsed,
+        "latency_ms": {
+            "p50": percentile(ok, 50) * 1000,
+            "p95": percentile(ok, 95) * 1000,
+            "p99": percentile(ok, 99) * 1000,
+            "mean": float(np.mean(ok)) * 1000 if ok else 0.0,
+            "max": max(ok) * 1000 if ok else 0.0,
+        },
+    }
+    if monitor:
+        report.update(monitor.stop())
+    return report
+
+
+def scenario_key(report: dict) -> str:
+    return f"{report['mode']}-c{report['concurrency']}-r{report['rate']}"
+
+
+def compare(results: list, baseline_path: str) -> bool:
+    """Print deltas against a previous report; False if p99 regressed."""
+    baseline = {
+        scenario_key(r): r
+        for r in json.loads(Path(baseline_path).read_text())["scenarios"]
+    }
+    ok = True
+    for report in results:
+        before = baseline.get(scenario_key(report))
+        if before is None:
+            continue
+        p99_before = before["latency_ms"]["p99"]
+        p99_delta = (
+            report["latency_ms"]["p99"] / p99_before - 1 if p99_before else 0.0
+        )
+        rps_before = before["throughput_rps"]
+        rps_delta = report["throughput_rps"] / rps_before - 1 if rps_before else 0.0
+        regressed = p99_delta > MAX_REGRESSION
+        ok = ok and not regressed
+        print(
+            f"{'❌' if regressed else '✅'} {scenario_key(report)}: "
+            f"p99 {p99_delta:+.1%}, throughput {rps_delta:+.1%}"
+        )
+    return ok
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    replay_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("requests.jsonl")
+    requests = load_requests(replay_path)
+    if requests:
+        print(f"✅ Replaying {len(requests)} requests from {replay_path}")
+    else:
+        print(f"⚠️ No replayable requests in {replay_path}, using synthetic images")
+        requests = synthetic_requests()
+
+    if TARGET == "inprocess":
+        client = InProcessClient()
+    else:
+        client = HttpClient(TARGET, SERVER_PID)
+
+    try:
+        for request in requests[:WARMUP_REQUESTS]:
+            client.send(request)
+
+        results = []
+        for concurrency in CONCURRENCY:
+            mode = "open" if RATE > 0 else "closed"
+            print(f"⏱️ {mode} loop, concurrency {concurrency}")
+            results.append(run_scenario(client, requests, concurrency, RATE))
+            print(json.dumps(results[-1], indent=2))
+    finally:
+        client.close()
+
+    report = {
+        "commit": git_commit(),
+        "target": TARGET,
+        "model_path": os.environ.get("MODEL_PATH") if TARGET == "inprocess" else None,
+        "endpoint": ENDPOINT,
+        "duration_seconds": DURATION,
+        "scenarios": results,
+    }
+    Path(OUTPUT_PATH).parent.mkdir(parents=True, exist_ok=True)
+    Path(OUTPUT_PATH).write_text(json.dumps(report, indent=2))
+    print(f"🎉 Report written to {OUTPUT_PATH}")
+
+    if BASELINE_PATH and not compare(results, BASELINE_PATH):
+        sys.exit(1)
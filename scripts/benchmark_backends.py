@@ -0,0 +1,183 @@
+"""
+Benchmark the exported CPU runtimes against the raw .pt weights.
+
+For every artifact found next to best.pt (written by scripts/log_model.py)
+this measures single-image latency p50/p99, throughput at fixed batch sizes
+and mAP on the validation split, then writes a JSON report so backends can
+be compared before switching MODEL_BACKEND in the API. BENCH_BACKENDS limits
+the run to some backends and BENCH_SPLIT picks the dataset split (e.g. a
+held-out "test" split); scripts/register_model.py runs this once per model
+to compare a candidate with production.
+
+Usage:
+    python scripts/benchmark_backends.py [weights_dir]
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+# =========================================================
+# CONFIG
+# =========================================================
+DATA_YAML = os.getenv("DATA_YAML", "data/data.yaml")
+IMGSZ = int(os.getenv("IMGSZ", "480"))
+LATENCY_RUNS = int(os.getenv("BENCH_LATENCY_RUNS", "50"))
+BATCH_SIZES = [int(b) for b in os.getenv("BENCH_BATCH_SIZES", "1,4,8").split(",")]
+THROUGHPUT_SECONDS = float(os.getenv("BENCH_THROUGHPUT_SECONDS", "5"))
+RUN_MAP = os.getenv("BENCH_MAP", "true").lower() == "true"
+OUTPUT_PATH = os.getenv("BENCH_OUTPUT", "runs/benchmark_backends.json")
+SPLIT = os.getenv("BENCH_SPLIT", "val")
+# Comma-separated subset of BACKEND_GLOBS, empty for all
+BACKENDS = [b for b in os.getenv("BENCH_BACKENDS", "").split(",") if b]
+
+# Backend name -> artifact glob inside the weights directory
+BACKEND_GLOBS = {
+    "pt": "*.pt",
+    "onnx": "*.onnx",
+    "onnx_int8": "*_int8.onnx",
+    "torchscript": "*.torchscript",
+    "openvino": "*_openvino_model",
+}
+
+
+def find_artifacts(weights_dir: Path) -> dict:
+    artifacts = {}
+    for backend, pattern in BACKEND_GLOBS.items():
+        matches = sorted(weights_dir.glob(pattern))
+        if backend == "onnx":
+            matches = [p for p in matches if not p.stem.endswith("_int8")]
+        if backend == "pt":
+            matches = [p for p in matches if p.name == "best.pt"] or matches
+        if matches:
+            artifacts[backend] = matches[0]
+    return artifacts
+
+
+def load_model(path: Path, backend: str) -> YOLO:
+    if backend != "pt":
+        return YOLO(str(path), task="detect")
+
+    # Same weights_only workaround as the API, our own artifacts are trusted
+    original_load = torch.load
+
+    def safe_load(*args, **kwargs):
+        kwargs.setdefault("weights_only", False)
+        return original_load(*args, **kwargs)
+
+    torch.load = safe_load
+    try:
+        return YOLO(str(path))
+    finally:
+        torch.load = original_load
+
+
+def sample_images(count: int = 32) -> list:
+    """SPLIT images if the dataset is available, else synthetic frames."""
+    try:
+        from ultralytics.data.utils import check_det_dataset
+
+        val = check_det_dataset(DATA_YAML)[SPLIT]
+        paths = []
+        for root in val if isinstance(val, list) else [val]:
+            for ext in ("*.jpg", "*.jpeg", "*.png"):
+                paths.extend(sorted(Path(root).rglob(ext)))
+        images = [cv2.imread(str(p)) for p in paths[:count]]
+        images = [im for im in images if im is not None]
+        if images:
+            return images
+    except Exception as e:
+        print(f"⚠️ Validation images unavailable ({e}), using synthetic frames")
+
+    rng = np.random.default_rng(0)
+    return [
+        rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8) for _ in range(count)
+    ]
+
+
+def percentile(values: list, q: float) -> float:
+    return float(np.percentile(np.asarray(values), q)) if values else 0.0
+
+
+def benchmark_model(model: YOLO, images: list, run_map: bool = RUN_MAP) -> dict:
+    kwargs = {"imgsz": IMGSZ, "verbose": False}
+    for _ in range(3):
+        model(images[0], **kwargs)
+
+    latencies = []
+    for i in range(LATENCY_RUNS):
+        start = time.perf_counter()
+        model(images[i % len(images)], **kwargs)
+        latencies.append(time.perf_counter() - start)
+
+    throughput = {}
+    for batch_size in BATCH_SIZES:
+        batch = [images[i % len(images)] for i in range(batch_size)]
+        try:
+            done, start = 0, time.perf_counter()
+            while time.perf_counter() - start < THROUGHPUT_SECONDS:
+                model(batch, **kwargs)
+                done += batch_size
+            throughput[str(batch_size)] = done / (time.perf_counter() - start)
+        except Exception as e:
+            # Static-shape exports can't run batch sizes they weren't built for
+            print(f"⚠️ Batch size {batch_size} unsupported: {e}")
+            throughput[str(batch_size)] = None
+
+    report = {
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_images_per_second": throughput,
+    }
+
+    if run_map:
+        try:
+            metrics = model.val(
+                data=DATA_YAML, split=SPLIT, imgsz=IMGSZ, batch=1, verbose=False
+            )
+            report["map50_95"] = float(metrics.box.map)
+            report["map50"] = float(metrics.box.map50)
+        except Exception as e:
+            print(f"⚠️ mAP evaluation failed: {e}")
+            report["map50_95"] = report["map50"] = None
+
+    return report
+
+
+def latest_weights_dir() -> Path:
+    train_dirs = [
+        d
+        for d in Path("runs/detect").iterdir()
+        if d.is_dir() and d.name.startswith("train")
+    ]
+    if not train_dirs:
+        raise RuntimeError("❌ No YOLO training run found in runs/detect")
+    return max(train_dirs, key=lambda d: d.stat().st_mtime) / "weights"
+
+
+if __name__ == "__main__":
+    weights_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else latest_weights_dir()
+    artifacts = find_artifacts(weights_dir)
+    if BACKENDS:
+        artifacts = {b: p for b, p in artifacts.items() if b in BACKENDS}
+    if not artifacts:
+        raise RuntimeError(f"❌ No model artifacts found in {weights_dir}")
+    print(f"✅ Benchmarking {', '.join(artifacts)} from {weights_dir}")
+
+    images = sample_images()
+    results = {}
+    for backend, path in artifacts.items():
+        print(f"⏱️ {backend}: {path}")
+        results[backend] = benchmark_model(load_model(path, backend), images)
+        print(json.dumps(results[backend], indent=2))
+
+    Path(OUTPUT_PATH).parent.mkdir(parents=True, exist_ok=True)
+    Path(OUTPUT_PATH).write_text(json.dumps(results, indent=2))
+    print(f"🎉 Report written to {OUTPUT_PATH}")
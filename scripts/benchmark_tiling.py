@@ -0,0 +1,140 @@
+"""
+Benchmark tiled inference against full-frame inference on large frames.
+
+For each frame size in BENCH_FRAME_SIZES, validation images (or synthetic
+frames) are resized to that size and run two ways with the same weights:
+downscaled whole to IMGSZ, and cut into overlapping tiles that run as one
+batch and are merged with cross-tile NMS, the way the API's tiled mode does.
+The report has latency, throughput in megapixels per second and the number
+of detections for both, so the cost of tiling can be weighed against the
+small markings it recovers.
+
+Usage:
+    python scripts/benchmark_tiling.py [weights.pt]
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from api.serialization import Detections  # noqa: E402
+from api.tiling import make_tiles, merge_tile_detections, road_fraction  # noqa: E402
+from benchmark_backends import (  # noqa: E402
+    IMGSZ,
+    latest_weights_dir,
+    load_model,
+    percentile,
+    sample_images,
+)
+
+# =========================================================
+# CONFIG
+# =========================================================
+FRAME_SIZES = [
+    tuple(int(v) for v in size.split("x"))
+    for size in os.getenv("BENCH_FRAME_SIZES", "1920x1080,3840x2160").split(",")
+]
+TILE_SIZE = int(os.getenv("TILE_SIZE", "0")) or IMGSZ
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+TILE_NMS_IOU = float(os.getenv("TILE_NMS_IOU", "0.5"))
+TILE_FULL_FRAME = os.getenv("TILE_FULL_FRAME", "true").lower() == "true"
+TILE_SKIP_ROADLESS = os.getenv("TILE_SKIP_ROADLESS", "false").lower() == "true"
+TILE_MIN_ROAD_FRACTION = float(os.getenv("TILE_MIN_ROAD_FRACTION", "0.1"))
+RUNS = int(os.getenv("BENCH_RUNS", "10"))
+OUTPUT_PATH = os.getenv("BENCH_OUTPUT", "runs/benchmark_tiling.json")
+
+
+def full_frame(model, image: np.ndarray) -> int:
+    return len(model(image, imgsz=IMGSZ, verbose=False)[0].boxes)
+
+
+def tiled(model, image: np.ndarray) -> tuple:
+    tiles = make_tiles(image, TILE_SIZE, TILE_OVERLAP)
+    total = len(tiles)
+    if TILE_SKIP_ROADLESS:
+        tiles = [t for t in tiles if road_fraction(t.image) >= TILE_MIN_ROAD_FRACTION]
+
+    parts, offsets = [], []
+    if tiles:
+        results = model([t.image for t in tiles], imgsz=IMGSZ, verbose=False)
+        parts += [Detections.from_result(r) for r in results]
+        offsets += [(t.x, t.y) for t in tiles]
+    if TILE_FULL_FRAME and total > 1:
+        # Same as the API: a downscaled pass for objects larger than a tile
+        parts.append(
+            Detections.from_result(model(image, imgsz=IMGSZ, verbose=False)[0])
+        )
+        offsets.append((0, 0))
+
+    merged = merge_tile_detections(parts, offsets, model.names, iou=TILE_NMS_IOU)
+    return len(merged), len(tiles)
+
+
+def measure(fn, images: list) -> tuple:
+    fn(images[0])
+    latencies, counts = [], []
+    for i in range(RUNS):
+        start = time.perf_counter()
+        counts.append(fn(images[i % len(images)]))
+        latencies.append(time.perf_counter() - start)
+    return latencies, counts
+
+
+if __name__ == "__main__":
+    weights = (
+        Path(sys.argv[1]) if len(sys.argv) > 1 else latest_weights_dir() / "best.pt"
+    )
+    model = load_model(weights, "pt")
+    print(f"✅ Benchmarking tiling with {weights} (tile {TILE_SIZE}, imgsz {IMGSZ})")
+    base_images = sample_images(8)
+
+    report = {
+        "weights": str(weights),
+        "imgsz": IMGSZ,
+        "tile_size": TILE_SIZE,
+        "overlap": TILE_OVERLAP,
+        "frames": {},
+    }
+    for width, height in FRAME_SIZES:
+        images = [
+            cv2.resize(im, (width, height), interpolation=cv2.INTER_CUBIC)
+            for im in base_images
+        ]
+        megapixels = width * height / 1e6
+
+        full_latencies, full_counts = measure(
+            lambda im: full_frame(model, im), images
+        )
+        tiled_latencies, tiled_out = measure(lambda im: tiled(model, im), images)
+
+        entry = {}
+        for name, latencies, detections, extra in (
+            ("full_frame", full_latencies, full_counts, {}),
+            (
+                "tiled",
+                tiled_latencies,
+                [d for d, _ in tiled_out],
+                {"tiles_per_frame": float(np.mean([n for _, n in tiled_out]))},
+            ),
+        ):
+            mean = float(np.mean(latencies))
+            entry[name] = {
+                "latency_p50_ms": percentile(latencies, 50) * 1000,
+                "latency_p99_ms": percentile(latencies, 99) * 1000,
+                "megapixels_per_second": megapixels / mean,
+                "detections_per_frame": float(np.mean(detections)),
+                **extra,
+            }
+        report["frames"][f"{width}x{height}"] = entry
+        print(f"⏱️ {width}x{height}: {json.dumps(entry, indent=2)}")
+
+    Path(OUTPUT_PATH).parent.mkdir(parents=True, exist_ok=True)
+    Path(OUTPUT_PATH).write_text(json.dumps(report, indent=2))
+    print(f"🎉 Report written to {OUTPUT_PATH}")
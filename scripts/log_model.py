@@ -1,7 +1,16 @@
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 from pathlib import Path
+from typing import Dict, Optional
+import boto3
 import mlflow
 import mlflow.pyfunc
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from mlflow.tracking import MlflowClient
 from ultralytics import YOLO
 
 # =========================================================
@@ -15,6 +24,30 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "minio123")
 
 MODEL_NAME = "road-mark-yolo"
 EXPERIMENT_NAME = "road-mark-yolo"
+IMGSZ = 480
+
+# Optimized CPU runtimes exported next to best.pt (onnx, torchscript, openvino)
+EXPORT_FORMATS = [
+    f.strip()
+    for f in os.getenv("EXPORT_FORMATS", "onnx,torchscript").split(",")
+    if f.strip()
+]
+# Also write a dynamically INT8-quantized ONNX model (needs onnxruntime)
+EXPORT_INT8 = os.getenv("EXPORT_INT8", "true").lower() == "true"
+
+# Training-run files left out of the yolo_run artifacts (globs relative to
+# the run directory). last.pt and per-epoch checkpoints are only useful for
+# resuming training, which never happens from MLflow.
+ARTIFACT_EXCLUDE = [
+    p.strip()
+    for p in os.getenv(
+        "ARTIFACT_EXCLUDE", "weights/last.pt,weights/epoch*.pt"
+    ).split(",")
+    if p.strip()
+]
+# Files uploaded at once, and parallel parts per multipart upload
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+MULTIPART_CHUNK_MB = int(os.getenv("MULTIPART_CHUNK_MB", "16"))
 
 # Set environment variables for MLflow S3 backend
 os.environ.update(
@@ -33,13 +66,21 @@ mlflow.set_experiment(EXPERIMENT_NAME)
 # =========================================================
 RUNS_DIR = Path("runs/detect")
 
-train_dirs = [
-    d for d in RUNS_DIR.iterdir() if d.is_dir() and d.name.startswith("train")
-]
-if not train_dirs:
-    raise RuntimeError("❌ No YOLO training run found in runs/detect")
+# A specific run directory (e.g. the sweep's best trial) instead of the latest
+TRAIN_DIR = os.getenv("TRAIN_DIR") or None
 
-latest_train_dir = max(train_dirs, key=lambda d: d.stat().st_mtime)
+if TRAIN_DIR:
+    latest_train_dir = Path(TRAIN_DIR)
+    if not latest_train_dir.is_dir():
+        raise RuntimeError(f"❌ TRAIN_DIR {TRAIN_DIR} does not exist")
+else:
+    train_dirs = [
+        d for d in RUNS_DIR.iterdir() if d.is_dir() and d.name.startswith("train")
+    ]
+    if not train_dirs:
+        raise RuntimeError("❌ No YOLO training run found in runs/detect")
+
+    latest_train_dir = max(train_dirs, key=lambda d: d.stat().st_mtime)
 weights_path = latest_train_dir / "weights" / "best.pt"
 
 if not weights_path.exists():
@@ -48,6 +89,188 @@ if not weights_path.exists():
 print(f"✅ Using latest YOLO run: {latest_train_dir}")
 print(f"✅ Model weights: {weights_path}")
 
+# Arguments, auto-sizing and per-epoch timings from road_mark_detection.py
+train_config_path = latest_train_dir / "train_config.json"
+train_config = (
+    json.loads(train_config_path.read_text()) if train_config_path.exists() else {}
+)
+train_args = train_config.get("args", {})
+IMGSZ = int(train_args.get("imgsz", IMGSZ))
+
+# =========================================================
+# EXPORT OPTIMIZED CPU ARTIFACTS
+# =========================================================
+def export_artifacts(weights_path: Path) -> dict:
+    """
+    Export best.pt to each of EXPORT_FORMATS and return pyfunc artifacts
+    keyed "<format>_path". A failed export is skipped, the .pt still ships.
+    """
+    exported = {}
+    for fmt in EXPORT_FORMATS:
+        try:
+            print(f"📦 Exporting {fmt}...")
+            # dynamic=True keeps the batch axis free so the API can batch
+            path = YOLO(str(weights_path)).export(
+                format=fmt, imgsz=IMGSZ, dynamic=(fmt == "onnx")
+            )
+            exported[f"{fmt}_path"] = str(path)
+            print(f"✅ Exported {fmt}: {path}")
+        except Exception as e:
+            print(f"⚠️ Export to {fmt} failed, skipping: {e}")
+
+    if EXPORT_INT8 and "onnx_path" in exported:
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            onnx_path = Path(exported["onnx_path"])
+            int8_path = onnx_path.with_name(f"{onnx_path.stem}_int8.onnx")
+            quantize_dynamic(
+                str(onnx_path), str(int8_path), weight_type=QuantType.QUInt8
+            )
+            exported["onnx_int8_path"] = str(int8_path)
+            print(f"✅ Quantized INT8: {int8_path}")
+        except Exception as e:
+            print(f"⚠️ INT8 quantization failed, skipping: {e}")
+
+    return exported
+
+
+# =========================================================
+# ARTIFACT UPLOAD
+# =========================================================
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_artifact_hashes(weights_path: Path, exported: dict) -> Dict[str, str]:
+    """sha256 -> where log_model stores each file of the pyfunc artifacts."""
+    locations = {}
+    for path in [weights_path, *map(Path, exported.values())]:
+        files = sorted(p for p in path.rglob("*") if p.is_file())
+        for file in files if path.is_dir() else [path]:
+            rel = file.relative_to(path.parent).as_posix()
+            locations[sha256_file(file)] = f"model/artifacts/{rel}"
+    return locations
+
+
+def upload_run_dir(run_dir: Path, artifact_path: str, stored: Dict[str, str]):
+    """
+    Log ``run_dir`` under ``artifact_path`` like mlflow.log_artifacts, but:
+    files matching ARTIFACT_EXCLUDE are skipped, files whose content is
+    already stored (``stored``, e.g. best.pt in the pyfunc model) or appears
+    twice in the run are uploaded once, uploads run UPLOAD_WORKERS at a time
+    with multipart transfers, and objects already in S3 with the same hash
+    (from a failed earlier attempt) are not sent again. A manifest.json maps
+    every file to its hash and, when deduplicated, where its content lives.
+    """
+    files = sorted(p for p in run_dir.rglob("*") if p.is_file())
+    with ThreadPoolExecutor(UPLOAD_WORKERS) as pool:
+        hashes = dict(zip(files, pool.map(sha256_file, files)))
+
+    manifest = {"files": {}, "excluded": []}
+    to_upload = {}  # sha256 -> relative path of the one copy we upload
+    for path in files:
+        rel = path.relative_to(run_dir).as_posix()
+        if any(fnmatch(rel, pattern) for pattern in ARTIFACT_EXCLUDE):
+            manifest["excluded"].append(rel)
+            continue
+        digest = hashes[path]
+        entry = {"sha256": digest, "size": path.stat().st_size}
+        if digest in stored:
+            entry["stored_at"] = stored[digest]
+        elif digest in to_upload:
+            entry["stored_at"] = f"{artifact_path}/{to_upload[digest]}"
+        else:
+            to_upload[digest] = rel
+        manifest["files"][rel] = entry
+
+    artifact_uri = mlflow.get_artifact_uri(artifact_path)
+    if artifact_uri.startswith("s3://"):
+        bucket, _, prefix = artifact_uri[len("s3://") :].partition("/")
+        client = boto3.client("s3", endpoint_url=MINIO_ENDPOINT)
+        chunk = MULTIPART_CHUNK_MB * 1024 * 1024
+        config = TransferConfig(
+            multipart_threshold=chunk,
+            multipart_chunksize=chunk,
+            max_concurrency=UPLOAD_WORKERS,
+        )
+
+        def upload(item) -> str:
+            digest, rel = item
+            key = f"{prefix}/{rel}"
+            try:
+                head = client.head_object(Bucket=bucket, Key=key)
+                if head.get("Metadata", {}).get("sha256") == digest:
+                    return "unchanged"
+            except ClientError:
+                pass
+            client.upload_file(
+                str(run_dir / rel),
+                bucket,
+                key,
+                ExtraArgs={"Metadata": {"sha256": digest}},
+                Config=config,
+            )
+            return "uploaded"
+
+        with ThreadPoolExecutor(UPLOAD_WORKERS) as pool:
+            outcomes = list(pool.map(upload, to_upload.items()))
+    else:
+        # Local artifact store (no MinIO): nothing to parallelise
+        for rel in to_upload.values():
+            parent = str(Path(artifact_path, rel).parent)
+            mlflow.log_artifact(str(run_dir / rel), artifact_path=parent)
+        outcomes = ["uploaded"] * len(to_upload)
+
+    mlflow.log_dict(manifest, f"{artifact_path}/manifest.json")
+    print(
+        f"✅ Logged {len(manifest['files'])} run files: "
+        f"{outcomes.count('uploaded')} uploaded, "
+        f"{outcomes.count('unchanged')} already there, "
+        f"{len(manifest['files']) - len(to_upload)} deduplicated, "
+        f"{len(manifest['excluded'])} excluded"
+    )
+
+
+def unfinished_run(weights_sha256: str) -> Optional[str]:
+    """A failed/killed run that logged these same weights, to resume.
+
+    RUNNING runs are left alone: another process may still be logging.
+    """
+    experiment = mlflow.get_experiment_by_name(EXPERIMENT_NAME)
+    if experiment is None:
+        return None
+    runs = MlflowClient().search_runs(
+        [experiment.experiment_id],
+        filter_string=(
+            f"tags.weights_sha256 = '{weights_sha256}' "
+            "and attributes.status != 'FINISHED'"
+        ),
+        order_by=["attributes.start_time DESC"],
+        max_results=20,
+    )
+    for run in runs:
+        if run.info.status in ("FAILED", "KILLED"):
+            return run.info.run_id
+    return None
+
+
+def log_params(params: dict, logged: Dict[str, str]):
+    """mlflow.log_params, minus params a resumed run already has.
+
+    MLflow refuses to change a logged param, and a retry can legitimately
+    differ (e.g. exported_formats after an export failed the first time).
+    """
+    for key, value in params.items():
+        if key in logged and logged[key] != str(value):
+            print(f"⚠️ Keeping {key}={logged[key]} from the resumed run ({value})")
+    mlflow.log_params({k: v for k, v in params.items() if k not in logged})
+
+
 # =========================================================
 # YOLO MLflow WRAPPER
 # =========================================================
@@ -66,20 +289,73 @@ class YOLOv5Wrapper(mlflow.pyfunc.PythonModel):
 # =========================================================
 # LOG & REGISTER
 # =========================================================
-with mlflow.start_run(run_name=latest_train_dir.name):
+# Export first: the exports land next to best.pt, so the run upload below
+# can point at the copies stored with the model instead of storing them twice
+exported = export_artifacts(weights_path)
+
+weights_sha256 = sha256_file(weights_path)
+resume_id = unfinished_run(weights_sha256)
+logged_params = {}
+if resume_id:
+    print(f"♻️ Resuming unfinished run {resume_id}")
+    logged_params = MlflowClient().get_run(resume_id).data.params
+
+run_name = None if resume_id else latest_train_dir.name
+with mlflow.start_run(run_id=resume_id, run_name=run_name):
+    mlflow.set_tag("weights_sha256", weights_sha256)
+    # Lets scripts/pipeline_plan.py find this run when nothing has changed
+    for name, value in (train_config.get("fingerprints") or {}).items():
+        mlflow.set_tag(f"{name}_fingerprint", value)
+    if train_config.get("warm_start_from"):
+        mlflow.set_tag("warm_started_from", train_config["warm_start_from"])
 
     # -----------------------------
     # LOG PARAMS (minimal & safe)
     # -----------------------------
-    mlflow.log_param("model_type", "yolov8n")
-    mlflow.log_param("imgsz", 480)
-    mlflow.log_param("batch", 2)
-    mlflow.log_param("epochs", "see yolo_run/results.csv")
+    if train_config:
+        log_params(
+            {"model_type": Path(str(train_args["model"])).stem}, logged_params
+        )
+        log_params(
+            {k: v for k, v in train_args.items() if k not in ("model", "imgsz")},
+            logged_params,
+        )
+        log_params(
+            {f"sizing_{k}": v for k, v in train_config.get("sizing", {}).items()},
+            logged_params,
+        )
+        for epoch in train_config.get("epochs", []):
+            mlflow.log_metrics(
+                {
+                    k: v
+                    for k, v in epoch.items()
+                    if k.endswith(("_seconds", "_fraction"))
+                },
+                step=epoch["epoch"],
+            )
+        mlflow.log_metric("train_seconds", train_config["train_seconds"])
+    else:
+        log_params(
+            {
+                "model_type": "yolov8n",
+                "batch": 2,
+                "epochs": "see yolo_run/results.csv",
+            },
+            logged_params,
+        )
+    log_params({"imgsz": IMGSZ}, logged_params)
 
     # -----------------------------
     # LOG TRAINING ARTIFACTS
     # -----------------------------
-    mlflow.log_artifacts(local_dir=str(latest_train_dir), artifact_path="yolo_run")
+    log_params(
+        {"exported_formats": ",".join(sorted(exported)) or "none"}, logged_params
+    )
+    upload_run_dir(
+        latest_train_dir,
+        "yolo_run",
+        stored=model_artifact_hashes(weights_path, exported),
+    )
 
     # -----------------------------
     # LOG MODEL (CRITICAL PART)
@@ -87,7 +363,7 @@ with mlflow.start_run(run_name=latest_train_dir.name):
     mlflow.pyfunc.log_model(
         artifact_path="model",  # ⚠️ MUST BE "model"
         python_model=YOLOv5Wrapper(),
-        artifacts={"model_path": str(weights_path)},
+        artifacts={"model_path": str(weights_path), **exported},
         registered_model_name=MODEL_NAME,
     )
 
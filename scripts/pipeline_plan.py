@@ -0,0 +1,173 @@
+"""
+Fingerprint the training pipeline's inputs and decide what has to run.
+
+    code     the pipeline image's environment (Dockerfile.pipeline, whose
+             inline pip list defines it; requirements.txt is the API's and
+             isn't used by the image), from PIPELINE_IMAGE, and the
+             training scripts
+    hparams  the train arguments as configured (TRAIN_CONFIG / TRAIN_* env,
+             before auto-sizing) and the starting weights
+    data     every image of every split: path, size, mtime and labels
+    train    all of the above
+
+The plan is one of:
+
+    reuse       a finished run already logged a model with this train
+                fingerprint: skip training and logging, register that run
+    warm_start  the production model was trained with the same code and
+                hparams on a subset of today's images (data was only
+                appended): train from the production weights
+    train       anything else
+
+It is printed as one JSON line last, which Airflow keeps as the task's XCom
+and hands to the next steps as PIPELINE_PLAN.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# =========================================================
+# CONFIG
+# =========================================================
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
+MINIO_ENDPOINT = os.getenv("MLFLOW_S3_ENDPOINT_URL", "http://localhost:9000")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "minio")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "minio123")
+
+os.environ.update(
+    {
+        "MLFLOW_S3_ENDPOINT_URL": MINIO_ENDPOINT,
+        "AWS_ACCESS_KEY_ID": AWS_ACCESS_KEY_ID,
+        "AWS_SECRET_ACCESS_KEY": AWS_SECRET_ACCESS_KEY,
+    }
+)
+
+import mlflow  # noqa: E402
+from mlflow.tracking import MlflowClient  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from prepare_dataset import dataset_entries  # noqa: E402
+from road_mark_detection import load_config  # noqa: E402
+
+MODEL_NAME = "road-mark-yolo"
+MODEL_ALIAS = "production"
+EXPERIMENT_NAME = "road-mark-yolo"
+
+# {"image": ..., "environment": ...} printed by the DAG's build_image step
+PIPELINE_IMAGE = json.loads(os.getenv("PIPELINE_IMAGE") or "{}")
+TRAINING_SCRIPTS = ["road_mark_detection.py", "prepare_dataset.py"]
+# Artifact written by road_mark_detection.py and logged with yolo_run
+DATASET_ENTRIES = "dataset_entries.json"
+# Always train, ignoring earlier runs
+FORCE_TRAIN = os.getenv("PIPELINE_FORCE_TRAIN", "false").lower() == "true"
+
+
+def sha256(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def fingerprints(config: dict, entries: dict) -> dict:
+    scripts = Path(__file__).resolve().parent
+    code = sha256(
+        PIPELINE_IMAGE.get("environment", "").encode(),
+        *((scripts / name).read_bytes() for name in TRAINING_SCRIPTS),
+    )
+
+    weights = Path(str(config["model"]))
+    hparams = sha256(
+        json.dumps(config, sort_keys=True, default=str).encode(),
+        weights.read_bytes() if weights.is_file() else b"",
+    )
+    data = sha256(json.dumps(entries, sort_keys=True).encode())
+    return {
+        "code": code,
+        "hparams": hparams,
+        "data": data,
+        "train": sha256(code.encode(), hparams.encode(), data.encode()),
+    }
+
+
+def only_appended(previous: dict, current: dict) -> bool:
+    grew = False
+    for split, entries in current.items():
+        before = set(previous.get(split, []))
+        if not before <= set(entries):
+            return False
+        grew = grew or len(entries) > len(before)
+    return grew and set(previous) <= set(current)
+
+
+def plan(client: MlflowClient, prints: dict, entries: dict) -> dict:
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    if FORCE_TRAIN or experiment is None:
+        return {"action": "train"}
+
+    runs = client.search_runs(
+        [experiment.experiment_id],
+        filter_string=(
+            f"tags.train_fingerprint = '{prints['train']}' "
+            "and attributes.status = 'FINISHED'"
+        ),
+        order_by=["attributes.start_time DESC"],
+        max_results=1,
+    )
+    if runs:
+        return {"action": "reuse", "run_id": runs[0].info.run_id}
+
+    try:
+        production = client.get_model_version_by_alias(MODEL_NAME, MODEL_ALIAS)
+    except Exception:
+        return {"action": "train"}
+    tags = client.get_run(production.run_id).data.tags
+    if (tags.get("code_fingerprint"), tags.get("hparams_fingerprint")) != (
+        prints["code"],
+        prints["hparams"],
+    ):
+        return {"action": "train"}
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = mlflow.artifacts.download_artifacts(
+                run_id=production.run_id,
+                artifact_path=f"yolo_run/{DATASET_ENTRIES}",
+                dst_path=tmp,
+            )
+            previous = json.loads(Path(path).read_text())
+    except Exception as e:
+        print(f"⚠️ Production run has no dataset entries: {e}")
+        return {"action": "train"}
+
+    if only_appended(previous, entries):
+        return {
+            "action": "warm_start",
+            "run_id": production.run_id,
+            "warm_start_from": f"models:/{MODEL_NAME}/{production.version}",
+        }
+    return {"action": "train"}
+
+
+if __name__ == "__main__":
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    config = load_config()
+    entries = dataset_entries(config["data"])
+    prints = fingerprints(config, entries)
+    print(f"🔏 Fingerprints: {json.dumps(prints)}")
+
+    result = {**plan(MlflowClient(), prints, entries), "fingerprints": prints}
+    print(
+        {
+            "reuse": f"♻️ Nothing changed since run {result.get('run_id')}",
+            "warm_start": "🌡️ Only new images: warm-starting from production",
+            "train": "🚀 Inputs changed: training from scratch",
+        }[result["action"]]
+    )
+    print(json.dumps(result))
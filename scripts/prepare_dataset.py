@@ -0,0 +1,319 @@
+"""
+Pre-decode the training dataset into memory-mapped arrays.
+
+Every image of each split in DATA_YAML is decoded once, resized the way
+ultralytics does for training (long side = IMGSZ) and written into a fixed
+IMGSZ x IMGSZ slot of one uint8 .npy array, next to an index with each
+image's path, original and resized shape and labels. The store lives in
+DATASET_CACHE_DIR/<hash>, where the hash covers the image paths, sizes and
+mtimes, the label files' contents and IMGSZ, so rerunning this is a no-op
+until the data changes. ultralytics 8.0.196 resizes every split with
+INTER_LINEAR, so train and val stores hold the same pixels the regular
+loader would produce.
+
+The dataset class mirrors ultralytics 8.0.x internals; Dockerfile.pipeline
+pins the version (8.0.196, as in requirements.txt).
+
+scripts/road_mark_detection.py trains from the store through
+MemmapTrainer: epochs read pixels straight from the page cache instead of
+decoding JPEGs, and label verification is skipped. Splits without a store
+fall back to the regular loader.
+
+Usage:
+    python scripts/prepare_dataset.py
+"""
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.data.utils import IMG_FORMATS, check_det_dataset, img2label_paths
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+from ultralytics.utils.torch_utils import de_parallel
+
+# =========================================================
+# CONFIG
+# =========================================================
+DATA_YAML = os.getenv("DATA_YAML", "data/data.yaml")
+IMGSZ = int(os.getenv("IMGSZ", "480"))
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", "runs/dataset_cache")
+DECODE_WORKERS = int(os.getenv("PREPARE_WORKERS", "0")) or os.cpu_count() or 1
+SPLITS = ("train", "val")
+
+# Bump when the store layout changes, so old stores are not reused
+STORE_VERSION = 3
+
+
+# =========================================================
+# DATASET HASH
+# =========================================================
+def list_images(img_path) -> List[str]:
+    """Image files of a split, in the order ultralytics would list them."""
+    files = []
+    for p in img_path if isinstance(img_path, list) else [img_path]:
+        p = Path(p)
+        if p.is_dir():
+            files += [str(f) for f in p.rglob("*.*")]
+        elif p.is_file():
+            # A .txt list of images, relative entries start with ./
+            parent = str(p.parent) + os.sep
+            for line in p.read_text().strip().splitlines():
+                if line.startswith("./"):
+                    line = parent + line[2:]
+                files.append(line)
+    return sorted(f for f in files if f.split(".")[-1].lower() in IMG_FORMATS)
+
+
+def file_entries(files: List[str]) -> List[str]:
+    """One digest per image, over its path, size, mtime and label file."""
+    entries = []
+    for image, label in zip(files, img2label_paths(files)):
+        stat = os.stat(image)
+        digest = hashlib.sha256(
+            f"{image}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode()
+        )
+        if os.path.isfile(label):
+            digest.update(Path(label).read_bytes())
+        entries.append(digest.hexdigest())
+    return entries
+
+
+def dataset_hash(files: List[str], imgsz: int) -> str:
+    digest = hashlib.sha256(f"v{STORE_VERSION}:{imgsz}\n".encode())
+    for entry in file_entries(files):
+        digest.update(entry.encode())
+    return digest.hexdigest()[:16]
+
+
+def dataset_entries(data_yaml: str) -> Dict[str, List[str]]:
+    """``file_entries`` of every split, to tell appended data from changes."""
+    data = check_det_dataset(data_yaml)
+    return {
+        split: file_entries(list_images(data[split]))
+        for split in SPLITS
+        if data.get(split)
+    }
+
+
+def store_dir(img_path, imgsz: int) -> Path:
+    return Path(DATASET_CACHE_DIR) / dataset_hash(list_images(img_path), imgsz)
+
+
+# =========================================================
+# BUILD
+# =========================================================
+def read_labels(path: str) -> np.ndarray:
+    """Label rows (class, x, y, w, h), normalised; polygons become boxes."""
+    rows = []
+    if os.path.isfile(path):
+        for line in Path(path).read_text().splitlines():
+            values = [float(v) for v in line.split()]
+            if len(values) == 5:
+                rows.append(values)
+            elif len(values) > 5:
+                xs, ys = values[1::2], values[2::2]
+                x0, x1, y0, y1 = min(xs), max(xs), min(ys), max(ys)
+                rows.append([values[0], (x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def resize_like_ultralytics(image: np.ndarray, imgsz: int) -> np.ndarray:
+    # BaseDataset.load_image in 8.0.196: long side to imgsz, always linear
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        image = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def build_store(img_path, imgsz: int) -> Path:
+    files = list_images(img_path)
+    if not files:
+        raise RuntimeError(f"❌ No images found in {img_path}")
+    target = Path(DATASET_CACHE_DIR) / dataset_hash(files, imgsz)
+    if (target / "meta.json").exists():
+        print(f"♻️ {img_path}: store {target.name} is up to date")
+        return target
+
+    started = time.perf_counter()
+    staging = target.with_name(f".{target.name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    images = np.lib.format.open_memmap(
+        staging / "images.npy",
+        mode="w+",
+        dtype=np.uint8,
+        shape=(len(files), imgsz, imgsz, 3),
+    )
+    hw0 = np.zeros((len(files), 2), dtype=np.int32)
+    hw = np.zeros((len(files), 2), dtype=np.int32)
+
+    def decode(i: int) -> bool:
+        image = cv2.imread(files[i])
+        if image is None:
+            return False
+        hw0[i] = image.shape[:2]
+        image = resize_like_ultralytics(image, imgsz)
+        h, w = image.shape[:2]
+        hw[i] = (h, w)
+        images[i, :h, :w] = image
+        return True
+
+    cv2.setNumThreads(1)
+    with ThreadPoolExecutor(DECODE_WORKERS) as pool:
+        ok = np.array(list(pool.map(decode, range(len(files)))), dtype=bool)
+    images.flush()
+
+    labels = [read_labels(path) for path in img2label_paths(files)]
+    np.savez(
+        staging / "index.npz",
+        files=np.array(files),
+        ok=ok,
+        hw0=hw0,
+        hw=hw,
+        label_counts=np.array([len(lb) for lb in labels], dtype=np.int64),
+        labels=np.concatenate(labels) if labels else np.zeros((0, 5), np.float32),
+    )
+    meta = {
+        "source": str(img_path),
+        "imgsz": imgsz,
+        "images": len(files),
+        "unreadable": int((~ok).sum()),
+        "bytes": int(images.nbytes),
+        "created_at": time.time(),
+    }
+    (staging / "meta.json").write_text(json.dumps(meta, indent=2))
+    del images
+
+    shutil.rmtree(target, ignore_errors=True)
+    staging.rename(target)
+    elapsed = time.perf_counter() - started
+    print(
+        f"✅ {img_path}: {len(files)} images -> {target} "
+        f"({meta['bytes'] / 1024**3:.2f} GB) in {elapsed:.1f}s"
+    )
+    return target
+
+
+# =========================================================
+# TRAINING FROM THE STORE
+# =========================================================
+class MemmapDataset(YOLODataset):
+    """YOLODataset that reads pre-decoded pixels and labels from a store."""
+
+    def __init__(self, *args, store: Path, **kwargs):
+        self.store = store
+        index = np.load(store / "index.npz")
+        keep = index["ok"]
+        offsets = np.concatenate([[0], np.cumsum(index["label_counts"])])
+        self._slots = np.flatnonzero(keep)
+        self._index = {
+            "files": index["files"][keep].tolist(),
+            "hw0": index["hw0"][keep],
+            "hw": index["hw"][keep],
+            "labels": [
+                index["labels"][offsets[i] : offsets[i + 1]] for i in self._slots
+            ],
+        }
+        # Store position per file: rect mode (val) reorders im_files and labels
+        # by aspect ratio, so load_image can't use its index directly
+        self._position = {file: k for k, file in enumerate(self._index["files"])}
+        self._images = np.load(store / "images.npy", mmap_mode="r")
+        super().__init__(*args, **kwargs)
+
+    def get_labels(self) -> List[Dict]:
+        self.im_files = self._index["files"]
+        return [
+            {
+                "im_file": file,
+                "shape": tuple(int(v) for v in hw0),
+                "cls": labels[:, :1].copy(),
+                "bboxes": labels[:, 1:].copy(),
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            }
+            for file, hw0, labels in zip(
+                self._index["files"], self._index["hw0"], self._index["labels"]
+            )
+        ]
+
+    def load_image(self, i, rect_mode=True):
+        k = self._position[self.im_files[i]]
+        h, w = (int(v) for v in self._index["hw"][k])
+        image = np.array(self._images[self._slots[k], :h, :w])
+        if not rect_mode and not (h == w == self.imgsz):
+            image = cv2.resize(
+                image, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR
+            )
+        if self.augment:
+            # Mosaic draws its partner images from this buffer
+            self.buffer.append(i)
+            if len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return image, tuple(int(v) for v in self._index["hw0"][k]), image.shape[:2]
+
+
+class MemmapTrainer(DetectionTrainer):
+    """DetectionTrainer that uses a prepared store for every split that has one."""
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        store = store_dir(img_path, self.args.imgsz)
+        if not (store / "meta.json").exists():
+            print(f"⚠️ No prepared store for {img_path}, decoding images as usual")
+            return super().build_dataset(img_path, mode, batch)
+
+        print(f"📦 {mode}: reading pre-decoded images from {store}")
+        stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+        cfg = self.args
+        return MemmapDataset(
+            store=store,
+            img_path=img_path,
+            imgsz=cfg.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=cfg,
+            rect=cfg.rect or mode == "val",
+            cache=None,
+            single_cls=cfg.single_cls or False,
+            stride=stride,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            use_segments=False,
+            use_keypoints=False,
+            classes=cfg.classes,
+            data=self.data,
+            fraction=cfg.fraction if mode == "train" else 1.0,
+        )
+
+
+def prepared_splits(data_yaml: str, imgsz: int) -> Dict[str, Optional[str]]:
+    """Store name per split, None where training would decode as usual."""
+    data = check_det_dataset(data_yaml)
+    stores = {}
+    for split in SPLITS:
+        if data.get(split):
+            store = store_dir(data[split], imgsz)
+            stores[split] = store.name if (store / "meta.json").exists() else None
+    return stores
+
+
+if __name__ == "__main__":
+    data = check_det_dataset(DATA_YAML)
+    print(f"🗂️ Preparing {DATA_YAML} at imgsz {IMGSZ} into {DATASET_CACHE_DIR}")
+    for split in SPLITS:
+        if data.get(split):
+            build_store(data[split], IMGSZ)
+    print("🎉 Dataset prepared")
@@ -1,5 +1,33 @@
+"""
+Register the latest training run and promote it to production, if it is
+not slower, heavier or less accurate than the current production model.
+
+The promotion gate benchmarks the candidate version and the version behind
+the `production` alias on the same held-out images (GATE_DATA_YAML /
+GATE_SPLIT, the "test" split by default: val picked best.pt, so it isn't
+held out) with scripts/benchmark_backends.py, one subprocess per model so
+its peak RSS is the model's own, each at the imgsz its run was trained
+with: CPU latency p50/p99, throughput per batch size, peak RSS and mAP.
+Every figure for both models, the thresholds and the verdict are logged to
+the candidate's MLflow run (gate_* metrics and promotion_gate.json). The
+alias only moves when every check passes; otherwise the script exits
+non-zero and production stays where it is.
+
+Usage:
+    python scripts/register_model.py
+"""
+
+import json
 import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
 
+# =========================================================
+# CONFIG
+# =========================================================
 # Use environment variables with localhost as default
 MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
 MINIO_ENDPOINT = os.getenv("MLFLOW_S3_ENDPOINT_URL", "http://localhost:9000")
@@ -11,8 +39,36 @@ os.environ["MLFLOW_S3_ENDPOINT_URL"] = MINIO_ENDPOINT
 os.environ["AWS_ACCESS_KEY_ID"] = AWS_ACCESS_KEY_ID
 os.environ["AWS_SECRET_ACCESS_KEY"] = AWS_SECRET_ACCESS_KEY
 
-import mlflow
-from mlflow.tracking import MlflowClient
+import mlflow  # noqa: E402
+from mlflow.entities import Metric  # noqa: E402
+from mlflow.tracking import MlflowClient  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from benchmark_backends import find_artifacts  # noqa: E402
+
+MODEL_NAME = "road-mark-yolo"
+MODEL_ALIAS = "production"
+
+# Run to register (the DAG passes it when the pipeline reuses an earlier
+# run); defaults to the latest run of the experiment
+REGISTER_RUN_ID = os.getenv("REGISTER_RUN_ID", "").strip()
+
+GATE_ENABLED = os.getenv("GATE_ENABLED", "true").lower() == "true"
+# Backend the API serves (MODEL_BACKEND); .pt when either model lacks it
+GATE_BACKEND = os.getenv("GATE_BACKEND", os.getenv("MODEL_BACKEND", "pt"))
+# Held-out images both models are measured on; training never saw them nor
+# chose best.pt on them (that is what val is for)
+GATE_DATA_YAML = os.getenv("GATE_DATA_YAML", os.getenv("DATA_YAML", "data/data.yaml"))
+GATE_SPLIT = os.getenv("GATE_SPLIT", "test")
+# benchmark_backends' default, for runs that didn't log imgsz
+DEFAULT_IMGSZ = 480
+# Allowed regressions of the candidate relative to production
+MAX_LATENCY_INCREASE = float(os.getenv("GATE_MAX_LATENCY_INCREASE", "0.10"))
+MAX_THROUGHPUT_DROP = float(os.getenv("GATE_MAX_THROUGHPUT_DROP", "0.10"))
+MAX_RSS_INCREASE = float(os.getenv("GATE_MAX_RSS_INCREASE", "0.15"))
+# Absolute mAP50-95 points the candidate may lose
+MAX_MAP_DROP = float(os.getenv("GATE_MAX_MAP_DROP", "0.005"))
 
 mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
 client = MlflowClient()
@@ -20,18 +76,231 @@ client = MlflowClient()
 print(f"📍 MLflow Tracking URI: {MLFLOW_TRACKING_URI}")
 print(f"📍 MinIO Endpoint: {MINIO_ENDPOINT}")
 
-exp = client.get_experiment_by_name("road-mark-yolo")
-run = client.search_runs(
-    [exp.experiment_id], order_by=["attributes.start_time DESC"], max_results=1
-)[0]
 
-model_uri = f"runs:/{run.info.run_id}/model"
+# =========================================================
+# BENCHMARK
+# =========================================================
+def weights_dir(version: str, dst: str) -> Path:
+    """Download a model version; returns the directory holding its best.pt."""
+    local = mlflow.artifacts.download_artifacts(
+        artifact_uri=f"models:/{MODEL_NAME}/{version}", dst_path=dst
+    )
+    pt_files = sorted(Path(local).rglob("*.pt"))
+    if not pt_files:
+        raise RuntimeError(f"❌ No .pt file in version {version}")
+    return pt_files[0].parent
+
+
+def version_imgsz(version: str) -> int:
+    """The imgsz the version's run trained (and so serves) at."""
+    run_id = client.get_model_version(MODEL_NAME, version).run_id
+    return int(client.get_run(run_id).data.params.get("imgsz", DEFAULT_IMGSZ))
+
+
+def check_split():
+    from ultralytics.data.utils import check_det_dataset
+
+    if not check_det_dataset(GATE_DATA_YAML).get(GATE_SPLIT):
+        raise SystemExit(
+            f"❌ {GATE_DATA_YAML} has no '{GATE_SPLIT}' split; the promotion "
+            "gate needs held-out images (set GATE_SPLIT)"
+        )
+    if GATE_SPLIT == "val":
+        print("⚠️ Gating on val, which picked best.pt: it is not held out")
+
+
+def benchmark(weights: Path, backend: str, imgsz: int) -> dict:
+    """Run benchmark_backends.py on one artifact in its own process."""
+    output = weights.parent / f"benchmark_{backend}.json"
+    env = {
+        **os.environ,
+        "IMGSZ": str(imgsz),
+        "DATA_YAML": GATE_DATA_YAML,
+        "BENCH_SPLIT": GATE_SPLIT,
+        "BENCH_BACKENDS": backend,
+        "BENCH_OUTPUT": str(output),
+    }
+    script = Path(__file__).resolve().parent / "benchmark_backends.py"
+    process = subprocess.Popen([sys.executable, str(script), str(weights)], env=env)
+    # wait4 reports the usage of this child alone, unlike RUSAGE_CHILDREN
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"❌ Benchmark of {weights} failed")
+
+    report = json.loads(output.read_text())[backend]
+    report["peak_rss_mb"] = usage.ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+    report["imgsz"] = imgsz
+    return report
+
+
+def flatten(report: dict) -> dict:
+    metrics = {
+        k: v for k, v in report.items() if k != "throughput_images_per_second"
+    }
+    for batch_size, value in report["throughput_images_per_second"].items():
+        metrics[f"throughput_bs{batch_size}"] = value
+    return {k: v for k, v in metrics.items() if v is not None}
+
+
+# =========================================================
+# GATE
+# =========================================================
+def compare(candidate: dict, production: dict) -> list:
+    """One entry per check: the figures, the limit and whether it passed."""
+    checks = []
+
+    def check(name, value, baseline, limit, passed):
+        checks.append(
+            {
+                "check": name,
+                "candidate": value,
+                "production": baseline,
+                "limit": limit,
+                "passed": passed,
+            }
+        )
+
+    for key in ("latency_p50_ms", "latency_p99_ms"):
+        limit = production[key] * (1 + MAX_LATENCY_INCREASE)
+        check(key, candidate[key], production[key], limit, candidate[key] <= limit)
+
+    for batch_size, base in production["throughput_images_per_second"].items():
+        value = candidate["throughput_images_per_second"].get(batch_size)
+        if base is None or value is None:
+            continue
+        limit = base * (1 - MAX_THROUGHPUT_DROP)
+        check(f"throughput_bs{batch_size}", value, base, limit, value >= limit)
+
+    limit = production["peak_rss_mb"] * (1 + MAX_RSS_INCREASE)
+    check(
+        "peak_rss_mb",
+        candidate["peak_rss_mb"],
+        production["peak_rss_mb"],
+        limit,
+        candidate["peak_rss_mb"] <= limit,
+    )
+
+    if production.get("map50_95") is None:
+        print("⚠️ Production mAP unavailable, skipping the accuracy check")
+    else:
+        value = candidate.get("map50_95")
+        limit = production["map50_95"] - MAX_MAP_DROP
+        check("map50_95", value, production["map50_95"], limit, (value or 0) >= limit)
+    return checks
+
+
+def production_version():
+    try:
+        return client.get_model_version_by_alias(MODEL_NAME, MODEL_ALIAS)
+    except Exception:
+        return None
+
+
+def promotion_gate(run_id: str, version: str) -> bool:
+    current = production_version()
+    if current is not None and current.version == str(version):
+        print(f"♻️ Version {version} is already {MODEL_ALIAS}")
+        return True
+
+    check_split()
+    with tempfile.TemporaryDirectory() as tmp:
+        candidate_dir = weights_dir(version, f"{tmp}/candidate")
+        production_dir = (
+            weights_dir(current.version, f"{tmp}/production") if current else None
+        )
+
+        backend = GATE_BACKEND
+        for d in filter(None, (candidate_dir, production_dir)):
+            if backend not in find_artifacts(d):
+                print(f"⚠️ No {backend} artifact in {d}, gating on .pt")
+                backend = "pt"
+
+        imgsz = version_imgsz(version)
+        print(f"⏱️ Benchmarking candidate version {version} ({backend}, {imgsz})")
+        candidate = benchmark(candidate_dir, backend, imgsz)
+        production = None
+        if current is not None:
+            imgsz = version_imgsz(current.version)
+            print(
+                f"⏱️ Benchmarking {MODEL_ALIAS} version {current.version} "
+                f"({backend}, {imgsz})"
+            )
+            production = benchmark(production_dir, backend, imgsz)
+
+    checks = compare(candidate, production) if production else []
+    passed = all(c["passed"] for c in checks)
+
+    now = int(time.time() * 1000)
+    client.log_batch(
+        run_id,
+        metrics=[
+            Metric(f"gate_{name}_{key}", value, now, 0)
+            for name, report in (("candidate", candidate), ("production", production))
+            if report
+            for key, value in flatten(report).items()
+        ],
+    )
+    client.log_dict(
+        run_id,
+        {
+            "candidate_version": str(version),
+            "production_version": current.version if current else None,
+            "backend": backend,
+            "data": GATE_DATA_YAML,
+            "split": GATE_SPLIT,
+            "candidate": candidate,
+            "production": production,
+            "checks": checks,
+            "passed": passed,
+        },
+        "promotion_gate.json",
+    )
+    verdict = "passed" if passed else "failed"
+    client.set_tag(run_id, "promotion_gate", verdict)
+    client.set_model_version_tag(MODEL_NAME, version, "promotion_gate", verdict)
+
+    for c in checks:
+        print(
+            f"{'✅' if c['passed'] else '❌'} {c['check']}: candidate {c['candidate']}"
+            f" vs {MODEL_ALIAS} {c['production']} (limit {c['limit']:.4g})"
+        )
+    if current is None:
+        print(f"ℹ️ No {MODEL_ALIAS} version yet, nothing to compare against")
+    return passed
+
+
+# =========================================================
+# REGISTER & PROMOTE
+# =========================================================
+if REGISTER_RUN_ID:
+    run = client.get_run(REGISTER_RUN_ID)
+else:
+    exp = client.get_experiment_by_name("road-mark-yolo")
+    run = client.search_runs(
+        [exp.experiment_id], order_by=["attributes.start_time DESC"], max_results=1
+    )[0]
+
+existing = client.search_model_versions(
+    f"name = 'road-mark-yolo' and run_id = '{run.info.run_id}'"
+)
+if existing:
+    version = max(int(v.version) for v in existing)
+    print(f"♻️ Run {run.info.run_id} is already registered as version {version}")
+else:
+    model_uri = f"runs:/{run.info.run_id}/model"
+    version = mlflow.register_model(model_uri=model_uri, name="road-mark-yolo").version
 
-res = mlflow.register_model(model_uri=model_uri, name="road-mark-yolo")
+if GATE_ENABLED and not promotion_gate(run.info.run_id, str(version)):
+    raise SystemExit(
+        f"❌ Version {version} failed the promotion gate, "
+        f"{MODEL_ALIAS} is unchanged (see promotion_gate.json on the run)"
+    )
 
 # promote
+client.set_registered_model_alias(MODEL_NAME, MODEL_ALIAS, str(version))
 client.transition_model_version_stage(
-    name="road-mark-yolo", version=res.version, stage="Production"
+    name="road-mark-yolo", version=version, stage="Production"
 )
 
-print("Registered Production:", res.version)
+print("Registered Production:", version)
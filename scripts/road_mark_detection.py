@@ -1,18 +1,332 @@
-# train.py
+"""
+Train YOLO on the road mark dataset.
+
+Hyperparameters come from TRAIN_CONFIG (a YAML file of ultralytics train
+arguments, optional) with TRAIN_* environment variables on top. Dataloader
+workers, batch size and torch threads default to what the machine's cores
+and free RAM allow (within the container's cgroup CPU and memory limits, so
+parallel sweep trials each size for their own share), and
+TRAIN_CACHE=ram|disk keeps decoded images in memory or as .npy files next
+to the dataset so later epochs skip JPEG decoding. Splits that
+scripts/prepare_dataset.py has already turned into a memory-mapped store
+are read from it instead (TRAIN_PREPARED=false to opt out).
+
+Every epoch records how long the training loop waited on the dataloader
+versus ran forward/backward, and the resolved arguments plus those timings
+are written to <run dir>/train_config.json, which scripts/log_model.py logs
+to MLflow, next to dataset_entries.json (one digest per image).
+
+In the Airflow pipeline PIPELINE_PLAN carries the plan of
+scripts/pipeline_plan.py: its fingerprints are recorded with the run, and a
+warm_start plan trains from the production weights instead of the base
+model (for WARM_START_EPOCHS epochs, if set).
+"""
+
+import json
+import math
+import os
+import platform
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import psutil
+import torch
+import yaml
 from ultralytics import YOLO
+from ultralytics.cfg import DEFAULT_CFG_DICT
+
+from prepare_dataset import MemmapTrainer, dataset_entries, prepared_splits
+
+# =========================================================
+# CONFIG
+# =========================================================
+CONFIG_PATH = os.getenv("TRAIN_CONFIG")
+
+DEFAULTS = {
+    "model": "weights/yolov8n.pt",
+    "data": "data/data.yaml",
+    "epochs": 2,
+    "imgsz": 480,
+    "batch": None,  # auto
+    "workers": None,  # auto
+    "cache": False,
+    "device": "cpu",
+    "project": "runs/detect",
+    "name": "train",
+    "exist_ok": False,
+}
+
+# TRAIN_<NAME> overrides the train argument <name> (any ultralytics train
+# setting); values are parsed as YAML scalars
+ENV_PREFIX = "TRAIN_"
+
+# Share of the free RAM the auto batch size may plan for, and a rough
+# training footprint per image (activations and gradients of a small YOLO,
+# in multiples of the float32 input tensor)
+RAM_BUDGET = float(os.getenv("TRAIN_RAM_BUDGET", "0.5"))
+BYTES_PER_INPUT_FLOAT = 60
+MAX_AUTO_BATCH = 64
+MAX_AUTO_WORKERS = 16
+
+USE_PREPARED = os.getenv("TRAIN_PREPARED", "true").lower() == "true"
+
+PIPELINE_PLAN = json.loads(os.getenv("PIPELINE_PLAN") or "{}")
+WARM_START_EPOCHS = int(os.getenv("WARM_START_EPOCHS", "0"))
+
+
+def load_config() -> dict:
+    config = dict(DEFAULTS)
+    if CONFIG_PATH:
+        with open(CONFIG_PATH) as f:
+            config.update(yaml.safe_load(f) or {})
+    for key, value in os.environ.items():
+        name = key[len(ENV_PREFIX) :].lower()
+        if not key.startswith(ENV_PREFIX):
+            continue
+        if name in DEFAULTS or name in DEFAULT_CFG_DICT:
+            config[name] = yaml.safe_load(value)
+    config["cache"] = config["cache"] or False
+    return config
+
+
+# =========================================================
+# AUTO-SIZING
+# =========================================================
+def cgroup_cpus() -> Optional[float]:
+    """CPU quota of this container (docker --cpus), None when unlimited."""
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1
+        quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+        period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def cgroup_memory_available() -> Optional[int]:
+    """Bytes left under this container's memory limit, None when unlimited."""
+    for limit_file, usage_file in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        (
+            "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+            "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        ),
+    ):
+        try:
+            limit = Path(limit_file).read_text().strip()
+            # cgroup v1 reports "unlimited" as a huge number
+            if limit == "max" or int(limit) >= 1 << 60:
+                return None
+            return max(0, int(limit) - int(Path(usage_file).read_text()))
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpus()
+    return max(1, min(cpus, int(quota))) if quota else cpus
+
+
+def dataset_images(data_yaml: str) -> int:
+    """Training image count, for sizing the RAM cache (0 if unknown)."""
+    try:
+        from ultralytics.data.utils import check_det_dataset
+
+        train = check_det_dataset(data_yaml)["train"]
+        roots = train if isinstance(train, list) else [train]
+        return sum(
+            1
+            for root in roots
+            for p in Path(root).rglob("*")
+            if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".bmp")
+        )
+    except Exception as e:
+        print(f"⚠️ Could not count training images: {e}")
+        return 0
+
+
+def auto_size(config: dict) -> dict:
+    cpus = available_cpus()
+    free = psutil.virtual_memory().available
+    cgroup_free = cgroup_memory_available()
+    if cgroup_free is not None:
+        free = min(free, cgroup_free)
+    imgsz = int(config["imgsz"])
+    sizing = {"cpus": cpus, "ram_available_mb": free // 1024**2}
+
+    budget = free * RAM_BUDGET
+    if config["cache"] in (True, "ram"):
+        # ultralytics keeps every resized training image in memory
+        cache_bytes = dataset_images(config["data"]) * imgsz * imgsz * 3
+        sizing["ram_cache_mb"] = cache_bytes // 1024**2
+        budget -= cache_bytes
+
+    if config["workers"] is None:
+        # One core stays with the training loop itself
+        config["workers"] = max(0, min(cpus - 1, MAX_AUTO_WORKERS))
+
+    if config["batch"] is None:
+        per_image = imgsz * imgsz * 3 * 4 * BYTES_PER_INPUT_FLOAT
+        # Each worker also holds a couple of collated batches in flight
+        per_image += imgsz * imgsz * 3 * 2 * max(1, config["workers"])
+        fit = max(1, int(budget // per_image))
+        config["batch"] = max(2, 2 ** int(math.log2(min(fit, MAX_AUTO_BATCH))))
+    # ultralytics never starts more workers than the batch size
+    config["workers"] = min(config["workers"], int(config["batch"]))
+
+    sizing["workers"], sizing["batch"] = config["workers"], config["batch"]
+    # torch sizes its pool from the host's cores, not the container's quota
+    sizing["torch_threads"] = cpus
+    return sizing
+
+
+# =========================================================
+# DATA-WAIT VS COMPUTE TIMING
+# =========================================================
+class EpochTimer:
+    """
+    Split each epoch into time spent waiting for the next batch (decode,
+    augmentation, collation) and time spent in forward/backward/step, plus
+    validation. A high data-wait share means more workers or caching help.
+    """
+
+    def __init__(self):
+        self.epochs = []
+        self._mark = 0.0
+
+    def on_train_epoch_start(self, trainer):
+        self.data_wait = self.compute = 0.0
+        self.batches = 0
+        self._mark = time.perf_counter()
+
+    def on_train_batch_start(self, trainer):
+        now = time.perf_counter()
+        self.data_wait += now - self._mark
+        self._mark = now
+
+    def on_train_batch_end(self, trainer):
+        now = time.perf_counter()
+        self.compute += now - self._mark
+        self.batches += 1
+        self._mark = now
+
+    def on_train_epoch_end(self, trainer):
+        self._train_end = time.perf_counter()
+
+    def on_fit_epoch_end(self, trainer):
+        train_seconds = self.data_wait + self.compute
+        epoch = {
+            "epoch": trainer.epoch + 1,
+            "batches": self.batches,
+            "data_wait_seconds": self.data_wait,
+            "compute_seconds": self.compute,
+            "val_seconds": time.perf_counter() - self._train_end,
+            "data_wait_fraction": (
+                self.data_wait / train_seconds if train_seconds else 0.0
+            ),
+        }
+        self.epochs.append(epoch)
+        print(
+            f"⏱️ Epoch {epoch['epoch']}: data wait {self.data_wait:.1f}s "
+            f"({epoch['data_wait_fraction']:.0%}), compute {self.compute:.1f}s, "
+            f"val {epoch['val_seconds']:.1f}s"
+        )
+
+    def register(self, model: YOLO):
+        for event in (
+            "on_train_epoch_start",
+            "on_train_batch_start",
+            "on_train_batch_end",
+            "on_train_epoch_end",
+            "on_fit_epoch_end",
+        ):
+            model.add_callback(event, getattr(self, event))
+
+
+# =========================================================
+# TRAIN
+# =========================================================
+def train(config: dict, callbacks: Optional[Dict[str, Callable]] = None) -> dict:
+    """Train with ``config``; returns the report written to train_config.json."""
+    config = dict(config)
+    sizing = auto_size(config)
+    torch.set_num_threads(sizing["torch_threads"])
+    print(f"🧮 Sizing: {json.dumps(sizing)}")
+    print(f"🚀 Training with: {json.dumps(config, default=str)}")
+
+    prepared = {}
+    if USE_PREPARED and not config["cache"]:
+        prepared = prepared_splits(config["data"], int(config["imgsz"]))
+        print(f"📦 Prepared stores: {json.dumps(prepared)}")
+
+    model_path = config.pop("model")
+    model = YOLO(model_path)
+    timer = EpochTimer()
+    timer.register(model)
+    for event, callback in (callbacks or {}).items():
+        model.add_callback(event, callback)
+
+    started = time.time()
+    if any(prepared.values()):
+        model.train(trainer=MemmapTrainer, **config)
+    else:
+        model.train(**config)
+    save_dir = Path(model.trainer.save_dir)
+
+    (save_dir / "dataset_entries.json").write_text(
+        json.dumps(dataset_entries(config["data"]))
+    )
+    report = {
+        "save_dir": str(save_dir),
+        "plan": PIPELINE_PLAN.get("action"),
+        "fingerprints": PIPELINE_PLAN.get("fingerprints"),
+        "warm_start_from": PIPELINE_PLAN.get("warm_start_from"),
+        "args": {"model": model_path, **config},
+        "sizing": sizing,
+        "prepared_stores": prepared,
+        "host": {"platform": platform.platform(), "python": platform.python_version()},
+        "train_seconds": time.time() - started,
+        "epochs": timer.epochs,
+    }
+    (save_dir / "train_config.json").write_text(
+        json.dumps(report, indent=2, default=str)
+    )
+    print(f"✅ Train done at: {save_dir}")
+    return report
+
+
+def warm_start_weights(model_uri: str) -> str:
+    import mlflow
+
+    local_dir = mlflow.artifacts.download_artifacts(
+        artifact_uri=model_uri, dst_path="runs/warm_start"
+    )
+    pt_files = sorted(Path(local_dir).rglob("best.pt")) or sorted(
+        Path(local_dir).rglob("*.pt")
+    )
+    if not pt_files:
+        raise RuntimeError(f"❌ No .pt file in {model_uri}")
+    print(f"🌡️ Warm start from {model_uri}: {pt_files[0]}")
+    return str(pt_files[0])
+
 
-model = YOLO("weights/yolov8n.pt")
-
-results = model.train(
-    data="data/data.yaml",
-    epochs=2,
-    imgsz=480,
-    batch=2,
-    workers=0,
-    device="cpu",
-    project="runs/detect",
-    name="train",
-    exist_ok=False,
-)
-
-print(f"✅ Train done at: {results.save_dir}")
+if __name__ == "__main__":
+    config = load_config()
+    if PIPELINE_PLAN.get("action") == "warm_start":
+        config["model"] = warm_start_weights(PIPELINE_PLAN["warm_start_from"])
+        if WARM_START_EPOCHS:
+            config["epochs"] = WARM_START_EPOCHS
+    train(config)
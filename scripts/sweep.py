@@ -0,0 +1,235 @@
+"""
+Hyperparameter sweep steps, run by the hyperparameter_sweep DAG.
+
+    python scripts/sweep.py start    create the parent sweep run
+    python scripts/sweep.py trial    train one configuration (TRAIN_* env)
+    python scripts/sweep.py select   pick the best trial
+
+Each trial is an MLflow child run of SWEEP_PARENT_RUN_ID with its train
+arguments as params and validation metrics per epoch. After
+SWEEP_MIN_EPOCHS a trial whose SWEEP_METRIC is worse than the median of the
+other trials at the same epoch is stopped early (median stopping rule).
+`select` ranks the finished trials by their best SWEEP_METRIC, records the
+winner on the parent run and prints its run directory, which the DAG hands
+to log_model.py as TRAIN_DIR.
+
+`start` and `select` print their result as the last line, so Airflow picks
+it up as the task's XCom.
+"""
+
+import os
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# =========================================================
+# CONFIG
+# =========================================================
+MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
+MINIO_ENDPOINT = os.getenv("MLFLOW_S3_ENDPOINT_URL", "http://localhost:9000")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "minio")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "minio123")
+
+os.environ.update(
+    {
+        "MLFLOW_S3_ENDPOINT_URL": MINIO_ENDPOINT,
+        "AWS_ACCESS_KEY_ID": AWS_ACCESS_KEY_ID,
+        "AWS_SECRET_ACCESS_KEY": AWS_SECRET_ACCESS_KEY,
+    }
+)
+
+import mlflow  # noqa: E402
+from mlflow.entities import Metric, Param  # noqa: E402
+from mlflow.tracking import MlflowClient  # noqa: E402
+
+EXPERIMENT_NAME = "road-mark-yolo"
+
+PARENT_RUN_ID = os.getenv("SWEEP_PARENT_RUN_ID")
+# An ultralytics validation metric, named as MLflow stores it (no brackets)
+METRIC = os.getenv("SWEEP_METRIC", "metrics/mAP50-95B")
+MODE = os.getenv("SWEEP_MODE", "max")  # max or min
+MIN_EPOCHS = int(os.getenv("SWEEP_MIN_EPOCHS", "3"))
+# Compare against the median only once this many other trials got as far
+MIN_PEERS = int(os.getenv("SWEEP_MIN_PEERS", "2"))
+
+SCORE = "sweep_score"
+
+mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+client = MlflowClient()
+
+
+def metric_name(key: str) -> str:
+    # MLflow rejects brackets, e.g. "metrics/mAP50-95(B)"
+    return re.sub(r"[()]", "", key)
+
+
+def better(a: float, b: float) -> bool:
+    return a > b if MODE == "max" else a < b
+
+
+def trials() -> list:
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    return client.search_runs(
+        [experiment.experiment_id],
+        filter_string=f"tags.mlflow.parentRunId = '{PARENT_RUN_ID}'",
+        max_results=1000,
+    )
+
+
+# =========================================================
+# START
+# =========================================================
+def start():
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    experiment_id = (
+        experiment.experiment_id
+        if experiment
+        else client.create_experiment(EXPERIMENT_NAME)
+    )
+    run = client.create_run(
+        experiment_id,
+        run_name=f"sweep-{time.strftime('%Y%m%d-%H%M%S')}",
+        tags={"sweep": "parent"},
+    )
+    client.log_batch(
+        run.info.run_id,
+        params=[
+            Param("sweep_metric", METRIC),
+            Param("sweep_mode", MODE),
+            Param("sweep_min_epochs", str(MIN_EPOCHS)),
+        ],
+    )
+    print(f"🧪 Sweep parent run {run.info.run_id}")
+    print(run.info.run_id)
+
+
+# =========================================================
+# TRIAL
+# =========================================================
+class MedianStopper:
+    """Log each epoch's metrics to the child run and stop poor trials."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.best = None
+        self.pruned_at = None
+
+    def peer_values(self, epoch: int) -> list:
+        values = []
+        for run in trials():
+            if run.info.run_id == self.run_id:
+                continue
+            history = client.get_metric_history(run.info.run_id, METRIC)
+            values += [m.value for m in history if m.step == epoch]
+        return values
+
+    def on_fit_epoch_end(self, trainer):
+        epoch = trainer.epoch + 1
+        now = int(time.time() * 1000)
+        metrics = {metric_name(k): float(v) for k, v in trainer.metrics.items()}
+        client.log_batch(
+            self.run_id,
+            metrics=[Metric(k, v, now, epoch) for k, v in metrics.items()],
+        )
+
+        value = metrics.get(METRIC)
+        if value is None:
+            return
+        if self.best is None or better(value, self.best):
+            self.best = value
+        if epoch < MIN_EPOCHS:
+            return
+
+        peers = self.peer_values(epoch)
+        if len(peers) < MIN_PEERS:
+            return
+        median = statistics.median(peers)
+        if better(median, value):
+            print(
+                f"✂️ Stopping at epoch {epoch}: {METRIC}={value:.4f} is worse "
+                f"than the median {median:.4f} of {len(peers)} other trial(s)"
+            )
+            self.pruned_at = epoch
+            trainer.stop = True
+
+
+def trial():
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from road_mark_detection import load_config, train
+
+    from ultralytics.utils import SETTINGS
+
+    # Trials log to their child run themselves
+    SETTINGS.update({"mlflow": False})
+
+    config = load_config()
+    parent = client.get_run(PARENT_RUN_ID)
+    run = client.create_run(
+        parent.info.experiment_id,
+        run_name=str(config["name"]),
+        tags={"mlflow.parentRunId": PARENT_RUN_ID, "sweep": "trial"},
+    )
+    run_id = run.info.run_id
+    client.log_batch(
+        run_id,
+        params=[Param(k, str(v)[:500]) for k, v in config.items()],
+    )
+    print(f"🧪 Trial {config['name']} -> child run {run_id}")
+
+    stopper = MedianStopper(run_id)
+    try:
+        report = train(config, {"on_fit_epoch_end": stopper.on_fit_epoch_end})
+    except Exception:
+        client.set_terminated(run_id, "FAILED")
+        raise
+
+    client.set_tag(run_id, "train_dir", report["save_dir"])
+    client.set_tag(run_id, "pruned", str(stopper.pruned_at is not None).lower())
+    if stopper.pruned_at is not None:
+        client.set_tag(run_id, "pruned_at_epoch", str(stopper.pruned_at))
+    if stopper.best is not None:
+        client.log_metric(run_id, SCORE, stopper.best)
+    client.log_metric(run_id, "train_seconds", report["train_seconds"])
+    client.set_terminated(run_id, "FINISHED")
+
+
+# =========================================================
+# SELECT
+# =========================================================
+def select():
+    finished = [
+        run
+        for run in trials()
+        if run.info.status == "FINISHED" and SCORE in run.data.metrics
+    ]
+    if not finished:
+        client.set_terminated(PARENT_RUN_ID, "FAILED")
+        raise RuntimeError("❌ No sweep trial finished with a score")
+
+    ranked = sorted(
+        finished, key=lambda run: run.data.metrics[SCORE], reverse=MODE == "max"
+    )
+    for run in ranked:
+        print(
+            f"  {run.info.run_name}: {SCORE}={run.data.metrics[SCORE]:.4f}"
+            f"{' (stopped early)' if run.data.tags.get('pruned') == 'true' else ''}"
+        )
+    best = ranked[0]
+    train_dir = best.data.tags["train_dir"]
+
+    client.set_tag(PARENT_RUN_ID, "best_run_id", best.info.run_id)
+    client.set_tag(PARENT_RUN_ID, "best_train_dir", train_dir)
+    client.log_metric(PARENT_RUN_ID, f"best_{SCORE}", best.data.metrics[SCORE])
+    client.log_metric(PARENT_RUN_ID, "trials_finished", len(finished))
+    client.set_terminated(PARENT_RUN_ID, "FINISHED")
+    print(f"🏆 Best trial {best.info.run_name} ({best.info.run_id}) at {train_dir}")
+    print(train_dir)
+
+
+if __name__ == "__main__":
+    steps = {"start": start, "trial": trial, "select": select}
+    if len(sys.argv) != 2 or sys.argv[1] not in steps:
+        raise SystemExit(f"Usage: python scripts/sweep.py {{{'|'.join(steps)}}}")
+    steps[sys.argv[1]]()